@@ -2,8 +2,8 @@
 Widgets Unlimited - A data warehousing simulation.
 
 demo1.py - Execute Widgets Unlimited's operations over a period of 4 days. Data create_only is restricted to tables
-involving products, customers and orders.  Customer data are transformed to the format of a customer dimension in a
-star schema.
+involving products, customers, orders, stores and store sales.  The data are transformed to the dimensions and the
+sales fact of a star schema.
 
 Core classes:
 
@@ -21,13 +21,19 @@ from model.customer import CustomerTable
 from model.customer_address import CustomerAddressTable
 from model.order import OrderTable
 from model.order_line_item import OrderLineItemTable
+from model.store import StoreTable
+from model.store_location import StoreLocationTable
+from model.store_sales import StoreSalesTable
 
 from operations.base import BaseSystem
 from operations.ecommerce import eCommerceSystem
+from operations.instore import InStoreSystem
 from operations.inventory import InventorySystem
 from operations.generator import DataGenerator, GeneratorRequest
 from operations.simulator import OperationsSimulator
 
+from warehouse.batch_checkpoint import EXTRACTED
+from warehouse.batch_pipeline import BatchPipeline
 from warehouse.data_warehouse import DataWarehouse
 
 # table metadata
@@ -36,6 +42,9 @@ CUSTOMER = CustomerTable()
 CUSTOMER_ADDRESS = CustomerAddressTable()
 ORDER = OrderTable()
 ORDER_LINE_ITEM = OrderLineItemTable()
+STORE = StoreTable()
+STORE_LOCATION = StoreLocationTable()
+STORE_SALES = StoreSalesTable()
 
 # create data generator
 data_generator = DataGenerator()
@@ -43,15 +52,17 @@ data_generator = DataGenerator()
 # create source systems
 e_commerce_system: BaseSystem = eCommerceSystem()
 inventory_system: BaseSystem = InventorySystem()
+in_store_system: BaseSystem = InStoreSystem()
 
 # Initialize simulator with data generator and source systems.  Allocate tables to source systems.
 operations_simulator = OperationsSimulator(
-    data_generator, [e_commerce_system, inventory_system]
+    data_generator, [e_commerce_system, inventory_system, in_store_system]
 )
 operations_simulator.add_tables(
     e_commerce_system, [CUSTOMER, CUSTOMER_ADDRESS, ORDER, ORDER_LINE_ITEM]
 )
 operations_simulator.add_tables(inventory_system, [PRODUCT])
+operations_simulator.add_tables(in_store_system, [STORE, STORE_LOCATION, STORE_SALES])
 
 # create data warehouse
 warehouse = DataWarehouse()
@@ -63,6 +74,8 @@ daily_operations = [
         GeneratorRequest(PRODUCT, n_inserts=500, n_updates=0),
         GeneratorRequest(CUSTOMER, n_inserts=200, n_updates=0),
         GeneratorRequest(CUSTOMER_ADDRESS, n_inserts=1, n_updates=0, link_parent=True),
+        GeneratorRequest(STORE, n_inserts=10, n_updates=0),
+        GeneratorRequest(STORE_LOCATION, n_inserts=1, n_updates=0, link_parent=True),
     ],
     [
         # day 2
@@ -71,6 +84,7 @@ daily_operations = [
         GeneratorRequest(CUSTOMER_ADDRESS, n_inserts=1, n_updates=0, link_parent=True),
         GeneratorRequest(ORDER, n_inserts=1000, n_updates=0),
         GeneratorRequest(ORDER_LINE_ITEM, n_inserts=5, n_updates=0, link_parent=True),
+        GeneratorRequest(STORE_SALES, n_inserts=500, n_updates=0),
     ],
     [
         # day 3
@@ -79,6 +93,8 @@ daily_operations = [
         GeneratorRequest(CUSTOMER_ADDRESS, n_inserts=0, n_updates=10),
         GeneratorRequest(ORDER, n_inserts=1000, n_updates=0),
         GeneratorRequest(ORDER_LINE_ITEM, n_inserts=3, n_updates=0, link_parent=True),
+        GeneratorRequest(STORE, n_inserts=0, n_updates=2),
+        GeneratorRequest(STORE_SALES, n_inserts=500, n_updates=20),
     ],
     [
         # day 4
@@ -87,15 +103,30 @@ daily_operations = [
     ],
 ]
 
-# Synchronously process generator_requests and extract and load in warehouse.
-for day, transactions in enumerate(daily_operations, start=1):
+
+def extract(day):
+    """Process the generator_requests of a day and extract them to the warehouse staging area"""
 
     print("-" * 60)
     print(f"Batch {day} starting")
     print("-" * 60)
 
-    operations_simulator.process(generator_requests=transactions, batch_id=day)
+    # a restarted warehouse (WAREHOUSE_RESTART=1) does not repeat the operations of a checkpointed day
+    checkpoints = warehouse.get_checkpoints()
+    if not checkpoints.is_complete(day, EXTRACTED):
+        operations_simulator.process(
+            generator_requests=daily_operations[day - 1], batch_id=day
+        )
+        checkpoints.record(day, EXTRACTED)
     warehouse.direct_extract(data_generator.get_connection(), batch_id=day)
-    warehouse.transform_load(batch_id=day)
+    return warehouse.get_staged_rows(day)
+
+
+# Pipeline the days: the operations and extraction of a day run while the previous day is transformed
+# and, with WAREHOUSE_WRITE_BEHIND=1, written to the warehouse.
+pipeline = BatchPipeline(extract, warehouse.transform_load, warehouse.get_writers())
+pipeline.run(range(1, len(daily_operations) + 1))
+warehouse.check_aggregates()
+warehouse.compact_export()  # with WAREHOUSE_EXPORT=1
 
 print("\ndemo1.py completed successfully.")
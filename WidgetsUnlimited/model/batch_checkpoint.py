@@ -0,0 +1,18 @@
+from .metadata import Table, Column
+
+
+class BatchCheckpointTable(Table):
+
+    NAME = "batch_checkpoint"
+
+    def __init__(self):
+        super().__init__(
+            BatchCheckpointTable.NAME,
+            # batch_id/step/processor, e.g. 3/written/customer_dimension
+            Column("checkpoint_key", "VARCHAR", primary_key=True),
+            Column("step", "VARCHAR"),  # extracted, staged, transformed or written
+            Column("processor", "VARCHAR"),  # empty for the steps of the whole batch
+            Column("completed_at", "TIMESTAMP"),
+            create_only=True,
+            indexes=[("batch_id",)],
+        )
@@ -9,17 +9,19 @@ class CustomerTable(Table):
         super().__init__(
             CustomerTable.NAME,
             Column("customer_id", "INTEGER", primary_key=True),
-            Column("customer_name", "VARCHAR"),
-            Column("customer_user_id", "VARCHAR"),
-            Column("customer_password", "VARCHAR"),
-            Column("customer_email", "VARCHAR", update=True),
-            Column("customer_referral_type", "VARCHAR", default="OA"),
-            Column("customer_sex", "VARCHAR", default="F"),
+            Column("customer_name", "VARCHAR", storage="string[pyarrow]"),
+            Column("customer_user_id", "VARCHAR", storage="string[pyarrow]"),
+            Column("customer_password", "VARCHAR", storage="string[pyarrow]"),
+            Column("customer_email", "VARCHAR", update=True, storage="string[pyarrow]"),
+            Column(
+                "customer_referral_type", "VARCHAR", default="OA", storage="category"
+            ),
+            Column("customer_sex", "VARCHAR", default="F", storage="category"),
             Column("customer_date_of_birth", "DATE"),
             Column("customer_loyalty_number", "INTEGER"),
-            Column("customer_credit_card_number", "VARCHAR"),
-            Column("customer_is_preferred", "BOOLEAN"),
-            Column("customer_is_active", "BOOLEAN"),
+            Column("customer_credit_card_number", "VARCHAR", storage="string[pyarrow]"),
+            Column("customer_is_preferred", "BOOLEAN", storage="boolean"),
+            Column("customer_is_active", "BOOLEAN", storage="boolean"),
             Column("customer_inserted_at", "TIMESTAMP", inserted_at=True),
             Column("customer_updated_at", "TIMESTAMP", updated_at=True),
         )
@@ -23,9 +23,10 @@ class CustomerAddressTable(Table):
                 255,
                 default="First Middle Last\n123 Snickersnack Lane\nBrooklyn, NY 11229",
                 update=True,
+                storage="string[pyarrow]",
             ),
             # Column("customer_temp_updateable", "VARCHAR", update=True),
-            Column("customer_address_type", "VARCHAR", default="S"),
+            Column("customer_address_type", "VARCHAR", default="S", storage="category"),
             Column("customer_address_inserted_at", "TIMESTAMP", inserted_at=True),
             Column("customer_address_updated_at", "TIMESTAMP", updated_at=True),
         )
@@ -13,41 +13,46 @@ class CustomerDimTable(Table):
             Column("effective_date", "DATE"),
             Column("expiration_date", "DATE"),
             Column("is_current_row", "BOOLEAN"),  # type 2 scd
+            Column("attribute_hash", "BIGINT"),  # hash of the customer columns
             # customer columns
-            Column("customer_key", "INTEGER"),  # natural key -- Add index
-            Column("name", "VARCHAR"),
-            Column("user_id", "VARCHAR"),
-            Column("password", "VARCHAR"),
-            Column("email", "VARCHAR"),
-            Column("referral_type", "VARCHAR"),  # I can decode this int->string
-            Column("sex", "VARCHAR"),  # ""
+            Column("customer_key", "INTEGER"),  # natural key
+            Column("name", "VARCHAR", storage="string[pyarrow]"),
+            Column("user_id", "VARCHAR", storage="string[pyarrow]"),
+            Column("password", "VARCHAR", storage="string[pyarrow]"),
+            Column("email", "VARCHAR", storage="string[pyarrow]"),
+            Column(
+                "referral_type", "VARCHAR", storage="category"
+            ),  # I can decode this int->string
+            Column("sex", "VARCHAR", storage="category"),  # ""
             Column("date_of_birth", "DATE"),
-            Column("age_cohort", "VARCHAR"),
+            Column("age_cohort", "VARCHAR", storage="category"),
             Column("loyalty_number", "INTEGER"),
-            Column("credit_card_number", "VARCHAR"),
+            Column("credit_card_number", "VARCHAR", storage="string[pyarrow]"),
             Column("is_preferred", "BOOLEAN"),
             Column("is_active", "BOOLEAN"),
             Column("activation_date", "DATE"),
             Column("deactivation_date", "DATE"),
             Column("start_date", "DATE"),
             Column("last_update_date", "DATE"),
-            Column("billing_name", "VARCHAR", 255),
+            Column("billing_name", "VARCHAR", 255, storage="string[pyarrow]"),
             Column(
                 "billing_street_number",
                 "VARCHAR",
+                storage="string[pyarrow]",
             ),
-            Column("billing_city", "VARCHAR", 255),
-            Column("billing_state", "VARCHAR", 255),
-            Column("billing_zip", "VARCHAR"),
+            Column("billing_city", "VARCHAR", 255, storage="string[pyarrow]"),
+            Column("billing_state", "VARCHAR", 255, storage="category"),
+            Column("billing_zip", "VARCHAR", storage="string[pyarrow]"),
             # Column("billing_last_update", "TIMESTAMP"),
             # Column("billing_number_of_updates", "INTEGER")  ,
-            Column("shipping_name", "VARCHAR", 255),
-            Column("shipping_street_number", "VARCHAR"),
-            Column("shipping_city", "VARCHAR", 255),
-            Column("shipping_state", "VARCHAR", 255),
-            Column("shipping_zip", "VARCHAR"),
+            Column("shipping_name", "VARCHAR", 255, storage="string[pyarrow]"),
+            Column("shipping_street_number", "VARCHAR", storage="string[pyarrow]"),
+            Column("shipping_city", "VARCHAR", 255, storage="string[pyarrow]"),
+            Column("shipping_state", "VARCHAR", 255, storage="category"),
+            Column("shipping_zip", "VARCHAR", storage="string[pyarrow]"),
             # Column("shipping_last_update", "TIMESTAMP"),
             # Column("shipping_number_of_updates", "INTEGER"),
             create_only=True,
             batch_id=False,
+            indexes=[("customer_key", "is_current_row")],  # current row lookups
         )
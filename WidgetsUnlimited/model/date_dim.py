@@ -0,0 +1,32 @@
+from .metadata import Table, Column
+
+
+class DateDimTable(Table):
+
+    NAME = "date_dim"
+
+    def __init__(self):
+        super().__init__(
+            DateDimTable.NAME,
+            Column("date_key", "INTEGER", primary_key=True),  # yyyymmdd, -1 unknown
+            Column("full_date", "DATE"),
+            Column("day_of_week", "INTEGER"),  # 1 (Monday) to 7
+            Column("day_name", "VARCHAR", storage="category"),
+            Column("day_of_month", "INTEGER"),
+            Column("day_of_year", "INTEGER"),
+            Column("week_of_year", "INTEGER"),  # ISO week
+            Column("month", "INTEGER"),
+            Column("month_name", "VARCHAR", storage="category"),
+            Column("quarter", "INTEGER"),
+            Column("year", "INTEGER"),
+            Column("fiscal_month", "INTEGER"),
+            Column("fiscal_quarter", "INTEGER"),
+            Column(
+                "fiscal_year", "INTEGER"
+            ),  # calendar year in which the fiscal year ends
+            Column("is_weekend", "BOOLEAN"),
+            Column("is_holiday", "BOOLEAN"),
+            Column("holiday_name", "VARCHAR", storage="category"),
+            create_only=True,
+            batch_id=False,
+        )
@@ -1,5 +1,6 @@
+import hashlib
 import random
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 
 class Column:
@@ -8,7 +9,7 @@ class Column:
     def __init__(
         self,
         column_name: str,  # sql name of the column
-        column_type: str,  # sql type (INTEGER, VARCHAR, FLOAT, DATE, BOOLEAN, TIMESTAMP)
+        column_type: str,  # sql type (INTEGER, BIGINT, VARCHAR, FLOAT, DATE, BOOLEAN, TIMESTAMP)
         column_length=None,  # optional column length (e.g. 200 for VARCHAR(200))
         primary_key: bool = False,  # column is primary key
         inserted_at: bool = False,  # column is the inserted_at column
@@ -20,6 +21,7 @@ class Column:
         parent_table: str = "",  # parent table from which to populate column
         parent_key: str = "",  # column within parent table (key) to populate column
         default: Any = None,  # default value for column
+        storage: str = None,  # pandas dtype overriding the type's (category, string[pyarrow], boolean)
     ):
 
         self._name = column_name
@@ -35,6 +37,7 @@ class Column:
         self._parent_table = parent_table
         self._parent_key = parent_key
         self._default = default
+        self._storage = storage
 
     def get_create_sql_text(self, db_types_dict) -> str:
         """
@@ -67,6 +70,9 @@ class Column:
     def get_type_length(self) -> str:
         return self._length
 
+    def get_storage(self) -> str:
+        return self._storage
+
     def is_primary_key(self) -> bool:
         return self._primary_key
 
@@ -110,7 +116,14 @@ class Column:
 class Table:
     """Database Table metadata (schema) used for DDL and data generation"""
 
-    def __init__(self, name: str, *columns: Column, create_only=False, batch_id=True):
+    def __init__(
+        self,
+        name: str,
+        *columns: Column,
+        create_only=False,
+        batch_id=True,
+        indexes: List[Tuple[str, ...]] = (),
+    ):
         """
         Prepare the Table class for use by the DataGenerator
 
@@ -119,14 +132,17 @@ class Table:
 
         :param name: sql name of the table
         :param columns: ordered Column objects comprising Table
-        :param create_only: Use Table only for create table and metadata, not data generation
+        :param create_only: Use Table only for create table and metadata, not data generation.  The
+        primary key of a create_only table may be composite (several primary_key columns).
         :param batch_id: Append a batch_id column to columns
+        :param indexes: secondary indexes, each a tuple of column names (created in mysql only)
         """
 
         self._name = name
         self._create_only = create_only
         self._batch_id = batch_id
         self._columns = [col for col in columns]
+        self._indexes = [tuple(index) for index in indexes]
         if self._batch_id:
             self._columns.append(Column("batch_id", "INTEGER", batch_id=True))
         primary_keys = [col.get_name() for col in columns if col.is_primary_key()]
@@ -134,9 +150,9 @@ class Table:
         updated_ats = [col.get_name() for col in columns if col.is_updated_at()]
         parent_keys = [col for col in columns if col.is_parent_key()]
 
-        if len(primary_keys) != 1:
+        if len(primary_keys) != 1 and not (self._create_only and primary_keys):
             raise Exception("Generator requires exactly one primary key.")
-        self._primary_key = primary_keys[0]
+        self._primary_keys = primary_keys
 
         if not self._create_only:
             if (len(inserted_ats), len(updated_ats)) != (1, 1):
@@ -187,13 +203,14 @@ class Table:
         # type mappings and default lengths for mysql
         mysql_types_dict = {
             "INTEGER": ("INT", None),
+            "BIGINT": ("BIGINT", None),
             "VARCHAR": ("VARCHAR", "80"),
             "FLOAT": ("DOUBLE", None),
             "DATE": ("DATE", None),
             "BOOLEAN": ("TINYINT", "1"),
             "TIMESTAMP": ("TIMESTAMP", "6"),
         }
-        return self.get_create_sql(mysql_types_dict)
+        return self.get_create_sql(mysql_types_dict, inline_indexes=True)
 
     def get_create_sql_postgres(self) -> str:
         """Returns SQL to create table for this class in postgresql"""
@@ -201,6 +218,7 @@ class Table:
         # type mappings and default lengths for postgres
         postgres_types_dict = {
             "INTEGER": ("INTEGER", None),
+            "BIGINT": ("BIGINT", None),
             "VARCHAR": ("VARCHAR", "80"),
             "FLOAT": ("FLOAT", "11"),
             "DATE": ("DATE", None),
@@ -209,11 +227,12 @@ class Table:
         }
         return self.get_create_sql(postgres_types_dict)
 
-    def get_create_sql(self, definition_dict):
+    def get_create_sql(self, definition_dict, inline_indexes=False):
         """
         Compose the text for CREATE TABLE to be executed on postgresql or mysql
 
         :param definition_dict: Mappings from Column.column_type to native SQL name plus optional column length
+        :param inline_indexes: Declare the secondary indexes within CREATE TABLE (mysql syntax)
         :return CREATE TABLE statement in print friendly format.
         """
 
@@ -224,9 +243,14 @@ class Table:
                 for col in self.get_columns()
             ]
         )
-        primary_key = f"\nPRIMARY KEY ({self.get_primary_key()}));"
+        indexes = ""
+        if inline_indexes:
+            indexes = "".join(
+                f"\nINDEX ({', '.join(index)})," for index in self.get_indexes()
+            )
+        primary_key = f"\nPRIMARY KEY ({', '.join(self.get_primary_keys())}));"
 
-        return create_table + columns + primary_key
+        return create_table + columns + indexes + primary_key
 
     def get_columns(self) -> List[Column]:
         """Return column objects"""
@@ -244,24 +268,53 @@ class Table:
         i = random.randint(0, len(self._update_columns) - 1)
         return self._update_columns[i]
 
-    def get_column_pandas_types(self) -> Dict[str, str]:
-        """Return a dictionary of column names and associated panda type for Dataframe.astype()"""
+    def get_column_pandas_types(self, storage: bool = True) -> Dict[str, str]:
+        """
+        Return a dictionary of column names and associated panda type for Dataframe.astype()
+
+        :param storage: apply the column storage hints (e.g. category for low cardinality strings, nullable
+        boolean) rather than the default type of each column type
+        """
 
         pd_types = {
             "INTEGER": "int64",
+            "BIGINT": "int64",
             "VARCHAR": "string",
             "FLOAT": "float64",
             "DATE": "datetime64[ns]",
             "BOOLEAN": "bool",
             "TIMESTAMP": "datetime64[ns]",
         }
-        return {col.get_name(): pd_types[col.get_type()] for col in self._columns}
+        return {
+            col.get_name(): (storage and col.get_storage()) or pd_types[col.get_type()]
+            for col in self._columns
+        }
+
+    def get_schema_fingerprint(self) -> str:
+        """Return a short hash of the column names and types, used to detect schema drift in stored data"""
+
+        schema_text = ",".join(
+            f"{col.get_name()}:{col.get_type()}" for col in self._columns
+        )
+        return hashlib.sha256(schema_text.encode()).hexdigest()[:16]
 
     def get_name(self) -> str:
         return self._name
 
+    def get_indexes(self) -> List[Tuple[str, ...]]:
+        return self._indexes
+
     def get_primary_key(self) -> str:
-        return self._primary_key
+        if len(self._primary_keys) != 1:
+            raise Exception(f"Table {self._name} has a composite primary key.")
+        return self._primary_keys[0]
+
+    def get_primary_keys(self) -> List[str]:
+        """Return the primary key columns, several for a composite key"""
+        return self._primary_keys
+
+    def get_inserted_at(self) -> str:
+        return self._inserted_at
 
     def get_updated_at(self) -> str:
         return self._updated_at
@@ -0,0 +1,36 @@
+from .metadata import Table, Column
+
+
+class ProductDimTable(Table):
+
+    NAME = "product_dim"
+
+    def __init__(self):
+        super().__init__(
+            ProductDimTable.NAME,
+            # dimension control
+            Column("surrogate_key", "INTEGER", primary_key=True),  # surrogate key
+            Column("effective_date", "DATE"),
+            Column("expiration_date", "DATE"),
+            Column("is_current_row", "BOOLEAN"),  # type 2 scd
+            Column("attribute_hash", "BIGINT"),  # hash of the product columns
+            # product columns
+            Column("product_key", "INTEGER"),  # natural key
+            Column("name", "VARCHAR", storage="string[pyarrow]"),
+            Column("description", "VARCHAR", storage="string[pyarrow]"),
+            Column("category", "VARCHAR", storage="category"),
+            Column("brand", "VARCHAR", storage="category"),
+            Column("preferred_supplier_key", "INTEGER"),
+            Column("unit_cost", "FLOAT"),
+            Column("length", "FLOAT"),
+            Column("width", "FLOAT"),
+            Column("height", "FLOAT"),
+            Column("introduced_date", "DATE"),
+            Column("introduced_date_key", "INTEGER"),  # date_dim
+            Column("is_discontinued", "BOOLEAN"),
+            Column("is_no_longer_offered", "BOOLEAN"),
+            Column("last_update_date", "DATE"),
+            create_only=True,
+            batch_id=False,
+            indexes=[("product_key", "is_current_row")],  # current row lookups
+        )
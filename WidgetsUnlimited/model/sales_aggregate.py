@@ -0,0 +1,38 @@
+from .metadata import Table, Column
+
+
+class DailyProductSalesTable(Table):
+
+    NAME = "daily_product_sales"
+
+    def __init__(self):
+        super().__init__(
+            DailyProductSalesTable.NAME,
+            Column("date_key", "INTEGER", primary_key=True),
+            Column("product_dim_key", "INTEGER", primary_key=True),
+            # measures
+            Column("sales_count", "INTEGER"),
+            Column("quantity", "INTEGER"),
+            Column("total_price", "FLOAT"),
+            create_only=True,
+            batch_id=False,
+        )
+
+
+class DailyCustomerCohortSalesTable(Table):
+
+    NAME = "daily_customer_cohort_sales"
+
+    def __init__(self):
+        super().__init__(
+            DailyCustomerCohortSalesTable.NAME,
+            Column("date_key", "INTEGER", primary_key=True),
+            # of the customer at the time of sale
+            Column("age_cohort", "VARCHAR", primary_key=True),
+            # measures
+            Column("sales_count", "INTEGER"),
+            Column("quantity", "INTEGER"),
+            Column("total_price", "FLOAT"),
+            create_only=True,
+            batch_id=False,
+        )
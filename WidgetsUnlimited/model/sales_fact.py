@@ -0,0 +1,28 @@
+from .metadata import Table, Column
+
+
+class SalesFactTable(Table):
+
+    NAME = "sales_fact"
+
+    def __init__(self):
+        super().__init__(
+            SalesFactTable.NAME,
+            Column("sales_key", "INTEGER", primary_key=True),  # surrogate key
+            # dimension keys, -1 without a matching dimension row
+            Column("date_key", "INTEGER"),  # yyyymmdd
+            Column("customer_dim_key", "INTEGER"),
+            Column("product_dim_key", "INTEGER"),
+            Column("store_dim_key", "INTEGER"),
+            # degenerate dimensions
+            Column("sales_channel", "VARCHAR", storage="category"),  # E-Commerce, Store
+            Column("source_id", "INTEGER"),  # order_line_item_id or store_sales_id
+            Column("order_id", "INTEGER", storage="Int64"),  # e-commerce only
+            # measures
+            Column("quantity", "INTEGER"),
+            Column("unit_price", "FLOAT"),
+            Column("total_price", "FLOAT"),
+            create_only=True,
+            batch_id=False,
+            indexes=[("sales_channel", "source_id")],  # lookup of the updated sales
+        )
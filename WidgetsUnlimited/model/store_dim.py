@@ -0,0 +1,36 @@
+from .metadata import Table, Column
+
+
+class StoreDimTable(Table):
+
+    NAME = "store_dim"
+
+    def __init__(self):
+        super().__init__(
+            StoreDimTable.NAME,
+            # dimension control
+            Column("surrogate_key", "INTEGER", primary_key=True),  # surrogate key
+            Column("effective_date", "DATE"),
+            Column("expiration_date", "DATE"),
+            Column("is_current_row", "BOOLEAN"),  # always current: type 1 scd
+            Column("attribute_hash", "BIGINT"),  # hash of the store columns
+            # store columns
+            Column("store_key", "INTEGER"),  # natural key
+            Column("name", "VARCHAR", storage="string[pyarrow]"),
+            Column("manager_name", "VARCHAR", storage="string[pyarrow]"),
+            Column("number_of_employees", "INTEGER"),
+            Column("opened_date", "DATE"),
+            Column("opened_date_key", "INTEGER"),  # date_dim
+            Column("closed_date", "DATE"),
+            Column("closed_date_key", "INTEGER"),  # date_dim, -1 while open
+            # store location columns
+            Column("street_address", "VARCHAR", storage="string[pyarrow]"),
+            Column("city", "VARCHAR", storage="string[pyarrow]"),
+            Column("state", "VARCHAR", storage="category"),
+            Column("zip_code", "VARCHAR", storage="string[pyarrow]"),
+            Column("sq_footage", "FLOAT"),
+            Column("last_update_date", "DATE"),
+            create_only=True,
+            batch_id=False,
+            indexes=[("store_key", "is_current_row")],  # current row lookups
+        )
@@ -0,0 +1,15 @@
+from .metadata import Table, Column
+
+
+class SurrogateKeyAllocationTable(Table):
+
+    NAME = "surrogate_key_allocation"
+
+    def __init__(self):
+        super().__init__(
+            SurrogateKeyAllocationTable.NAME,
+            Column("table_name", "VARCHAR", primary_key=True),  # dimension table
+            Column("next_key", "INTEGER"),  # first key not yet reserved
+            create_only=True,
+            batch_id=False,
+        )
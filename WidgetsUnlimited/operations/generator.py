@@ -10,6 +10,7 @@ from psycopg2.extensions import connection, cursor
 
 DEFAULT_INSERT_VALUES: Dict[str, object] = {
     "INTEGER": 98,
+    "BIGINT": 98,
     "VARCHAR": "AAA",
     "FLOAT": 5.0,
     "DATE": "2021-02-11 12:52:47",
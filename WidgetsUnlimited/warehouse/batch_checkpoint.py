@@ -0,0 +1,116 @@
+import threading
+from datetime import datetime
+from typing import Optional, Set
+
+from model.batch_checkpoint import BatchCheckpointTable
+
+# steps of a batch, in order
+EXTRACTED = "extracted"  # the source systems have produced the batch
+STAGED = "staged"  # the batch is in the stage area
+TRANSFORMED = "transformed"  # every processor has transformed the batch
+WRITTEN = "written"  # the writes of every processor are committed
+CHECKPOINT_STEPS = [EXTRACTED, STAGED, TRANSFORMED, WRITTEN]
+
+
+class BatchCheckpoints:
+    """
+    Durable record of the completed steps of each batch, in the batch_checkpoint table of the warehouse,
+    so that a restarted warehouse resumes a batch at its first incomplete step.
+
+    The steps of a whole batch are CHECKPOINT_STEPS.  Each processor also records the written step of a
+    batch under its own name once its writes are committed: a restart then only reruns the processors
+    that had not completed.  A processor recording its checkpoint on its own connection, before the
+    commit of its last write, makes the writes and the checkpoint one transaction.
+
+    Recording a checkpoint again is ignored, so every step may be retried.
+    """
+
+    def __init__(self, connection, recreate=True) -> None:
+        """
+        :param connection: mySQL connection, used only by this object
+        :param recreate: drop the checkpoints of an earlier run
+        """
+        self._connection = connection
+        self._table = BatchCheckpointTable()
+        # the connection is shared by the pipeline threads
+        self._lock = threading.Lock()
+
+        cur = self._connection.cursor()
+        if recreate:
+            cur.execute(f"DROP TABLE IF EXISTS {self._table.get_name()};")
+        cur.execute(self._table.get_create_sql_mysql())
+
+    def record(
+        self,
+        batch_id: int,
+        step: str,
+        processor: str = "",
+        last_batch_id: Optional[int] = None,
+        connection=None,
+    ) -> None:
+        """
+        Record a completed step of a batch (or inclusive range of batches)
+
+        :param batch_id: identifier of incremental batch
+        :param step: one of CHECKPOINT_STEPS
+        :param processor: name of the processor completing the step, empty for the whole batch
+        :param last_batch_id: optional last batch of an inclusive range of batches
+        :param connection: optional connection of the caller's transaction.  The caller commits;
+        otherwise the checkpoint is committed on the connection of this object.
+        :return: None
+        """
+        if step not in CHECKPOINT_STEPS:
+            raise Exception(f"Unknown checkpoint step {step}")
+
+        completed_at = datetime.now()
+        rows = [
+            (get_checkpoint_key(b, step, processor), b, step, processor, completed_at)
+            for b in range(batch_id, (last_batch_id or batch_id) + 1)
+        ]
+        query = (
+            f"INSERT IGNORE INTO {self._table.get_name()}"
+            " (checkpoint_key, batch_id, step, processor, completed_at)"
+            " VALUES (%s, %s, %s, %s, %s)"
+        )
+        if connection is not None:
+            connection.cursor().executemany(query, rows)
+            return
+        with self._lock:
+            self._connection.cursor().executemany(query, rows)
+            self._connection.commit()
+
+    def is_complete(self, batch_id: int, step: str, processor: str = "") -> bool:
+        """Return True when the step of a batch (of a processor, if given) was recorded"""
+        with self._lock:
+            cur = self._connection.cursor()
+            cur.execute(
+                f"SELECT COUNT(*) FROM {self._table.get_name()} WHERE checkpoint_key = %s;",
+                (get_checkpoint_key(batch_id, step, processor),),
+            )
+            count = cur.fetchone()[0]
+            self._connection.commit()  # end the read, so later reads see new checkpoints
+        return count > 0
+
+    def get_written_processors(self, batch_id: int) -> Set[str]:
+        """Return the names of the processors whose writes of a batch are committed"""
+        with self._lock:
+            cur = self._connection.cursor()
+            cur.execute(
+                f"SELECT processor FROM {self._table.get_name()}"
+                " WHERE batch_id = %s AND step = %s AND processor <> '';",
+                (batch_id, WRITTEN),
+            )
+            processors = {row[0] for row in cur.fetchall()}
+            self._connection.commit()
+        return processors
+
+    def get_first_incomplete_step(self, batch_id: int) -> Optional[str]:
+        """Return the first of CHECKPOINT_STEPS not completed by a batch, None when all are"""
+        for step in CHECKPOINT_STEPS:
+            if not self.is_complete(batch_id, step):
+                return step
+        return None
+
+
+def get_checkpoint_key(batch_id: int, step: str, processor: str = "") -> str:
+    return f"{batch_id}/{step}/{processor}"
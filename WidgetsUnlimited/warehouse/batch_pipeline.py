@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .write_behind import WriteBehind
+
+PIPELINE_QUEUE_SIZE = 1  # extracted batches waiting for transformation
+
+PIPELINE_STAGES = ["extract", "transform", "write"]
+
+
+class BatchPipeline:
+    """
+    Run a sequence of warehouse batches as a pipeline of three stages, so that the extraction of batch
+    N+1 and the transformation of batch N overlap with the mySQL writes of batch N-1:
+
+    extract -- produce and stage a batch, on the extraction thread
+    transform -- transform the staged batch (DataWarehouse.transform_load), on the calling thread
+    write -- the writes queued by the processors writing behind, on their WriteBehind threads
+
+    Each stage handles the batches one at a time in batch order, and every processor writes its
+    batches in order, so the updates of every key are applied in batch order.  Queues are bounded:
+    extraction runs at most queue_size batches ahead of transformation, and transformation blocks
+    when a processor has WRITE_BEHIND_QUEUE_SIZE writes waiting.
+
+    run reports the busy time of each stage, the time two or more stages overlapped and the
+    end-to-end throughput.
+    """
+
+    def __init__(
+        self,
+        extract: Callable[[int], Optional[int]],
+        transform: Callable[[int], None],
+        writers: Optional[List[WriteBehind]] = None,
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+    ) -> None:
+        """
+        :param extract: callable staging a batch, returning the number of rows staged or None
+        :param transform: callable transforming a staged batch
+        :param writers: the WriteBehind of each processor writing behind
+        :param queue_size: maximum number of extracted batches waiting for transformation
+        """
+        self._extract = extract
+        self._transform = transform
+        self._writers = writers or []
+        self._queue_size = queue_size
+
+    def run(self, batch_ids: Iterable[int]) -> Dict[str, float]:
+        """
+        Extract, transform and write the batches, and wait until every write is committed.  The first
+        failure of a stage stops the pipeline and is raised.
+
+        :param batch_ids: identifiers of the batches, in order
+        :return: report of the run: batches, rows, elapsed seconds, busy seconds of each stage,
+        overlap seconds, batches_per_second and rows_per_second
+        """
+
+        batches = queue.Queue(maxsize=self._queue_size)
+        stop = threading.Event()
+        intervals: Dict[str, List[Tuple[float, float]]] = {
+            "extract": [],
+            "transform": [],
+        }
+        first_write = {id(w): len(w.get_intervals()) for w in self._writers}
+
+        def extract_batches():
+            try:
+                for batch_id in batch_ids:
+                    if stop.is_set():
+                        return
+                    start = time.perf_counter()
+                    n_rows = self._extract(batch_id)
+                    intervals["extract"].append((start, time.perf_counter()))
+                    batches.put((batch_id, n_rows, None))
+            except Exception as e:
+                batches.put((None, None, e))
+                return
+            batches.put((None, None, None))
+
+        pipeline_start = time.perf_counter()
+        extractor = threading.Thread(
+            target=extract_batches, name="pipeline_extract", daemon=True
+        )
+        extractor.start()
+
+        n_batches = 0
+        n_rows = 0
+        try:
+            while True:
+                batch_id, batch_rows, error = batches.get()
+                if error is not None:
+                    raise error
+                if batch_id is None:
+                    break
+                start = time.perf_counter()
+                self._transform(batch_id)
+                intervals["transform"].append((start, time.perf_counter()))
+                n_batches += 1
+                n_rows += batch_rows or 0
+
+            for writer in self._writers:
+                writer.flush()
+        except Exception:
+            stop.set()
+            while extractor.is_alive():  # unblock a waiting put
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            raise
+        elapsed = time.perf_counter() - pipeline_start
+        extractor.join()
+
+        intervals["write"] = [
+            interval
+            for writer in self._writers
+            for interval in writer.get_intervals()[first_write[id(writer)] :]
+        ]
+        report = {
+            "batches": n_batches,
+            "rows": n_rows,
+            "elapsed": elapsed,
+            **{stage: get_busy_seconds(intervals[stage]) for stage in PIPELINE_STAGES},
+            "overlap": get_overlap_seconds(list(intervals.values())),
+            "batches_per_second": n_batches / elapsed if elapsed > 0 else 0.0,
+            "rows_per_second": n_rows / elapsed if elapsed > 0 else 0.0,
+        }
+        self._print_report(report)
+        return report
+
+    @staticmethod
+    def _print_report(report: Dict[str, float]) -> None:
+        busy = " ".join(f"{stage} {report[stage]:.3f} s" for stage in PIPELINE_STAGES)
+        print(
+            f"BatchPipeline: {report['batches']} batches in {report['elapsed']:.3f} s"
+            f" (busy: {busy}) (overlapped: {report['overlap']:.3f} s)"
+        )
+        print(
+            f"BatchPipeline: {report['batches_per_second']:.3f} batches/s"
+            f" {report['rows_per_second']:.0f} rows/s"
+        )
+
+
+def _merge_intervals(intervals: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """Return the union of intervals as sorted disjoint intervals"""
+    merged: List[Tuple[float, float]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def get_busy_seconds(intervals: List[Tuple[float, float]]) -> float:
+    """Return the time covered by any of the (start, end) intervals of a stage"""
+    return sum(end - start for start, end in _merge_intervals(intervals))
+
+
+def get_overlap_seconds(stage_intervals: List[List[Tuple[float, float]]]) -> float:
+    """
+    Return the time during which two or more stages were busy
+
+    :param stage_intervals: the (start, end) intervals of each stage
+    :return: overlapped seconds
+    """
+    events = sorted(
+        (time_point, change)
+        for intervals in stage_intervals
+        for start, end in _merge_intervals(intervals)
+        for time_point, change in [(start, 1), (end, -1)]
+    )
+    overlap = 0.0
+    active = 0
+    last = None
+    for time_point, change in events:
+        if active >= 2:
+            overlap += time_point - last
+        active += change
+        last = time_point
+    return overlap
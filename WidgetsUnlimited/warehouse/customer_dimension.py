@@ -1,9 +1,18 @@
-from typing import Tuple, Dict
+from typing import Callable, Tuple, Dict, List, Optional
+
 import pandas as pd
-from datetime import date
 
-from pandas.core.frame import DataFrame, Series, Index
-from .warehouse_util import read_stage
+from pandas.core.frame import DataFrame, Series
+from .batch_checkpoint import BatchCheckpoints
+from .star_export import StarExport
+from .dimension_processor import (
+    DimensionProcessor,
+    DimensionSpec,
+    ChildSpec,
+    UPDATE_COUNTS,
+    CURRENT_ROW_EXPIRATION_DATE,
+    get_hash_partitions,
+)
 from model.customer_dim import CustomerDimTable
 from model.customer import CustomerTable
 from model.customer_address import CustomerAddressTable
@@ -18,6 +27,7 @@ customer_dim_to_customer_mapping = {
     "referral_type": "customer_referral_type",
     "sex": "customer_sex",
     "date_of_birth": "customer_date_of_birth",
+    "age_cohort": "customer_date_of_birth",
     "loyalty_number": "customer_loyalty_number",
     "credit_card_number": "customer_credit_card_number",
     "is_preferred": "customer_is_preferred",
@@ -41,389 +51,217 @@ shipping_to_customer_dim_mapping = {
 }
 
 
-class CustomerDimensionProcessor:
-    """
-    Transform the customer_dimension table in the mySQL star schema.
+# name\nstreet_address\ncity, state zip -- the same shape parse_address splits
+ADDRESS_PATTERN = (
+    r"^(?P<name>[^\n]*)\n(?P<street_number>[^\n]*)\n"
+    r"(?P<city>[^,\n]*),\s*(?P<state>\S+)\s+(?P<zip>\S+)\s*$"
+)
 
-    The process_update method is called when a batch of incremental updates of source data is
-    available in data warehouse staging area.
 
-    The following naming conventions are used in the class:
+def decode_referral_type(s) -> str:
+    """Translate referral_type code to text"""
+    referrals = {
+        "OA": "Online Advertising",
+        "AM": "Affiliate Marketing",
+        "": "None",
+    }
+    return referrals.get(s.strip().upper(), "Unknown")
 
-    pandas DataFrames
 
-    customer - staged customer data
-    customer_address - staged customer address data
-    customer_dim - mySQL star schema customer_dimension data
+def decode_age_cohort(date_of_birth) -> str:
+    """Translate date_of_birth to the decade of birth of the customer (e.g. 1990s)"""
+    if pd.isna(date_of_birth):
+        return "Unknown"
+    return f"{date_of_birth.year // 10 * 10}s"
 
-    pandas Indexes
 
-    incremental_keys - All customer ids (natural key) present in batch
-    update_keys - Customer ids already in the star schema
-    new_keys - Customer ids not yet in the star schema
+def parse_address(s: str) -> Series:
     """
+    Parse the customer_address column and return a series of correctly labeled component fields.
+    The address is a string with the expected format: name\nstreet_address\ncity, state zip
+    """
+    name, street_number, rest = s.split("\n")
+    city, rest = rest.split(",")
+    state, zip_code = rest.strip().split()
+
+    return pd.Series(
+        {
+            "name": name,
+            "street_number": street_number,
+            "city": city,
+            "state": state,
+            "zip": zip_code,
+        }
+    )
 
-    def __init__(self, connection=None):
-        """
-        Initialize CustomerDimensionProcessor
-        :param connection: mySQL connection created by the warehouse.  None is used for test.
-        """
-
-        self._connection = connection
-        self._dimension_table = CustomerDimTable()
-        self._next_surrogate_key = 1
-        if connection:
-            self._create_dimension()
 
-    def process_update(self, batch_id: int) -> None:
-        """
-        Perform the following steps to update the customer_dimension table for an ETL batch
-
-        1) Read customer and customer_address files from stage area into dataframes
-        2) Compute incremental_keys
-        3) Load customer_dim from mySQL to dataframe for incremental_keys
-        4) Compute input_keys and update_keys
-        5) Compute input and update customer_dim records using transformations taking customer, customer_address
-        and customer_dim as inputs
-        6) Write inputs and updates to customer_dimension table in mySQL
-        :param batch_id: Identifier for ETL process
-        :return:None
-        """
+def parse_addresses(addresses: Series) -> Tuple[DataFrame, Series]:
+    """
+    Vectorized parse_address: split a whole customer_address column with one regular expression.
 
-        customer, customer_address = read_stage(
-            batch_id, [CustomerTable(), CustomerAddressTable()]
-        )
-        incremental_keys = customer.index.union(customer_address.index).unique()
-        print(
-            f"CustomerDimensionProcessor: {len(incremental_keys)} unique customer ids detected",
-            end=" ",
-        )
-        if incremental_keys.size == 0:
-            print()  # Add newline to 0 keys message
-            return
-
-        prior_customer_dim = self._read_dimension("customer_key", incremental_keys)
-        update_keys = prior_customer_dim.index
-        new_keys = incremental_keys.difference(update_keys)
-        print(f"(New: {len(new_keys)})", end=" ")
-        print(f"(Updated: {len(update_keys)})")
-
-        inserts = self._build_new_dimension(new_keys, customer, customer_address)
-        updates = self._build_update_dimension(
-            update_keys, prior_customer_dim, customer, customer_address
-        )
+    :param addresses: customer_address column
+    :return: a dataframe of the component fields (name, street_number, city, state, zip) of the
+    well formed addresses, with the index of addresses, and a series of the malformed addresses
+    """
+    parsed = addresses.astype("string").str.extract(ADDRESS_PATTERN)
+    is_valid = parsed["name"].notna()
+    return parsed[is_valid], addresses[~is_valid]
 
-        self._write_dimension(inserts, "INSERT")
-        self._next_surrogate_key += inserts.shape[0]
-        self._write_dimension(updates, "REPLACE")
 
-        print(
-            f"CustomerDimensionProcessor: {self._count_dimension()} total rows in customer_dim table"
-        )
+# missing address items of new rows are set to N/A
+ADDRESS_DEFAULTS = {
+    col: "N/A"
+    for col in list(billing_to_customer_dim_mapping)
+    + list(shipping_to_customer_dim_mapping)
+}
 
-    def _create_dimension(self):
-        """Create an empty customer_dimension on warehouse initialization."""
+CUSTOMER_DIMENSION = DimensionSpec(
+    "customer_dimension",
+    CustomerDimTable(),
+    natural_key="customer_key",
+    source=CustomerTable(),
+    mapping=customer_dim_to_customer_mapping,
+    decoders={
+        "referral_type": decode_referral_type,
+        "age_cohort": decode_age_cohort,
+    },
+    children=[
+        ChildSpec(
+            CustomerAddressTable(),
+            billing_to_customer_dim_mapping,
+            where=("customer_address_type", "B"),
+            column="customer_address",
+            parser=parse_addresses,
+        ),
+        ChildSpec(
+            CustomerAddressTable(),
+            shipping_to_customer_dim_mapping,
+            where=("customer_address_type", "S"),
+            column="customer_address",
+            parser=parse_addresses,
+        ),
+    ],
+    new_row_mapping={
+        "activation_date": "customer_inserted_at",
+        "start_date": "customer_inserted_at",
+    },
+    new_row_values={
+        "deactivation_date": CURRENT_ROW_EXPIRATION_DATE,
+    },
+    defaults=ADDRESS_DEFAULTS,
+    status=("customer_is_active", "is_active", "activation_date", "deactivation_date"),
+    scd_type=2,
+)
+
+
+class CustomerDimensionProcessor(DimensionProcessor):
+    """
+    Transform the customer_dimension table in the mySQL star schema, as described by
+    CUSTOMER_DIMENSION: customers flattened with their billing and shipping addresses, keeping type 2
+    history.
 
-        cur = self._connection.cursor()
-        cur.execute(f"DROP TABLE IF EXISTS {self._dimension_table.get_name()};")
-        cur.execute(self._dimension_table.get_create_sql_mysql())
+    The following naming conventions are used in the class:
 
-    def _read_dimension(self, key_name: str, key_values: Index) -> DataFrame:
-        """
-        Read rows from the customer_dimension table using a key filter
+    pandas DataFrames
 
-        :param key_name: Name of the filter key
-        :param key_values: Filter values
-        :return: A dataframe of the result set, indexed by the key column
-        """
+    customer - staged customer data
+    customer_address - staged customer address data
+    customer_dim - mySQL star schema customer_dimension data
+    """
 
-        table_name = self._dimension_table.get_name()
-        key_values_list = ",".join([str(k) for k in key_values])
-        query = f"SELECT * FROM {table_name} WHERE {key_name} IN ({key_values_list});"
-        dimension_df = pd.read_sql_query(query, self._connection)
-        dimension_df = dimension_df.set_index(key_name, drop=False)
+    SPEC = CUSTOMER_DIMENSION
+    NAME = CUSTOMER_DIMENSION.name
 
-        return dimension_df
+    decode_referral_type = staticmethod(decode_referral_type)
+    parse_address = staticmethod(parse_address)
+    parse_addresses = staticmethod(parse_addresses)
 
-    def _write_dimension(self, customer_dim: DataFrame, operation: str) -> None:
+    def __init__(
+        self,
+        connection=None,
+        write_methods: Dict[str, str] = None,
+        recreate=True,
+        engine="pandas",
+        connection_factory: Optional[Callable] = None,
+        partitions: int = 1,
+        write_behind: bool = False,
+        checkpoints: Optional[BatchCheckpoints] = None,
+        export: Optional[StarExport] = None,
+    ):
         """
-        Write a dataframe containing inserts or updates to the mySQL customer_dimension table.
-        Convert the dataframe to a python list and use mysql-connector-python for bulk execution call.
-
-        :param customer_dim: dataframe conforming to customer_dim schema
-        :param operation: INSERT/REPLACE -- mirror mySQL verbs for insert/upsert
-        :return: None
+        Initialize CustomerDimensionProcessor
+        :param connection: mySQL connection created by the warehouse.  None is used for test.
+        :param write_methods: optional overrides of WRITE_METHODS per operation, e.g. {"INSERT": "load"},
+        which needs a connection with allow_local_infile and local_infile enabled on the server.
+        :param recreate: drop and recreate the customer_dimension table.  False continues with an existing
+        table, e.g. on restart of the warehouse or in a parallel worker.
+        :param engine: pandas, or duckdb to run the transform as SQL in an embedded DuckDB over the stage
+        data (see duckdb_engine)
+        :param connection_factory: picklable callable returning a new mySQL connection, used by the
+        worker processes of a parallel update
+        :param partitions: number of hash partitions of the customer ids updated in parallel worker
+        processes.  Needs a connection_factory.
+        :param write_behind: write each batch on a background thread while the next batch is transformed
+        (see WriteBehind).  Needs a connection_factory.
+        :param checkpoints: optional BatchCheckpoints recording the batches written by the processor
+        :param export: optional StarExport publishing the rows written by each batch
         """
-        if customer_dim.shape[0] > 0:
-            table = self._dimension_table
-            table_name = table.get_name()
-            column_names = ",".join(table.get_column_names())
-            values_substitutions = ",".join(["%s"] * len(table.get_column_names()))
-            cur = self._connection.cursor()
-            rows = customer_dim.to_numpy().tolist()
-
-            cur.executemany(
-                f"{operation} INTO {table_name} ({column_names}) values ({values_substitutions})",
-                rows,
-            )
+        if engine not in ["pandas", "duckdb"]:
+            raise Exception(f"Unknown transform engine {engine}")
+
+        self._engine = engine
+        super().__init__(
+            connection,
+            write_methods,
+            recreate,
+            connection_factory,
+            partitions,
+            write_behind,
+            checkpoints,
+            export,
+        )
+
+    def _read_changes(
+        self, batch_id: int, last_batch_id: Optional[int]
+    ) -> Tuple[DataFrame, List[DataFrame], Optional[DataFrame]]:
+        if self._engine == "duckdb":
+            # imported here: duckdb is only required by this engine
+            from .duckdb_engine import duckdb_customer_transform
 
-            if operation == "INSERT":
-                operation_text = "inserts"
-                rows_affected = cur.rowcount
-            else:
-                operation_text = "updates"
-                rows_affected = cur.rowcount // 2
-            print(
-                f"CustomerDimensionProcessor: {rows_affected} {operation_text} written to {table_name} table"
+            customer, customer_changes = duckdb_customer_transform(
+                batch_id, last_batch_id, self._quarantined
             )
+            return customer, [], customer_changes
+        return super()._read_changes(batch_id, last_batch_id)
 
-            self._connection.commit()
+    def _get_worker_options(self) -> Dict[str, str]:
+        return {"engine": self._engine}
 
-    def _count_dimension(self) -> int:
-        """Return number of rows in dimension table"""
-        table_name = self._dimension_table.get_name()
-        cur = self._connection.cursor()
-        cur.execute(f"SELECT COUNT(*) FROM {table_name};")
-        return cur.fetchone()[0]
+    def get_quarantined_addresses(self) -> DataFrame:
+        """
+        Return the customer_address stage records whose address could not be parsed in the last
+        process_update.  Their address fields were left out of the customer_dim records.
+        """
+        return self.get_quarantined_rows()
 
     @staticmethod
     def get_address_defaults() -> Dict[str, str]:
         """Build a dictionary used to set missing address items to N/A"""
-        return {
-            col: "N/A"
-            for col in [
-                "billing_name",
-                "billing_street_number",
-                "billing_city",
-                "billing_state",
-                "billing_zip",
-                "shipping_name",
-                "shipping_street_number",
-                "shipping_city",
-                "shipping_state",
-                "shipping_zip",
-            ]
-        }
-
-    @staticmethod
-    def decode_referral_type(s) -> str:
-        """Translate referral_type code to text"""
-        referrals = {
-            "OA": "Online Advertising",
-            "AM": "Affiliate Marketing",
-            "": "None",
-        }
-        return referrals.get(s.strip().upper(), "Unknown")
-
-    @staticmethod
-    def parse_address(s: str) -> Series:
-        """
-        Parse the customer_address column and return a series of correctly labeled component fields.
-        The address is a string with the expected format: name\nstreet_address\ncity, state zip
-        """
-        name, street_number, rest = s.split("\n")
-        city, rest = rest.split(",")
-        state, zip_code = rest.strip().split()
-
-        return pd.Series(
-            {
-                "name": name,
-                "street_number": street_number,
-                "city": city,
-                "state": state,
-                "zip": zip_code,
-            }
-        )
+        return dict(ADDRESS_DEFAULTS)
 
     @staticmethod
     def customer_transform(
-        customer: DataFrame, customer_address: DataFrame
+        customer: DataFrame,
+        customer_address: DataFrame,
+        quarantine: Optional[List[DataFrame]] = None,
     ) -> DataFrame:
         """
-        Common transformations that apply to both inserts and updates.
-
-        - simple column to column mapping
-        - decoding of customer_referral_type
-        - parsing of billing and customer addresses
-        - resolution of last_update_date column
+        Common transformations that apply to both inserts and updates (see DimensionSpec.transform).
 
         :param customer: customer stage data, indexed with new_keys or update_keys
         :param customer_address: customer address stage data, indexed with new_keys or update_keys
+        :param quarantine: optional list collecting the customer_address records with malformed addresses
         :return: a customer_dim dataframe with incremental changes. Values not included in the stage data
-        are returned as null.
-
+        (or in malformed addresses) are returned as null.
         """
-
-        # make empty customer_dim dataframe indexed by target keys
-        union_index = customer.index.union(customer_address.index).unique()
-        customer_dim = pd.DataFrame(
-            [], columns=CustomerDimTable().get_column_names(), index=union_index
-        )
-
-        # work area to compute latest of three possibly existing dates
-        update_dates = pd.DataFrame(
-            [], columns=["billing", "shipping", "customer"], index=union_index
-        )
-
-        # simple copies from customer to customer_dim
-        for k, v in customer_dim_to_customer_mapping.items():
-            if v in customer:
-                customer_dim[k] = customer[v]
-
-        if "customer_referral_type" in customer.columns:
-            customer_dim.referral_type = customer["customer_referral_type"].map(
-                CustomerDimensionProcessor.decode_referral_type
-            )
-
-        # Collect billing and shipping information where available
-        is_billing = customer_address["customer_address_type"] == "B"
-        is_shipping = customer_address["customer_address_type"] == "S"
-
-        billing = customer_address[is_billing]["customer_address"].apply(
-            CustomerDimensionProcessor.parse_address
-        )
-
-        if billing.size != 0:
-            update_dates["billing"] = customer_address.loc[
-                is_billing, "customer_address_updated_at"
-            ]
-            for k, v in billing_to_customer_dim_mapping.items():
-                customer_dim[k] = billing[v]
-
-        shipping = customer_address[is_shipping]["customer_address"].apply(
-            CustomerDimensionProcessor.parse_address
-        )
-
-        if shipping.size != 0:
-            update_dates["shipping"] = customer_address.loc[
-                is_shipping, "customer_address_updated_at"
-            ]
-            for k, v in shipping_to_customer_dim_mapping.items():
-                customer_dim[k] = shipping[v]
-
-        # set last_update_date to latest of three dates
-        update_dates["customer"] = customer["customer_updated_at"]  # required column
-        customer_dim["last_update_date"] = update_dates.T.max()
-
-        return customer_dim
-
-    def _build_new_dimension(
-        self, new_keys: Index, customer: DataFrame, customer_address: DataFrame
-    ) -> DataFrame:
-        """
-        Create and initialize new records for customer_dimension table in star schema
-
-        :param new_keys: keys for records in batch not yet in star schema
-        :param customer: staged customer data
-        :param customer_address: staged customer address data
-        :return: a customer_dim dataframe ready to be written to mySQL
-        """
-
-        if len(new_keys) == 0:
-            return pd.DataFrame([])
-
-        # restrict stage date to new_keys
-        customer = customer.loc[new_keys.intersection(customer.index)]
-        customer_address = customer_address.loc[
-            new_keys.intersection(customer_address.index)
-        ]
-
-        # apply common transformation
-        customer_dim = CustomerDimensionProcessor.customer_transform(
-            customer, customer_address
-        )
-
-        # assign surrogate keys
-        next_surrogate_key = self._next_surrogate_key
-        num_inserts = customer_dim.shape[0]
-        customer_dim["surrogate_key"] = range(
-            next_surrogate_key, next_surrogate_key + num_inserts
-        )
-
-        # initialize values for new records
-        customer_dim["age_cohort"] = "N/A"
-        customer_dim["activation_date"] = customer["customer_inserted_at"]
-        customer_dim["deactivation_date"] = date(2099, 12, 31)
-        customer_dim["start_date"] = customer["customer_inserted_at"]
-        customer_dim["effective_date"] = date(2020, 10, 10)
-        customer_dim["expiration_date"] = date(2099, 12, 31)
-        customer_dim["is_current_row"] = "Y"
-
-        # conform output types
-        customer_dim = customer_dim.astype(
-            self._dimension_table.get_column_pandas_types()
-        )
-
-        # apply default values
-        customer_dim = customer_dim.fillna(
-            CustomerDimensionProcessor.get_address_defaults()
-        )
-
-        return customer_dim
-
-    def _build_update_dimension(
-        self,
-        update_keys: Index,
-        prior_customer_dim: DataFrame,
-        customer: DataFrame,
-        customer_address: DataFrame,
-    ) -> DataFrame:
-        """
-        Update existing records in customer_dimension table star schema
-
-        :param update_keys: keys for records in batch already in star schema
-        :param prior_customer_dim:
-        :param customer: staged customer data
-        :param customer_address: staged customer address data
-        :return: a customer_dim dataframe ready to be written to mySQL
-        """
-
-        if prior_customer_dim.shape[0] == 0:
-            return pd.DataFrame([])
-
-        # restrict stage date to update_keys
-        customer = customer.loc[update_keys.intersection(customer.index)]
-        customer_address = customer_address.loc[
-            update_keys.intersection(customer_address.index)
-        ]
-
-        # apply common transformation
-        customer_dim = CustomerDimensionProcessor.customer_transform(
-            customer, customer_address
-        )
-
-        # reset activation status and dates when change detected
-        customer = customer.reindex(update_keys)
-        if "customer_is_active" in customer.columns:
-            was_activated = (customer["customer_is_active"] == True) & (
-                prior_customer_dim["is_active"] == False
-            )
-            was_deactivated = (customer["customer_is_active"] == False) & (
-                prior_customer_dim["is_active"] == True
-            )
-
-            prior_customer_dim.loc[was_activated, "activation_date"] = customer[
-                "customer_updated_at"
-            ]
-            prior_customer_dim.loc[was_activated, "deactivation_date"] = date(
-                2099, 12, 31
-            )
-            prior_customer_dim.loc[was_deactivated, "deactivation_date"] = customer[
-                "customer_updated_at"
-            ]
-
-        # copy all non-null values from customer_dim over prior_customer_dim (old values not
-        # appearing in the incremental batch are preserved)
-        mask = customer_dim.notnull()
-        for col in customer_dim.columns:
-            prior_customer_dim.loc[mask[col], col] = customer_dim[col]
-
-        # make copy of result
-        update_dim = pd.DataFrame(
-            prior_customer_dim, columns=self._dimension_table.get_column_names()
-        )
-
-        # conform output types
-        update_dim = update_dim.astype(self._dimension_table.get_column_pandas_types())
-
-        return update_dim
+        return CUSTOMER_DIMENSION.transform(customer, [customer_address], quarantine)
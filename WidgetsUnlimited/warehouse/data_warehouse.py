@@ -1,37 +1,138 @@
-from .warehouse_util import extract_write_stage
+from .warehouse_util import (
+    extract_write_stage,
+    get_stage_row_counts,
+    has_stage_batch,
+    set_stage_backend,
+)
+from .batch_checkpoint import BatchCheckpoints, STAGED, TRANSFORMED, WRITTEN
+from .star_export import StarExport
 from model.customer import CustomerTable
 from model.customer_address import CustomerAddressTable
+from model.order import OrderTable
+from model.order_line_item import OrderLineItemTable
+from model.product import ProductTable
+from model.store import StoreTable
+from model.store_location import StoreLocationTable
+from model.store_sales import StoreSalesTable
+from model.customer_dim import CustomerDimTable
+from model.date_dim import DateDimTable
+from model.product_dim import ProductDimTable
+from model.store_dim import StoreDimTable
+from model.sales_fact import SalesFactTable
 from .customer_dimension import CustomerDimensionProcessor
+from .date_dimension import DateDimensionProcessor
+from .product_dimension import ProductDimensionProcessor
+from .store_dimension import StoreDimensionProcessor
+from .sales_fact import SalesFactProcessor
+from .transform_scheduler import TransformScheduler
 import os
 import pandas as pd
+import psycopg2
 from mysql.connector import connect
 
 
 class DataWarehouse:
     """
     The Data Warehouse ingests and processes incremental batches of generator_requests from multiple source
-    systems.  Data from the source systems are persisted to a staging area as parquet files.  When all the staging data
-    have been written for a batch, a series of transformations are launched which update a star schema in mySQL.
+    systems.  Data from the source systems are persisted to a staging area (parquet files by default, see
+    WAREHOUSE_STAGE_BACKEND).  When all the staging data have been written for a batch, a series of
+    transformations are launched which update a star schema in mySQL.
+
+    The completed steps of each batch are checkpointed in the warehouse (see BatchCheckpoints).  A
+    warehouse restarted with WAREHOUSE_RESTART=1 keeps its tables and checkpoints: a staged batch is
+    not extracted again, and only the processors which had not written a batch transform it again.
+
+    With WAREHOUSE_EXPORT=1 the processors also publish the rows written by each batch to a parquet copy
+    of the star schema (see StarExport), compacted as batches are written, for analytical scans.
     """
 
     def __init__(self) -> None:
         """
-        Connect to mySQL for star schema and initialize transformation classes
+        Connect to mySQL for star schema, select the stage backend and initialize transformation classes.
+
+        WAREHOUSE_STAGE_BACKEND selects how stage data are handed from extraction to transformation:
+        parquet (default), ipc (memory mapped arrow IPC files) or memory (in process, no files).
         """
-        self._ms_connection = connect(
-            host=os.getenv("WAREHOUSE_HOST"),
-            port=os.getenv("WAREHOUSE_PORT"),
-            user=os.getenv("WAREHOUSE_USER"),
-            password=os.getenv("WAREHOUSE_PASSWORD"),
-            database=os.getenv("WAREHOUSE_DB"),
-            charset="utf8",
-        )
+        set_stage_backend(os.getenv("WAREHOUSE_STAGE_BACKEND", "parquet"))
 
-        # phase 1 - single transformation
-        self._customer_dimension = CustomerDimensionProcessor(self._ms_connection)
+        self._ms_connection = connect_warehouse()
+        recreate = os.getenv("WAREHOUSE_RESTART", "0") != "1"
+        self._checkpoints = BatchCheckpoints(connect_warehouse(), recreate)
+        self._unwritten_batches = []  # transformed batches without written checkpoint
+        self._export = None
+        if os.getenv("WAREHOUSE_EXPORT", "0") == "1":
+            self._export = StarExport(
+                [
+                    CustomerDimTable(),
+                    DateDimTable(),
+                    ProductDimTable(),
+                    StoreDimTable(),
+                    SalesFactTable(),
+                ],
+                recreate=recreate,
+            )
 
-    @staticmethod
-    def direct_extract(connection, batch_id):
+        # transformation processors, each with its own connection as independent processors run
+        # concurrently
+        # WAREHOUSE_INSERT_METHOD: load (LOAD DATA LOCAL INFILE) or insert (multi-row INSERT)
+        # WAREHOUSE_PARTITIONS: number of worker processes updating hash partitions of the dimension
+        # WAREHOUSE_WRITE_BEHIND: 1 to write each batch while the next one is transformed (see
+        # WriteBehind), with an extra connection per processor
+        write_behind = os.getenv("WAREHOUSE_WRITE_BEHIND", "0") == "1"
+        self._customer_dimension = CustomerDimensionProcessor(
+            self._ms_connection,
+            write_methods={"INSERT": os.getenv("WAREHOUSE_INSERT_METHOD", "insert")},
+            connection_factory=connect_warehouse,
+            recreate=recreate,
+            partitions=int(os.getenv("WAREHOUSE_PARTITIONS", "1")),
+            write_behind=write_behind,
+            checkpoints=self._checkpoints,
+            export=self._export,
+        )
+        self._date_dimension = DateDimensionProcessor(
+            connect_warehouse(),
+            write_method=os.getenv("WAREHOUSE_INSERT_METHOD", "insert"),
+            recreate=recreate,
+            export=self._export,
+        )
+        self._product_dimension = ProductDimensionProcessor(
+            connect_warehouse(),
+            write_methods={"INSERT": os.getenv("WAREHOUSE_INSERT_METHOD", "insert")},
+            recreate=recreate,
+            connection_factory=connect_warehouse,
+            write_behind=write_behind,
+            checkpoints=self._checkpoints,
+            export=self._export,
+        )
+        self._store_dimension = StoreDimensionProcessor(
+            connect_warehouse(),
+            write_methods={"INSERT": os.getenv("WAREHOUSE_INSERT_METHOD", "insert")},
+            recreate=recreate,
+            connection_factory=connect_warehouse,
+            write_behind=write_behind,
+            checkpoints=self._checkpoints,
+            export=self._export,
+        )
+        self._sales_fact = SalesFactProcessor(
+            connect_warehouse(),
+            write_method=os.getenv("WAREHOUSE_INSERT_METHOD", "insert"),
+            recreate=recreate,
+            connection_factory=connect_warehouse,
+            write_behind=write_behind,
+            checkpoints=self._checkpoints,
+            export=self._export,
+        )
+        self._scheduler = TransformScheduler(
+            [
+                self._customer_dimension,
+                self._date_dimension,
+                self._product_dimension,
+                self._store_dimension,
+                self._sales_fact,
+            ]
+        )
+
+    def direct_extract(self, connection, batch_id):
         """
         Extract incremental updates directly from the data generator database and write to staging area
 
@@ -39,22 +140,153 @@ class DataWarehouse:
         version of the WidgetsUnlimited project: 1) Source system specific exposure of incremental updates by the
         OperationsSimulator; 2) Source system specific ingestion of incremental updates by the DataWarehouse.
 
-        The input tables for the customer dimension are hard coded in phase #1
+        The input tables for the customer, product and store dimensions and the e-commerce and store
+        sales are hard coded in phase #1.  Tables are extracted in parallel from one snapshot of the data
+        generator database.
+
+        A batch checkpointed as staged and still in the stage area is not extracted again.
 
         :param connection: connection to data generator database
         :param batch_id: identifier of incremental batch
         :return: None
         """
+        if self._checkpoints.is_complete(batch_id, STAGED) and has_stage_batch(
+            batch_id
+        ):
+            print(f"DataWarehouse: batch {batch_id} already staged")
+            return
+
         extract_write_stage(
-            connection, batch_id, [CustomerTable(), CustomerAddressTable()]
+            connection,
+            batch_id,
+            DataWarehouse.get_extract_tables(),
+            connection_factory=connect_data_generator,
         )
+        self._checkpoints.record(batch_id, STAGED)
+
+    @staticmethod
+    def get_extract_tables():
+        """Return the tables extracted by direct_extract"""
+        return [
+            CustomerTable(),
+            CustomerAddressTable(),
+            OrderTable(),
+            OrderLineItemTable(),
+            ProductTable(),
+            StoreTable(),
+            StoreLocationTable(),
+            StoreSalesTable(),
+        ]
+
+    @staticmethod
+    def get_staged_rows(batch_id) -> int:
+        """Return the number of rows staged by direct_extract for a batch"""
+        row_counts = get_stage_row_counts(batch_id, DataWarehouse.get_extract_tables())
+        return sum(row_counts.values()) if row_counts is not None else 0
 
-    def transform_load(self, batch_id):
+    def transform_load(self, batch_id, last_batch_id=None):
         """
-        Transform inputs from staging area into updated mySQL star schema.
+        Transform inputs from staging area into updated mySQL star schema.  Processors run in dependency
+        order, independent ones concurrently, and their timings are reported.
+
+        Processors which already wrote the batch (checkpointed) are skipped, so a batch failing in one
+        processor resumes with that processor.
 
         :param batch_id: identifier of incremental batch
+        :param last_batch_id: optional last batch of an inclusive range of batches to transform in one run
+        (backfill or reprocessing)
         :return: None
         """
-        # phase 1 - single transformation
-        self._customer_dimension.process_update(batch_id=batch_id)
+        self._record_written_batches()
+
+        written = self._checkpoints.get_written_processors(batch_id)
+        self._scheduler.run(batch_id, last_batch_id, skip=written)
+        self._checkpoints.record(batch_id, TRANSFORMED, last_batch_id=last_batch_id)
+        self._unwritten_batches.append((batch_id, last_batch_id))
+        self._record_written_batches()
+
+    def _record_written_batches(self):
+        """
+        Record the written checkpoint of the transformed batches written by every processor, and
+        compact the export up to the last of them
+        """
+        processors = {
+            p.NAME
+            for p in [
+                self._customer_dimension,
+                self._product_dimension,
+                self._store_dimension,
+                self._sales_fact,
+            ]
+        }
+        for batch_id, last_batch_id in list(self._unwritten_batches):
+            if processors <= self._checkpoints.get_written_processors(batch_id):
+                self._checkpoints.record(batch_id, WRITTEN, last_batch_id=last_batch_id)
+                self._unwritten_batches.remove((batch_id, last_batch_id))
+                if self._export is not None:
+                    self._export.compact_due(last_batch_id or batch_id)
+
+    def check_aggregates(self, rebuild=False):
+        """
+        Compare the aggregate tables of the sales facts with a full recompute, once every write is
+        committed
+
+        :param rebuild: recompute the inconsistent aggregate tables
+        :return: number of mismatched rows per aggregate table
+        """
+        self.flush()
+        return self._sales_fact.check_aggregates(rebuild)
+
+    def compact_export(self):
+        """Compact all the changes of the export (see WAREHOUSE_EXPORT), once every write is committed"""
+        self.flush()
+        if self._export is not None:
+            for table_name in self._export.get_table_names():
+                self._export.compact(table_name)
+
+    def get_export(self):
+        return self._export
+
+    def get_checkpoints(self) -> BatchCheckpoints:
+        return self._checkpoints
+
+    def get_writers(self):
+        """Return the WriteBehind of each processor writing behind (see WAREHOUSE_WRITE_BEHIND)"""
+        processors = [
+            self._customer_dimension,
+            self._product_dimension,
+            self._store_dimension,
+            self._sales_fact,
+        ]
+        return [p.get_writer() for p in processors if p.get_writer() is not None]
+
+    def flush(self):
+        """Wait until the writes of every transformed batch are committed"""
+        for writer in self.get_writers():
+            writer.flush()
+        self._record_written_batches()
+
+
+def connect_data_generator():
+    """Open a new connection to the data generator database (used by parallel extraction workers)"""
+    return psycopg2.connect(
+        dbname=os.environ["DATA_GENERATOR_DB"],
+        host=os.environ["DATA_GENERATOR_HOST"],
+        port=os.environ["DATA_GENERATOR_PORT"],
+        user=os.environ["DATA_GENERATOR_USER"],
+        password=os.environ["DATA_GENERATOR_PASSWORD"],
+        options=f"-c search_path={os.environ['DATA_GENERATOR_SCHEMA']}",
+    )
+
+
+def connect_warehouse():
+    """Open a new connection to the mySQL star schema (also used by parallel transformation workers)"""
+    return connect(
+        host=os.getenv("WAREHOUSE_HOST"),
+        port=os.getenv("WAREHOUSE_PORT"),
+        user=os.getenv("WAREHOUSE_USER"),
+        password=os.getenv("WAREHOUSE_PASSWORD"),
+        database=os.getenv("WAREHOUSE_DB"),
+        charset="utf8",
+        allow_local_infile=True,
+    )
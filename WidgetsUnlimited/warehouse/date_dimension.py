@@ -0,0 +1,204 @@
+from datetime import date
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame
+from pandas.tseries.holiday import USFederalHolidayCalendar
+
+from model.metadata import Table
+from model.date_dim import DateDimTable
+from .dimension_key_map import UNKNOWN_KEY
+from .mysql_writer import insert_rows, load_rows
+from .star_export import StarExport
+
+DATE_DIM_FIRST_DATE = date(2000, 1, 1)  # range of the generated date dimension
+DATE_DIM_LAST_DATE = date(2030, 12, 31)
+FISCAL_YEAR_START_MONTH = 2  # February: the retail fiscal year
+
+
+def get_date_keys(
+    dates, first_date: date = DATE_DIM_FIRST_DATE, last_date: date = DATE_DIM_LAST_DATE
+) -> np.ndarray:
+    """
+    Return the date key (yyyymmdd) of each date, computed with integer arithmetic on datetime64 arrays
+    rather than looked up: the key of a date is known without reading the date dimension.  Missing
+    dates and dates outside the range of the date dimension have UNKNOWN_KEY.
+
+    :param dates: array-like of dates or timestamps (the time of day is ignored)
+    :param first_date: first date of the date dimension
+    :param last_date: last date of the date dimension
+    :return: int64 array of date keys
+    """
+    days = pd.to_datetime(dates).to_numpy(dtype="datetime64[D]")
+    months = days.astype("datetime64[M]")
+    years = months.astype("datetime64[Y]").astype("int64") + 1970
+    date_keys = (
+        years * 10000
+        + (months.astype("int64") % 12 + 1) * 100
+        + (days - months).astype("int64")
+        + 1
+    )
+    is_known = (
+        ~np.isnat(days)
+        & (days >= np.datetime64(first_date, "D"))
+        & (days <= np.datetime64(last_date, "D"))
+    )
+    return np.where(is_known, date_keys, UNKNOWN_KEY)
+
+
+def build_date_dimension(
+    first_date: date = DATE_DIM_FIRST_DATE,
+    last_date: date = DATE_DIM_LAST_DATE,
+    fiscal_year_start_month: int = FISCAL_YEAR_START_MONTH,
+) -> DataFrame:
+    """
+    Build the rows of the date dimension for an inclusive range of dates, plus the row of UNKNOWN_KEY
+    referenced by facts without a known date.  Holidays are the US federal holidays.
+
+    :param first_date: first date of the range
+    :param last_date: last date of the range
+    :param fiscal_year_start_month: first month (1 to 12) of the fiscal year
+    :return: a date_dim dataframe indexed by date_key
+    """
+    dates = pd.date_range(first_date, last_date, freq="D")
+    holidays = USFederalHolidayCalendar().holidays(
+        first_date, last_date, return_name=True
+    )
+    fiscal_month = (dates.month - fiscal_year_start_month) % 12 + 1
+    # the fiscal year is named by the calendar year in which it ends
+    fiscal_year = dates.year + (
+        (dates.month >= fiscal_year_start_month) & (fiscal_year_start_month > 1)
+    )
+
+    date_dim = pd.DataFrame(
+        {
+            "date_key": get_date_keys(dates, first_date, last_date),
+            "full_date": dates,
+            "day_of_week": dates.dayofweek + 1,
+            "day_name": dates.day_name(),
+            "day_of_month": dates.day,
+            "day_of_year": dates.dayofyear,
+            "week_of_year": dates.isocalendar().week.to_numpy(dtype="int64"),
+            "month": dates.month,
+            "month_name": dates.month_name(),
+            "quarter": dates.quarter,
+            "year": dates.year,
+            "fiscal_month": fiscal_month,
+            "fiscal_quarter": (fiscal_month - 1) // 3 + 1,
+            "fiscal_year": fiscal_year,
+            "is_weekend": dates.dayofweek >= 5,
+            "is_holiday": dates.isin(holidays.index),
+            "holiday_name": holidays.reindex(dates).to_numpy(),
+        }
+    )
+    unknown = {name: 0 for name in date_dim.columns}
+    unknown.update(
+        date_key=UNKNOWN_KEY,
+        full_date=pd.NaT,
+        day_name="Unknown",
+        month_name="Unknown",
+        is_weekend=False,
+        is_holiday=False,
+        holiday_name=None,
+    )
+    date_dim = pd.concat([pd.DataFrame([unknown]), date_dim], ignore_index=True)
+
+    return date_dim.astype(DateDimTable().get_column_pandas_types()).set_index(
+        "date_key", drop=False
+    )
+
+
+class DateDimensionProcessor:
+    """
+    Load the date_dim table in the mySQL star schema.
+
+    The date dimension does not depend on source data: it is generated once, on the first batch, for a
+    configured range of dates and left untouched afterwards.  Processors do not read it to resolve
+    date keys; they compute them with get_date_keys.
+    """
+
+    NAME = "date_dimension"
+
+    def __init__(
+        self,
+        connection=None,
+        first_date: date = DATE_DIM_FIRST_DATE,
+        last_date: date = DATE_DIM_LAST_DATE,
+        fiscal_year_start_month: int = FISCAL_YEAR_START_MONTH,
+        write_method="insert",
+        recreate=True,
+        export: Optional[StarExport] = None,
+    ):
+        """
+        Initialize DateDimensionProcessor
+        :param connection: mySQL connection created by the warehouse.  None is used for test.
+        :param first_date: first date of the date dimension
+        :param last_date: last date of the date dimension
+        :param fiscal_year_start_month: first month (1 to 12) of the fiscal year
+        :param write_method: load (LOAD DATA LOCAL INFILE) or insert (multi-row INSERT)
+        :param recreate: drop and recreate the date_dim table
+        :param export: optional StarExport publishing the date dimension once written
+        """
+        if write_method not in ["load", "insert"]:
+            raise Exception(
+                f"Unknown write method {write_method} for the date dimension"
+            )
+        if not 1 <= fiscal_year_start_month <= 12:
+            raise Exception(
+                f"Invalid fiscal year start month {fiscal_year_start_month}"
+            )
+
+        self._connection = connection
+        self._first_date = first_date
+        self._last_date = last_date
+        self._fiscal_year_start_month = fiscal_year_start_month
+        self._write_method = write_method
+        self._dimension_table = DateDimTable()
+        self._export = export
+        self._loaded = False
+        if connection:
+            cur = connection.cursor()
+            if recreate:
+                cur.execute(f"DROP TABLE IF EXISTS {self._dimension_table.get_name()};")
+            cur.execute(self._dimension_table.get_create_sql_mysql())
+
+    @staticmethod
+    def get_stage_tables() -> List[Table]:
+        """Return the stage tables read by process_update"""
+        return []
+
+    @staticmethod
+    def get_dependencies() -> List[str]:
+        """Return the names of the processors whose tables process_update reads"""
+        return []
+
+    def process_update(self, batch_id: int, last_batch_id: int = None) -> None:
+        """
+        Generate and write the date dimension unless the date_dim table was already loaded.
+
+        :param batch_id: Identifier for ETL process
+        :param last_batch_id: Optional last batch of an inclusive range of batches starting at batch_id
+        :return: None
+        """
+        if self._loaded:
+            return
+
+        table_name = self._dimension_table.get_name()
+        cur = self._connection.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM {table_name};")
+        if cur.fetchone()[0] == 0:
+            date_dim = build_date_dimension(
+                self._first_date, self._last_date, self._fiscal_year_start_month
+            )
+            if self._write_method == "load":
+                load_rows(self._connection, self._dimension_table, date_dim)
+            else:
+                insert_rows(self._connection, self._dimension_table, date_dim)
+            self._connection.commit()
+            print(
+                f"DateDimensionProcessor: {date_dim.shape[0]} dates written to {table_name} table"
+            )
+            if self._export is not None:
+                self._export.publish(table_name, batch_id, date_dim)
+        self._loaded = True
@@ -0,0 +1,86 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+UNKNOWN_KEY = -1  # dimension key of facts without a matching dimension row
+
+
+class DimensionKeyMap:
+    """
+    In-memory map from the natural keys of a dimension to the surrogate keys of its current rows, used by
+    fact processors to resolve dimension keys with vectorized lookups instead of joins in mySQL.
+
+    The map is loaded once and refreshed incrementally: surrogate keys only grow, so each refresh reads
+    the current rows above the highest surrogate key seen so far.  A new row version (type 2) has a
+    higher surrogate key than the row it replaces and takes its place in the map.
+
+    A refresh reads in the current transaction of the connection: the caller ends it before a refresh,
+    so the rows committed since by other connections are seen.
+    """
+
+    def __init__(
+        self,
+        connection,
+        table_name: str,
+        natural_key: str,
+        surrogate_key: str = "surrogate_key",
+        current_row_column: Optional[str] = "is_current_row",
+    ) -> None:
+        """
+        :param connection: mySQL connection
+        :param table_name: dimension table
+        :param natural_key: natural key column (need not be unique: the latest row wins)
+        :param surrogate_key: surrogate key column
+        :param current_row_column: optional flag of the current row versions
+        """
+        self._connection = connection
+        self._table_name = table_name
+        self._natural_key = natural_key
+        self._surrogate_key = surrogate_key
+        self._current_row_column = current_row_column
+        self._keys = pd.Series(
+            [], dtype="int64"
+        )  # surrogate keys indexed by natural key
+        self._max_surrogate_key = 0
+
+    def refresh(self) -> int:
+        """
+        Add the dimension rows written since the last refresh (all rows on the first call) to the map
+
+        :return: number of rows read
+        """
+        query = (
+            f"SELECT {self._natural_key}, {self._surrogate_key} FROM {self._table_name}"
+            f" WHERE {self._surrogate_key} > %s"
+        )
+        if self._current_row_column:
+            query += f" AND {self._current_row_column} = 1"
+        cur = self._connection.cursor()
+        cur.execute(query + ";", (self._max_surrogate_key,))
+        rows = cur.fetchall()
+        if not rows:
+            return 0
+
+        natural_keys, surrogate_keys = zip(*rows)
+        added = pd.Series(surrogate_keys, index=natural_keys, dtype="int64")
+        added = added.sort_values()
+        added = added[~added.index.duplicated(keep="last")]
+        # the added surrogate keys are higher than all in the map: they replace its entries
+        self._keys = pd.concat([self._keys[~self._keys.index.isin(added.index)], added])
+        self._max_surrogate_key = int(added.max())
+        return len(rows)
+
+    def lookup(self, natural_keys) -> np.ndarray:
+        """
+        Return the surrogate key of each natural key, UNKNOWN_KEY for missing or unknown natural keys
+
+        :param natural_keys: array-like of natural keys
+        :return: int64 array of surrogate keys
+        """
+        positions = self._keys.index.get_indexer(natural_keys)
+        # missing natural keys have position -1, which selects the appended UNKNOWN_KEY
+        return np.append(self._keys.to_numpy(), UNKNOWN_KEY)[positions].astype("int64")
+
+    def __len__(self) -> int:
+        return self._keys.shape[0]
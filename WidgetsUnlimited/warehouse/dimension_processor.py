@@ -0,0 +1,1115 @@
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import reduce
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame, Series, Index
+
+from model.metadata import Table
+from .batch_checkpoint import BatchCheckpoints, WRITTEN
+from .date_dimension import DateDimensionProcessor, get_date_keys
+from .mysql_writer import WRITE_CHUNK_ROWS, insert_rows, load_rows
+from .star_export import StarExport
+from .surrogate_key import SurrogateKeyAllocator
+from .warehouse_util import read_stage, get_stage_row_counts
+from .write_behind import WriteBehind
+
+# key sets up to this size are looked up with one parameterized IN list; larger ones are joined
+# through a temporary table
+READ_DIMENSION_IN_LIMIT = 1000
+READ_DIMENSION_INSERT_CHUNK = (
+    10000  # keys per multi-row insert into the temporary table
+)
+
+# how _write_dimension writes each operation:
+#   INSERT -- "load" (LOAD DATA LOCAL INFILE) or "insert" (multi-row INSERT)
+#   REPLACE -- "upsert" (multi-row INSERT ... ON DUPLICATE KEY UPDATE)
+WRITE_METHODS = {"INSERT": "insert", "REPLACE": "upsert"}
+
+# columns describing a row version rather than the dimension member, and the expiration date of
+# current rows.  attribute_hash holds a hash of all other columns.
+SCD_CONTROL_COLUMNS = [
+    "surrogate_key",
+    "effective_date",
+    "expiration_date",
+    "is_current_row",
+    "attribute_hash",
+    "last_update_date",
+]
+CURRENT_ROW_EXPIRATION_DATE = date(2099, 12, 31)
+
+# counts returned by process_update, summed over the partitions of a parallel update
+UPDATE_COUNTS = ["keys", "new", "updated", "skipped", "quarantined"]
+
+
+class ChildSpec:
+    """
+    Flattening of a child stage table (rows linked to the source table by their parent key) into
+    dimension columns, e.g. the billing address of a customer.
+    """
+
+    def __init__(
+        self,
+        table: Table,
+        mapping: Dict[str, str],
+        where: Optional[Tuple[str, Any]] = None,
+        column: Optional[str] = None,
+        parser: Optional[Callable[[Series], Tuple[DataFrame, Series]]] = None,
+    ):
+        """
+        :param table: child stage table, indexed by its parent key
+        :param mapping: dimension column -> child column, or parsed field with a parser
+        :param where: optional (column, value) selecting the child rows, e.g. the address type
+        :param column: child column split into fields by the parser
+        :param parser: vectorized parser returning the fields of the well formed values and the malformed
+        values.  Child rows with malformed values are quarantined.
+        """
+        if (column is None) != (parser is None):
+            raise Exception("A child column needs a parser and a parser needs a column")
+
+        self.table = table
+        self.mapping = mapping
+        self.where = where
+        self.column = column
+        self.parser = parser
+
+
+class DimensionSpec:
+    """
+    Declarative description of a dimension: its table, the stage tables it is built from and how stage
+    columns map to dimension columns.  The spec is checked against the table metadata once, when it is
+    created, and its transform applies all the mappings to a batch with column-wise (vectorized)
+    operations.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        dimension_table: Table,
+        natural_key: str,
+        source: Table,
+        mapping: Dict[str, str],
+        decoders: Optional[Dict[str, Callable[[Any], Any]]] = None,
+        children: Optional[List[ChildSpec]] = None,
+        new_row_mapping: Optional[Dict[str, str]] = None,
+        new_row_values: Optional[Dict[str, Any]] = None,
+        defaults: Optional[Dict[str, Any]] = None,
+        status: Optional[Tuple[str, str, str, str]] = None,
+        date_keys: Optional[Dict[str, str]] = None,
+        scd_type: int = 2,
+    ):
+        """
+        :param name: name of the processor (see TransformScheduler)
+        :param dimension_table: dimension table, with the SCD_CONTROL_COLUMNS
+        :param natural_key: dimension column holding the primary key of the source table
+        :param source: stage table with one row per dimension member
+        :param mapping: dimension column -> source column, copied as is
+        :param decoders: dimension column -> function translating the values of its source column
+        :param children: flattened child tables
+        :param new_row_mapping: dimension column -> source column, set on new rows only
+        :param new_row_values: dimension column -> value, set on new rows only
+        :param defaults: dimension column -> value of new rows without a value
+        :param status: optional (source flag, dimension flag, activation date column, deactivation date
+        column): the dates are reset on updates activating or deactivating a member
+        :param date_keys: dimension column -> DATE dimension column whose date key (see get_date_keys)
+        it holds
+        :param scd_type: 1 updates rows in place, 2 keeps history in row versions
+        """
+        self.name = name
+        self.dimension_table = dimension_table
+        self.natural_key = natural_key
+        self.source = source
+        self.mapping = mapping
+        self.decoders = decoders or {}
+        self.children = children or []
+        self.new_row_mapping = new_row_mapping or {}
+        self.new_row_values = new_row_values or {}
+        self.defaults = defaults or {}
+        self.status = status
+        self.date_keys = date_keys or {}
+        self.scd_type = scd_type
+        self._compile()
+
+    def _compile(self) -> None:
+        """Check the spec against the table metadata and collect the stage tables read"""
+
+        dimension_columns = set(self.dimension_table.get_column_names())
+        source_columns = set(self.source.get_column_names())
+
+        if self.scd_type not in [1, 2]:
+            raise Exception(f"{self.name}: unknown scd_type {self.scd_type}")
+        missing = set(SCD_CONTROL_COLUMNS) - dimension_columns
+        if missing:
+            raise Exception(f"{self.name}: missing control columns {sorted(missing)}")
+        if self.mapping.get(self.natural_key) != self.source.get_primary_key():
+            raise Exception(
+                f"{self.name}: natural key {self.natural_key} must map the source primary key"
+            )
+
+        targets = (
+            list(self.mapping)
+            + [k for child in self.children for k in child.mapping]
+            + list(self.new_row_mapping)
+            + list(self.new_row_values)
+            + list(self.defaults)
+            + list(self.status[1:] if self.status else [])
+            + list(self.date_keys)
+            + list(self.date_keys.values())
+        )
+        unknown = [k for k in targets if k not in dimension_columns]
+        if unknown:
+            raise Exception(f"{self.name}: unknown dimension columns {unknown}")
+
+        sources = list(self.mapping.values()) + list(self.new_row_mapping.values())
+        sources += [self.status[0]] if self.status else []
+        unknown = [v for v in sources if v not in source_columns]
+        unknown += [k for k in self.decoders if k not in self.mapping]
+        for child in self.children:
+            child_columns = child.table.get_column_names()
+            if child.table.get_parent_table() != self.source.get_name():
+                raise Exception(
+                    f"{self.name}: {child.table.get_name()} is not a child of {self.source.get_name()}"
+                )
+            unknown += [
+                v
+                for v in (
+                    ([child.column] if child.parser else list(child.mapping.values()))
+                    + ([child.where[0]] if child.where else [])
+                )
+                if v not in child_columns
+            ]
+        if unknown:
+            raise Exception(f"{self.name}: unknown stage columns {unknown}")
+
+        self._child_tables: List[Table] = []
+        for child in self.children:
+            if child.table.get_name() not in [t.get_name() for t in self._child_tables]:
+                self._child_tables.append(child.table)
+
+    def get_stage_tables(self) -> List[Table]:
+        """Return the source table followed by the distinct child tables"""
+        return [self.source] + self._child_tables
+
+    def get_child_tables(self) -> List[Table]:
+        return self._child_tables
+
+    def transform(
+        self,
+        source: DataFrame,
+        children: List[DataFrame],
+        quarantine: Optional[List[DataFrame]] = None,
+    ) -> DataFrame:
+        """
+        Transformations that apply to both inserts and updates.
+
+        - column to column mappings and decoders of the source table
+        - flattening (and parsing) of the child tables
+        - resolution of last_update_date as the latest update of the source and child rows
+
+        :param source: source stage data, indexed by its primary key
+        :param children: stage data of the child tables (get_child_tables), indexed by their parent key
+        :param quarantine: optional list collecting the child rows with malformed values
+        :return: a dimension dataframe with incremental changes.  Values not included in the stage data
+        (or in malformed values) are returned as null.
+        """
+
+        children = dict(zip([t.get_name() for t in self._child_tables], children))
+
+        # make empty dimension dataframe indexed by target keys
+        union_index = reduce(
+            lambda index, child: index.union(child.index),
+            children.values(),
+            source.index,
+        ).unique()
+        dimension = pd.DataFrame(
+            [], columns=self.dimension_table.get_column_names(), index=union_index
+        )
+
+        # work area to compute latest of the update dates
+        update_dates = pd.DataFrame(index=union_index, dtype="datetime64[ns]")
+
+        # simple copies and decodings from the source table
+        for k, v in self.mapping.items():
+            if v in source:
+                dimension[k] = source[v]
+        for k, decoder in self.decoders.items():
+            if self.mapping[k] in source:
+                dimension[k] = source[self.mapping[k]].map(decoder)
+
+        # flatten child rows where available
+        for i, child in enumerate(self.children):
+            child_stage = children[child.table.get_name()]
+            if child.where is not None:
+                child_stage = child_stage[child_stage[child.where[0]] == child.where[1]]
+
+            if child.parser is not None:
+                fields, malformed = child.parser(child_stage[child.column])
+                if quarantine is not None and malformed.size != 0:
+                    quarantine.append(child_stage.loc[malformed.index])
+            else:
+                fields = child_stage
+
+            if fields.size != 0:
+                update_dates[f"child_{i}"] = child_stage[child.table.get_updated_at()]
+                for k, v in child.mapping.items():
+                    dimension[k] = fields[v]
+
+        # set last_update_date to latest of the dates
+        update_dates["source"] = source[self.source.get_updated_at()]  # required column
+        dimension["last_update_date"] = update_dates.astype("datetime64[ns]").max(
+            axis=1
+        )
+
+        return dimension
+
+
+class DimensionProcessor:
+    """
+    Transform a dimension table in the mySQL star schema, as described by the DimensionSpec of the
+    subclass (SPEC).
+
+    The process_update method is called when a batch of incremental updates of source data is
+    available in data warehouse staging area.  New members are inserted; updated members are written
+    as new row versions (type 2) or in place (type 1) when any attribute changed.
+
+    The following naming conventions are used in the class:
+
+    pandas DataFrames
+
+    source - staged data of the source table
+    children - staged data of the child tables
+    dimension - mySQL star schema dimension data
+
+    pandas Indexes
+
+    incremental_keys - All natural keys present in batch
+    update_keys - Natural keys already in the star schema
+    new_keys - Natural keys not yet in the star schema
+    """
+
+    SPEC: DimensionSpec = None
+    NAME: str = None
+
+    def __init__(
+        self,
+        connection=None,
+        write_methods: Dict[str, str] = None,
+        recreate=True,
+        connection_factory: Optional[Callable] = None,
+        partitions: int = 1,
+        write_behind: bool = False,
+        checkpoints: Optional[BatchCheckpoints] = None,
+        export: Optional[StarExport] = None,
+    ):
+        """
+        :param connection: mySQL connection created by the warehouse.  None is used for test.
+        :param write_methods: optional overrides of WRITE_METHODS per operation, e.g. {"INSERT": "load"},
+        which needs a connection with allow_local_infile and local_infile enabled on the server.
+        :param recreate: drop and recreate the dimension table.  False continues with an existing
+        table, e.g. on restart of the warehouse or in a parallel worker.
+        :param connection_factory: picklable callable returning a new mySQL connection, used by the
+        worker processes of a parallel update
+        :param partitions: number of hash partitions of the natural keys updated in parallel worker
+        processes.  Needs a connection_factory.
+        :param write_behind: write each batch on a background thread and its own connection (see
+        WriteBehind), while the next batch is transformed.  Needs a connection_factory.
+        :param checkpoints: optional BatchCheckpoints recording the batches written by the processor
+        :param export: optional StarExport publishing the rows written by each batch, after their
+        commit
+        """
+        if (partitions > 1 or write_behind) and connection_factory is None:
+            raise Exception(
+                "A connection_factory is required for a partitioned or write-behind update"
+            )
+        if partitions > 1 and write_behind:
+            raise Exception("A partitioned update cannot write behind")
+
+        self._spec = self.SPEC
+        self._connection = connection
+        self._write_methods = {**WRITE_METHODS, **(write_methods or {})}
+        self._connection_factory = connection_factory
+        self._partitions = partitions
+        self._dimension_table = self._spec.dimension_table
+        self._next_surrogate_key = 1  # used without connection (test) only
+        self._surrogate_keys = None
+        self._quarantined: List[DataFrame] = []
+        self._checkpoints = checkpoints
+        self._export = export
+        self._writer = None
+        self._write_connection = None
+        # current rows of the writes not yet committed, by write sequence number
+        self._pending_rows: Dict[int, DataFrame] = {}
+        self._pending_lock = threading.Lock()
+        self._write_sequence = itertools.count()
+        if connection:
+            self._surrogate_keys = SurrogateKeyAllocator(
+                connection, self._dimension_table.get_name()
+            )
+            self._create_dimension(recreate)
+        if write_behind:
+            self._writer = WriteBehind(self.NAME)
+            if connection:
+                self._write_connection = connection_factory()
+
+    @classmethod
+    def get_stage_tables(cls) -> List[Table]:
+        """Return the stage tables read by process_update"""
+        return cls.SPEC.get_stage_tables()
+
+    @classmethod
+    def get_dependencies(cls) -> List[str]:
+        """Return the names of the processors whose tables process_update reads"""
+        return [DateDimensionProcessor.NAME] if cls.SPEC.date_keys else []
+
+    def _log(self, message: str, **kwargs) -> None:
+        print(f"{self.__class__.__name__}: {message}", **kwargs)
+
+    def process_update(
+        self,
+        batch_id: int,
+        last_batch_id: int = None,
+        partition: Optional[Tuple[int, int]] = None,
+    ) -> Dict[str, int]:
+        """
+        Perform the following steps to update the dimension table for an ETL batch
+
+        1) Read the source and child tables from stage area into dataframes
+        2) Compute incremental_keys
+        3) Load current dimension rows from mySQL to dataframe for incremental_keys
+        4) Compute new_keys and update_keys
+        5) Compute new and updated dimension records with the transformation of the spec
+        6) Write new records to the dimension table in mySQL
+        7) For updates changing any attribute: type 2, expire the current row and insert the update as
+        a new current row; type 1, update the row in place
+
+        A range of batches (e.g. for a backfill) is processed as one batch holding the latest staged version
+        of each record.
+
+        With partitions > 1 the natural keys are split by hash into partitions, each run through all the
+        steps in its own worker process and mySQL connection (see _process_partitions).
+
+        :param batch_id: Identifier for ETL process
+        :param last_batch_id: Optional last batch of an inclusive range of batches starting at batch_id
+        :param partition: Optional (partition, partitions): update only the natural keys of one hash
+        partition
+        :return: the UPDATE_COUNTS of the update
+        """
+
+        source_name = self._spec.source.get_name()
+        self._quarantined = []
+        counts = dict.fromkeys(UPDATE_COUNTS, 0)
+
+        # skip reading the stage files when the manifest shows an empty batch
+        row_counts = get_stage_row_counts(
+            batch_id, self.get_stage_tables(), last_batch_id
+        )
+        if row_counts is not None and sum(row_counts.values()) == 0:
+            self._log(f"0 unique {source_name} ids detected")
+            self._submit_checkpoint(batch_id, last_batch_id)
+            return counts
+
+        if self._partitions > 1 and partition is None:
+            counts = self._process_partitions(batch_id, last_batch_id)
+            self._submit_checkpoint(batch_id, last_batch_id)
+            return counts
+
+        source, children, changes = self._read_changes(batch_id, last_batch_id)
+        if changes is not None:
+            incremental_keys = changes.index
+        else:
+            incremental_keys = reduce(
+                lambda index, child: index.union(child.index), children, source.index
+            ).unique()
+        if partition is not None:
+            # the builders restrict the stage data to the keys of the partition
+            incremental_keys = incremental_keys[
+                get_hash_partitions(incremental_keys, partition[1]) == partition[0]
+            ]
+            self._quarantined = [
+                malformed[malformed.index.isin(incremental_keys)]
+                for malformed in self._quarantined
+            ]
+        self._log(f"{len(incremental_keys)} unique {source_name} ids detected", end=" ")
+        if incremental_keys.size == 0:
+            print()  # Add newline to 0 keys message
+            self._submit_checkpoint(batch_id, last_batch_id)
+            return counts
+
+        prior_dimension = self._read_current(self._spec.natural_key, incremental_keys)
+        update_keys = prior_dimension.index
+        new_keys = incremental_keys.difference(update_keys)
+        print(f"(New: {len(new_keys)})", end=" ")
+        print(f"(Updated: {len(update_keys)})")
+
+        inserts = self._build_new_dimension(new_keys, source, children, changes)
+        updates = self._build_update_dimension(
+            update_keys, prior_dimension, source, children, changes
+        )
+        if self._spec.scd_type == 2:
+            expirations, versions = self._build_versions(prior_dimension, updates)
+            expired = self._build_expired(prior_dimension, expirations)
+        else:
+            versions = updates[self._get_changed(prior_dimension, updates)]
+            expired = pd.DataFrame([])
+        self._log(f"{updates.shape[0] - versions.shape[0]} unchanged rows skipped")
+
+        quarantined = self.get_quarantined_rows()
+        if quarantined.shape[0] > 0:
+            self._log(f"{quarantined.shape[0]} malformed rows quarantined")
+
+        def write():
+            try:
+                self._write_dimension(inserts, "INSERT")
+
+                if self._spec.scd_type == 2:
+                    # expire the current rows and insert their new versions in one transaction
+                    self._expire_dimension(expirations)
+                    self._write_dimension(versions, "INSERT")
+                else:
+                    self._write_dimension(versions, "REPLACE")
+            except Exception:
+                # no partial write is committed with a later one
+                if self._get_write_connection() is not None:
+                    self._get_write_connection().rollback()
+                raise
+
+            self._publish(batch_id, [inserts, expired, versions])
+            if partition is None:
+                self._log(
+                    f"{self._count_dimension()} total rows in {self._dimension_table.get_name()} table"
+                )
+                self._record_written(batch_id, last_batch_id)
+
+        self._submit_write(write, [inserts, versions])
+
+        counts.update(
+            keys=len(incremental_keys),
+            new=len(new_keys),
+            updated=len(update_keys),
+            skipped=updates.shape[0] - versions.shape[0],
+            quarantined=quarantined.shape[0],
+        )
+        return counts
+
+    def _submit_write(
+        self, write: Callable[[], None], current_rows: List[DataFrame]
+    ) -> None:
+        """
+        Run the writes of a batch, or queue them to the writer with write-behind.  Until queued
+        writes are committed, the current rows they write overlay the dimension table rows read by
+        the next batches (see _read_current).
+
+        :param write: callable performing the writes
+        :param current_rows: the new current rows written
+        :return: None
+        """
+        if self._writer is None:
+            write()
+            return
+
+        sequence = next(self._write_sequence)
+        with self._pending_lock:
+            self._pending_rows[sequence] = pd.concat(
+                [rows for rows in current_rows if rows.shape[0] > 0]
+                or [pd.DataFrame([])]
+            )
+
+        def on_done():
+            with self._pending_lock:
+                del self._pending_rows[sequence]
+
+        self._writer.submit(write, on_done)
+
+    def _publish(self, batch_id: int, rows: List[DataFrame]) -> None:
+        """Publish the rows written by a batch to the export, once committed"""
+        rows = [r for r in rows if r.shape[0] > 0]
+        if self._export is not None and rows:
+            self._export.publish(
+                self._dimension_table.get_name(), batch_id, pd.concat(rows)
+            )
+
+    def _submit_checkpoint(self, batch_id: int, last_batch_id: Optional[int]) -> None:
+        """Record the written checkpoint of a batch without writes, after the writes queued before"""
+        if self._checkpoints is not None:
+            self._submit_write(
+                lambda: self._record_written(batch_id, last_batch_id), []
+            )
+
+    def _record_written(self, batch_id: int, last_batch_id: Optional[int]) -> None:
+        """
+        Record and commit the written checkpoint of a batch (see BatchCheckpoints) on the connection of
+        the writes.  A batch whose writes were committed without their checkpoint is rerun on restart:
+        its rows are then found unchanged and skipped.
+        """
+        if self._checkpoints is not None:
+            connection = self._get_write_connection()
+            self._checkpoints.record(
+                batch_id, WRITTEN, self.NAME, last_batch_id, connection
+            )
+            connection.commit()
+
+    def flush(self) -> None:
+        """Wait until the writes of all batches are committed (write-behind only)"""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def get_writer(self) -> Optional[WriteBehind]:
+        return self._writer
+
+    def _read_current(self, key_name: str, key_values: Index) -> DataFrame:
+        """
+        Read current rows from the dimension table (see _read_dimension), replaced by the current rows
+        of writes still queued to the writer.  The writer commits them before any later write, so the
+        transformation sees the dimension as if every earlier batch were written.
+
+        :param key_name: Name of the filter key, the natural key
+        :param key_values: Filter values
+        :return: A dataframe of the current rows, indexed by the key column
+        """
+        # queued rows are taken before the read: rows the writer has committed and dropped since are
+        # in its snapshot
+        with self._pending_lock:
+            pending = [
+                rows for rows in self._pending_rows.values() if rows.shape[0] > 0
+            ]
+        self._end_read()
+        prior_dimension = self._read_dimension(key_name, key_values)
+        if not pending:
+            return prior_dimension
+
+        pending = pd.concat(pending)  # in write order: the latest row of a key is last
+        pending = pending[~pending.index.duplicated(keep="last")]
+        pending = pending[pending.index.isin(key_values)]
+        if pending.shape[0] == 0:
+            return prior_dimension
+        return pd.concat(
+            [
+                prior_dimension[~prior_dimension.index.isin(pending.index)],
+                pending[prior_dimension.columns],
+            ]
+        )
+
+    def _end_read(self) -> None:
+        """
+        End the transaction of the read connection, so the next read takes a new snapshot.  A
+        REPEATABLE READ transaction keeps the snapshot of its first read, and with write-behind the
+        rows are committed on the writer's connection.
+        """
+        if self._connection is not None:
+            self._connection.commit()
+
+    def _get_write_connection(self):
+        """Return the connection of the writes: with write-behind, the writer's own connection"""
+        if self._write_connection is not None:
+            return self._write_connection
+        return self._connection
+
+    def _read_changes(
+        self, batch_id: int, last_batch_id: Optional[int]
+    ) -> Tuple[DataFrame, List[DataFrame], Optional[DataFrame]]:
+        """
+        Read the stage data of a batch
+
+        :return: the source and child stage data, and optionally the transformed changes of all
+        incremental keys when computed outside of pandas (None here)
+        """
+        source, *children = read_stage(
+            batch_id, self.get_stage_tables(), last_batch_id=last_batch_id
+        )
+        return source, children, None
+
+    def _get_worker_options(self) -> Dict[str, Any]:
+        """Return the constructor options, besides connection and write methods, of a partition worker"""
+        return {}
+
+    def _process_partitions(
+        self, batch_id: int, last_batch_id: Optional[int]
+    ) -> Dict[str, int]:
+        """
+        Update the dimension table with one worker process per hash partition of the natural keys.
+        Each worker reads the stage, transforms and writes its partition on its own connection,
+        drawing surrogate keys from its own reserved blocks.  A member's rows only depend on its
+        own stage records and dimension rows, so the result is that of a single process update
+        except for the surrogate key values.
+
+        The memory stage backend is only visible to workers started by fork.
+
+        :return: the UPDATE_COUNTS summed over the partitions
+        """
+
+        with ProcessPoolExecutor(max_workers=self._partitions) as executor:
+            futures = [
+                executor.submit(
+                    _process_partition,
+                    self.__class__,
+                    self._connection_factory,
+                    self._write_methods,
+                    {"export": self._export, **self._get_worker_options()},
+                    batch_id,
+                    last_batch_id,
+                    (partition, self._partitions),
+                )
+                for partition in range(self._partitions)
+            ]
+            results = [future.result() for future in futures]
+
+        counts = {name: sum(c[name] for c, _ in results) for name in UPDATE_COUNTS}
+        self._quarantined = [
+            quarantined for _, quarantined in results if quarantined.shape[0] > 0
+        ]
+        self._log(
+            f"{self._partitions} partitions:"
+            f" {counts['keys']} unique {self._spec.source.get_name()} ids"
+            f" (New: {counts['new']}) (Updated: {counts['updated']})"
+            f" (Unchanged: {counts['skipped']})"
+        )
+        self._log(
+            f"{self._count_dimension()} total rows in {self._dimension_table.get_name()} table"
+        )
+        return counts
+
+    def get_quarantined_rows(self) -> DataFrame:
+        """
+        Return the child stage records whose values could not be parsed in the last process_update.
+        Their fields were left out of the dimension records.
+        """
+        if not self._quarantined:
+            parsed = [child.table for child in self._spec.children if child.parser]
+            return pd.DataFrame(
+                [], columns=parsed[0].get_column_names() if parsed else []
+            )
+        return pd.concat(self._quarantined)
+
+    def _create_dimension(self, recreate=True):
+        """Create the dimension table on warehouse initialization, replacing any existing one when recreate"""
+
+        cur = self._connection.cursor()
+        if recreate:
+            cur.execute(f"DROP TABLE IF EXISTS {self._dimension_table.get_name()};")
+            self._surrogate_keys.reset()
+        cur.execute(self._dimension_table.get_create_sql_mysql())
+
+    def _hash_attributes(self, dimension: DataFrame) -> Series:
+        """
+        Return a 64 bit hash of the attributes (all columns but SCD_CONTROL_COLUMNS) of each row.  The
+        hash is computed vectorized on the conformed column types, with DATE columns at the day
+        precision stored in mySQL, and does not vary between runs.
+
+        :param dimension: dimension dataframe
+        :return: the hashes, as signed integers for the BIGINT attribute_hash column
+        """
+
+        pd_types = self._dimension_table.get_column_pandas_types()
+        attributes = {
+            col.get_name(): col.get_type()
+            for col in self._dimension_table.get_columns()
+            if col.get_name() not in SCD_CONTROL_COLUMNS
+        }
+        values = dimension[list(attributes)].astype(
+            {name: pd_types[name] for name in attributes}
+        )
+        for name, column_type in attributes.items():
+            if column_type == "DATE":
+                values[name] = values[name].dt.normalize()
+        hashes = pd.util.hash_pandas_object(values, index=False)
+
+        return pd.Series(hashes.to_numpy().view("int64"), index=dimension.index)
+
+    def _allocate_surrogate_keys(self, n_keys: int) -> range:
+        """Return a range of n_keys new surrogate keys"""
+
+        if self._surrogate_keys is None:
+            first_key = self._next_surrogate_key
+            self._next_surrogate_key += n_keys
+        else:
+            first_key = self._surrogate_keys.allocate(n_keys)
+        return range(first_key, first_key + n_keys)
+
+    def _read_dimension(self, key_name: str, key_values: Index) -> DataFrame:
+        """
+        Read current rows from the dimension table using a key filter
+
+        Up to READ_DIMENSION_IN_LIMIT keys are passed as parameters of an IN list.  Larger key sets
+        are bulk loaded into a temporary table joined to the dimension on its indexed key, keeping
+        statements well below max_allowed_packet whatever the batch size.
+
+        :param key_name: Name of the filter key
+        :param key_values: Filter values
+        :return: A dataframe of the result set, indexed by the key column
+        """
+
+        table_name = self._dimension_table.get_name()
+        keys = [int(k) for k in key_values]
+        if len(keys) <= READ_DIMENSION_IN_LIMIT:
+            key_substitutions = ",".join(["%s"] * len(keys))
+            query = (
+                f"SELECT * FROM {table_name}"
+                f" WHERE {key_name} IN ({key_substitutions}) AND is_current_row = 1;"
+            )
+            dimension_df = pd.read_sql_query(query, self._connection, params=keys)
+        else:
+            dimension_df = self._read_dimension_join(key_name, keys)
+        dimension_df = dimension_df.set_index(key_name, drop=False)
+
+        return dimension_df
+
+    def _read_dimension_join(self, key_name: str, keys: List[int]) -> DataFrame:
+        """Read current rows from the dimension table by joining to a temporary table of keys"""
+
+        table_name = self._dimension_table.get_name()
+        keys_table_name = f"{table_name}_{key_name}_lookup"
+        cur = self._connection.cursor()
+        cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {keys_table_name};")
+        cur.execute(
+            f"CREATE TEMPORARY TABLE {keys_table_name} ({key_name} INT PRIMARY KEY);"
+        )
+        try:
+            for i in range(0, len(keys), READ_DIMENSION_INSERT_CHUNK):
+                cur.executemany(
+                    f"INSERT IGNORE INTO {keys_table_name} ({key_name}) VALUES (%s)",
+                    [(k,) for k in keys[i : i + READ_DIMENSION_INSERT_CHUNK]],
+                )
+            query = (
+                f"SELECT d.* FROM {table_name} d"
+                f" JOIN {keys_table_name} k ON d.{key_name} = k.{key_name}"
+                f" WHERE d.is_current_row = 1;"
+            )
+            dimension_df = pd.read_sql_query(query, self._connection)
+        finally:
+            cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {keys_table_name};")
+
+        return dimension_df
+
+    def _write_dimension(self, dimension: DataFrame, operation: str) -> None:
+        """
+        Write a dataframe containing inserts or updates to the mySQL dimension table, with the
+        write method selected for the operation (see WRITE_METHODS).
+
+        load -- stream the rows as CSV through LOAD DATA LOCAL INFILE
+        insert -- multi-row INSERT statements of WRITE_CHUNK_ROWS rows
+        upsert -- multi-row INSERT ... ON DUPLICATE KEY UPDATE statements of WRITE_CHUNK_ROWS rows.
+        Unlike REPLACE, an update is done in place rather than a delete plus an insert.
+
+        :param dimension: dataframe conforming to the dimension schema
+        :param operation: INSERT/REPLACE -- mirror mySQL verbs for insert/upsert
+        :return: None
+        """
+        if dimension.shape[0] > 0:
+            connection = self._get_write_connection()
+            table_name = self._dimension_table.get_name()
+            method = self._write_methods[operation]
+            if method == "load":
+                load_rows(connection, self._dimension_table, dimension)
+            elif method in ["insert", "upsert"]:
+                insert_rows(
+                    connection,
+                    self._dimension_table,
+                    dimension,
+                    upsert=method == "upsert",
+                    chunk_rows=WRITE_CHUNK_ROWS,
+                )
+            else:
+                raise Exception(f"Unknown write method {method} for {operation}")
+
+            operation_text = "inserts" if operation == "INSERT" else "updates"
+            self._log(
+                f"{dimension.shape[0]} {operation_text} written to {table_name} table"
+            )
+
+            connection.commit()
+
+    def _expire_dimension(self, expirations: Series) -> None:
+        """
+        Expire current dimension rows, without commit.  Rows sharing an expiration date are expired
+        by one UPDATE over a list of surrogate keys (chunks of WRITE_CHUNK_ROWS keys).
+
+        :param expirations: expiration dates indexed by the surrogate keys of the rows to expire
+        :return: None
+        """
+        if expirations.shape[0] > 0:
+            table_name = self._dimension_table.get_name()
+            cur = self._get_write_connection().cursor()
+            for expiration_date, keys in expirations.groupby(
+                expirations
+            ).groups.items():
+                keys = [int(k) for k in keys]
+                for i in range(0, len(keys), WRITE_CHUNK_ROWS):
+                    chunk = keys[i : i + WRITE_CHUNK_ROWS]
+                    cur.execute(
+                        f"UPDATE {table_name} SET expiration_date = %s, is_current_row = 0"
+                        f" WHERE surrogate_key IN ({','.join(['%s'] * len(chunk))});",
+                        [expiration_date.date()] + chunk,
+                    )
+            self._log(f"{expirations.shape[0]} rows expired in {table_name} table")
+
+    def _count_dimension(self) -> int:
+        """Return number of rows in dimension table"""
+        table_name = self._dimension_table.get_name()
+        cur = self._get_write_connection().cursor()
+        cur.execute(f"SELECT COUNT(*) FROM {table_name};")
+        return cur.fetchone()[0]
+
+    @staticmethod
+    def overlay_changes(
+        prior_dimension: DataFrame, dimension: DataFrame, column_names
+    ) -> DataFrame:
+        """
+        Copy all non-null values of dimension over prior_dimension in one aligned operation; old
+        values not appearing in the incremental batch are preserved.  Columns without changes keep
+        their prior values and dtypes untouched.  The prior values are the ones masked, so categorical
+        changes need not share the categories of the prior values.
+
+        :param prior_dimension: dimension records read from the star schema
+        :param dimension: incremental changes from the transform
+        :param column_names: columns of the result
+        :return: a new dataframe with the index of prior_dimension
+        """
+        update_dim = prior_dimension.reindex(columns=column_names)
+        changes = dimension.reindex(
+            index=update_dim.index,
+            columns=[name for name in column_names if name in dimension],
+        )
+        mask = changes.notna()
+        changed_columns = mask.columns[mask.any()]
+        update_dim[changed_columns] = update_dim[changed_columns].mask(
+            mask[changed_columns], changes[changed_columns]
+        )
+        return update_dim
+
+    def _transform_keys(
+        self,
+        keys: Index,
+        source: DataFrame,
+        children: Optional[List[DataFrame]],
+        changes: Optional[DataFrame],
+    ) -> DataFrame:
+        """Apply the transform of the spec to the stage data of keys, or select their changes"""
+
+        if changes is not None:
+            return changes.loc[keys]
+        if isinstance(children, DataFrame):  # the only child table
+            children = [children]
+        children = [
+            child.loc[keys.intersection(child.index)] for child in children or []
+        ]
+        return self._spec.transform(source, children, self._quarantined)
+
+    def _build_new_dimension(
+        self,
+        new_keys: Index,
+        source: DataFrame,
+        children: Optional[List[DataFrame]] = None,
+        changes: Optional[DataFrame] = None,
+    ) -> DataFrame:
+        """
+        Create and initialize new records for the dimension table in star schema
+
+        :param new_keys: keys for records in batch not yet in star schema
+        :param source: staged source data
+        :param children: staged data of the child tables (a dataframe for a single child table)
+        :param changes: optional result of the transform for all incremental keys, replacing children
+        :return: a dimension dataframe ready to be written to mySQL
+        """
+
+        if len(new_keys) == 0:
+            return pd.DataFrame([])
+
+        # restrict stage data to new_keys
+        source = source.loc[new_keys.intersection(source.index)]
+        dimension = self._transform_keys(new_keys, source, children, changes)
+
+        # assign surrogate keys
+        dimension["surrogate_key"] = self._allocate_surrogate_keys(dimension.shape[0])
+
+        # initialize values for new records
+        for k, v in self._spec.new_row_values.items():
+            dimension[k] = v
+        for k, v in self._spec.new_row_mapping.items():
+            dimension[k] = source[v]
+        dimension["effective_date"] = (
+            source[self._spec.source.get_inserted_at()]
+            .reindex(dimension.index)
+            .fillna(dimension["last_update_date"])
+            .dt.normalize()
+        )
+        dimension["expiration_date"] = CURRENT_ROW_EXPIRATION_DATE
+        dimension["is_current_row"] = True
+
+        # apply default values
+        dimension = dimension.fillna(self._spec.defaults)
+        self._set_date_keys(dimension)
+        dimension["attribute_hash"] = self._hash_attributes(dimension)
+
+        # conform output types
+        return dimension.astype(self._dimension_table.get_column_pandas_types())
+
+    def _build_update_dimension(
+        self,
+        update_keys: Index,
+        prior_dimension: DataFrame,
+        source: DataFrame,
+        children: Optional[List[DataFrame]] = None,
+        changes: Optional[DataFrame] = None,
+    ) -> DataFrame:
+        """
+        Update existing records in the dimension table star schema
+
+        :param update_keys: keys for records in batch already in star schema
+        :param prior_dimension: current dimension rows read from the star schema
+        :param source: staged source data
+        :param children: staged data of the child tables (a dataframe for a single child table)
+        :param changes: optional result of the transform for all incremental keys, replacing children
+        :return: a dimension dataframe ready to be written to mySQL
+        """
+
+        if prior_dimension.shape[0] == 0:
+            return pd.DataFrame([])
+
+        # restrict stage data to update_keys
+        source = source.loc[update_keys.intersection(source.index)]
+        dimension = self._transform_keys(update_keys, source, children, changes)
+
+        # reset activation status and dates when change detected
+        source = source.reindex(update_keys)
+        if self._spec.status and self._spec.status[0] in source.columns:
+            source_flag, flag, activation_date, deactivation_date = self._spec.status
+            updated_at = source[self._spec.source.get_updated_at()]
+            # nullable booleans: an unknown status is no change
+            was_activated = (
+                (source[source_flag] == True) & (prior_dimension[flag] == False)
+            ).fillna(False)
+            was_deactivated = (
+                (source[source_flag] == False) & (prior_dimension[flag] == True)
+            ).fillna(False)
+
+            prior_dimension = prior_dimension.assign(
+                **{
+                    activation_date: prior_dimension[activation_date].mask(
+                        was_activated, updated_at
+                    ),
+                    deactivation_date: prior_dimension[deactivation_date]
+                    .mask(was_activated, CURRENT_ROW_EXPIRATION_DATE)
+                    .mask(was_deactivated, updated_at),
+                }
+            )
+
+        update_dim = self.overlay_changes(
+            prior_dimension, dimension, self._dimension_table.get_column_names()
+        )
+        self._set_date_keys(update_dim)
+        update_dim["attribute_hash"] = self._hash_attributes(update_dim)
+
+        # conform output types
+        return update_dim.astype(self._dimension_table.get_column_pandas_types())
+
+    def _set_date_keys(self, dimension: DataFrame) -> None:
+        """Set the date key columns of the spec from their dates"""
+        for k, v in self._spec.date_keys.items():
+            dimension[k] = get_date_keys(dimension[v])
+
+    def _get_changed(self, prior_dimension: DataFrame, update_dim: DataFrame) -> Series:
+        """
+        Select the updates changing any attribute (any column but SCD_CONTROL_COLUMNS), by comparing
+        their attribute_hash with the one stored in the current rows.  Current rows written without a
+        hash are hashed here.
+        """
+
+        if update_dim.shape[0] == 0:
+            return pd.Series([], dtype="bool")
+
+        prior_dimension = prior_dimension.reindex(index=update_dim.index)
+        if (
+            "attribute_hash" in prior_dimension
+            and prior_dimension["attribute_hash"].notna().all()
+        ):
+            prior_hash = prior_dimension["attribute_hash"].astype("int64")
+        else:
+            prior_hash = self._hash_attributes(prior_dimension)
+        return update_dim["attribute_hash"].ne(prior_hash)
+
+    def _build_expired(
+        self, prior_dimension: DataFrame, expirations: Series
+    ) -> DataFrame:
+        """
+        Return the current rows expired by _build_versions, as they are once expired
+
+        :param prior_dimension: current dimension rows read from the star schema
+        :param expirations: expiration dates indexed by surrogate keys of the rows to expire
+        :return: the expired rows
+        """
+        if expirations.shape[0] == 0:
+            return pd.DataFrame([])
+
+        expired = (
+            prior_dimension.set_index("surrogate_key", drop=False)
+            .loc[expirations.index]
+            .copy()
+        )
+        expired["expiration_date"] = expirations.to_numpy()
+        expired["is_current_row"] = False
+        return expired
+
+    def _build_versions(
+        self, prior_dimension: DataFrame, update_dim: DataFrame
+    ) -> Tuple[Series, DataFrame]:
+        """
+        Type 2 history: make the updates changing any attribute (see _get_changed) new current row
+        versions, effective at their last_update_date, which is also the expiration date of the current
+        rows they replace.
+
+        :param prior_dimension: current dimension rows read from the star schema
+        :param update_dim: updated dimension rows from _build_update_dimension
+        :return: expiration dates indexed by surrogate keys of the rows to expire, and the new row
+        versions (with surrogate keys assigned) ready to be written to mySQL
+        """
+
+        if update_dim.shape[0] == 0:
+            return pd.Series([], dtype="datetime64[ns]"), pd.DataFrame([])
+
+        is_changed = self._get_changed(prior_dimension, update_dim)
+        change_dates = update_dim.loc[is_changed, "last_update_date"].dt.normalize()
+        expirations = pd.Series(
+            change_dates.to_numpy(),
+            index=update_dim.loc[is_changed, "surrogate_key"].to_numpy(),
+        )
+
+        versions = update_dim[is_changed].copy()
+        versions["surrogate_key"] = self._allocate_surrogate_keys(versions.shape[0])
+        versions["effective_date"] = change_dates
+        versions["expiration_date"] = pd.Timestamp(CURRENT_ROW_EXPIRATION_DATE)
+        versions["is_current_row"] = True
+
+        return expirations, versions.astype(
+            self._dimension_table.get_column_pandas_types()
+        )
+
+
+def get_hash_partitions(keys: Index, partitions: int) -> np.ndarray:
+    """Return the hash partition (0 to partitions - 1) of each natural key"""
+    return pd.util.hash_array(keys.to_numpy(dtype="int64")) % partitions
+
+
+def _process_partition(
+    processor_class,
+    connection_factory: Callable,
+    write_methods: Dict[str, str],
+    options: Dict[str, Any],
+    batch_id: int,
+    last_batch_id: Optional[int],
+    partition: Tuple[int, int],
+) -> Tuple[Dict[str, int], DataFrame]:
+    """Worker process of a partitioned update: return the counts and quarantined rows of a partition"""
+
+    connection = connection_factory()
+    try:
+        processor = processor_class(
+            connection, write_methods, recreate=False, **options
+        )
+        counts = processor.process_update(batch_id, last_batch_id, partition=partition)
+        return counts, processor.get_quarantined_rows()
+    finally:
+        connection.close()
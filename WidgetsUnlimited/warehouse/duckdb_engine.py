@@ -0,0 +1,199 @@
+from typing import List, Optional, Tuple
+
+import duckdb
+import pyarrow.dataset as ds
+from pandas.core.frame import DataFrame
+
+from model.customer import CustomerTable
+from model.customer_address import CustomerAddressTable
+from model.customer_dim import CustomerDimTable
+from .customer_dimension import (
+    ADDRESS_PATTERN,
+    customer_dim_to_customer_mapping,
+    billing_to_customer_dim_mapping,
+    shipping_to_customer_dim_mapping,
+)
+from .warehouse_util import get_stage_dataset
+
+# parse_address component fields, in order of the ADDRESS_PATTERN groups
+ADDRESS_FIELDS = ["name", "street_number", "city", "state", "zip"]
+
+# customer columns the processor needs besides the transform (dates of new rows, activation changes)
+CUSTOMER_COLUMNS = [
+    "customer_id",
+    "customer_inserted_at",
+    "customer_updated_at",
+    "customer_is_active",
+]
+
+
+def duckdb_customer_transform(
+    batch_id: int,
+    last_batch_id: Optional[int] = None,
+    quarantine: Optional[List[DataFrame]] = None,
+) -> Tuple[DataFrame, DataFrame]:
+    """
+    The customer dimension transform (CustomerDimensionProcessor.customer_transform) as SQL run by an
+    embedded DuckDB over the stage data of a batch, or inclusive range of batches.
+
+    Parquet stage files are scanned by DuckDB's parallel parquet reader; other stage backends are
+    scanned through their arrow datasets.  Only the result is materialized in pandas, and DuckDB spills
+    to disk rather than holding the whole stage in memory.
+
+    :param batch_id: identifier of incremental batch (first batch of the range)
+    :param last_batch_id: optional last batch of an inclusive range of batches
+    :param quarantine: optional list collecting the customer_address records with malformed addresses
+    :return: the staged customers (CUSTOMER_COLUMNS) and the customer_dim dataframe with incremental
+    changes, both indexed by customer id
+    """
+    last_batch_id = last_batch_id or batch_id
+    connection = duckdb.connect()
+    try:
+        _create_stage_view(
+            connection, "customer_stage", CustomerTable(), batch_id, last_batch_id
+        )
+        _create_stage_view(
+            connection,
+            "customer_address_stage",
+            CustomerAddressTable(),
+            batch_id,
+            last_batch_id,
+        )
+        connection.execute(_get_transform_sql())
+
+        customer = connection.execute(
+            f"SELECT {', '.join(CUSTOMER_COLUMNS)} FROM customer;"
+        ).fetchdf()
+        customer = customer.set_index("customer_id", drop=False)
+
+        customer_dim = connection.execute(
+            "SELECT * FROM customer_dim_changes;"
+        ).fetchdf()
+        customer_dim = customer_dim.set_index("customer_id").reindex(
+            columns=CustomerDimTable().get_column_names()
+        )
+
+        if quarantine is not None:
+            malformed = connection.execute(
+                "SELECT * EXCLUDE (version) FROM customer_address"
+                " WHERE customer_address_type IN ('B', 'S') AND NOT is_valid_address;"
+            ).fetchdf()
+            if malformed.shape[0] != 0:
+                malformed = malformed.drop(
+                    columns=ADDRESS_FIELDS + ["is_valid_address"]
+                )
+                quarantine.append(malformed.set_index("customer_id", drop=False))
+    finally:
+        connection.close()
+
+    return customer, customer_dim
+
+
+def _create_stage_view(
+    connection, view_name: str, table, first_batch_id: int, last_batch_id: int
+) -> None:
+    """Create a view of the stage data of a table over an inclusive range of batches"""
+
+    dataset = get_stage_dataset(table, first_batch_id, last_batch_id)
+    if (
+        isinstance(dataset, ds.FileSystemDataset)
+        and isinstance(dataset.format, ds.ParquetFileFormat)
+        and dataset.files
+    ):
+        files = ", ".join("'" + path.replace("'", "''") + "'" for path in dataset.files)
+        source = f"read_parquet([{files}], hive_partitioning=true)"
+    else:
+        connection.register(f"{view_name}_arrow", dataset)
+        source = f"{view_name}_arrow"
+    connection.execute(
+        f"CREATE VIEW {view_name} AS SELECT * FROM {source}"
+        f" WHERE batch_id BETWEEN {int(first_batch_id)} AND {int(last_batch_id)};"
+    )
+
+
+def _get_transform_sql() -> str:
+    """Return the SQL creating the customer_dim_changes view from the customer stage views"""
+
+    pattern = "'" + ADDRESS_PATTERN.replace("'", "''") + "'"
+    address_fields = ",\n        ".join(
+        f"regexp_extract(customer_address, {pattern}, {i}) AS {field}"
+        for i, field in enumerate(ADDRESS_FIELDS, start=1)
+    )
+
+    customer_columns = ",\n    ".join(
+        f"c.{customer_column} AS {dim_column}"
+        for dim_column, customer_column in customer_dim_to_customer_mapping.items()
+        if dim_column not in ["referral_type", "age_cohort"]
+    )
+    address_columns = ",\n    ".join(
+        f"CASE WHEN {alias}.is_valid_address THEN {alias}.{field} END AS {dim_column}"
+        for alias, mapping in [
+            ("b", billing_to_customer_dim_mapping),
+            ("s", shipping_to_customer_dim_mapping),
+        ]
+        for dim_column, field in mapping.items()
+    )
+
+    return f"""
+CREATE VIEW customer AS
+SELECT * FROM (
+    SELECT *, row_number() OVER (PARTITION BY customer_id ORDER BY batch_id DESC) AS version
+    FROM customer_stage
+) WHERE version = 1;
+
+CREATE VIEW customer_address AS
+SELECT
+    *,
+    regexp_matches(customer_address, {pattern}) AS is_valid_address,
+    {address_fields}
+FROM (
+    SELECT *, row_number() OVER (PARTITION BY customer_address_id ORDER BY batch_id DESC) AS version
+    FROM customer_address_stage
+) WHERE version = 1;
+
+CREATE VIEW billing AS
+SELECT * FROM (
+    SELECT *, row_number() OVER (
+        PARTITION BY customer_id ORDER BY customer_address_updated_at DESC
+    ) AS address_rank
+    FROM customer_address WHERE customer_address_type = 'B'
+) WHERE address_rank = 1;
+
+CREATE VIEW shipping AS
+SELECT * FROM (
+    SELECT *, row_number() OVER (
+        PARTITION BY customer_id ORDER BY customer_address_updated_at DESC
+    ) AS address_rank
+    FROM customer_address WHERE customer_address_type = 'S'
+) WHERE address_rank = 1;
+
+CREATE VIEW customer_dim_changes AS
+WITH incremental_keys AS (
+    SELECT customer_id FROM customer UNION SELECT customer_id FROM customer_address
+)
+SELECT
+    k.customer_id,
+    {customer_columns},
+    CASE
+        WHEN c.customer_id IS NULL THEN NULL
+        WHEN upper(trim(c.customer_referral_type)) = 'OA' THEN 'Online Advertising'
+        WHEN upper(trim(c.customer_referral_type)) = 'AM' THEN 'Affiliate Marketing'
+        WHEN upper(trim(c.customer_referral_type)) = '' THEN 'None'
+        ELSE 'Unknown'
+    END AS referral_type,
+    CASE
+        WHEN c.customer_id IS NULL THEN NULL
+        WHEN c.customer_date_of_birth IS NULL THEN 'Unknown'
+        ELSE CAST(year(c.customer_date_of_birth) // 10 * 10 AS VARCHAR) || 's'
+    END AS age_cohort,
+    {address_columns},
+    greatest(
+        b.customer_address_updated_at,
+        s.customer_address_updated_at,
+        c.customer_updated_at
+    ) AS last_update_date
+FROM incremental_keys k
+LEFT JOIN customer c ON c.customer_id = k.customer_id
+LEFT JOIN billing b ON b.customer_id = k.customer_id
+LEFT JOIN shipping s ON s.customer_id = k.customer_id;
+"""
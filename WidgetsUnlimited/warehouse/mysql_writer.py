@@ -0,0 +1,96 @@
+import os
+import tempfile
+
+from pandas.core.frame import DataFrame
+
+from model.metadata import Table
+
+WRITE_CHUNK_ROWS = 1000  # rows per multi-row statement, well below max_allowed_packet
+
+
+def insert_rows(
+    connection,
+    table: Table,
+    df: DataFrame,
+    upsert: bool = False,
+    chunk_rows: int = WRITE_CHUNK_ROWS,
+) -> None:
+    """
+    Write rows with multi-row INSERT (... ON DUPLICATE KEY UPDATE) statements, without commit
+
+    :param connection: mySQL connection
+    :param table: table metadata
+    :param df: dataframe with the columns of table
+    :param upsert: update rows with an existing primary key in place
+    :param chunk_rows: rows per statement
+    :return: None
+    """
+
+    column_names = table.get_column_names()
+    values_substitutions = ",".join(["%s"] * len(column_names))
+    statement = f"INSERT INTO {table.get_name()} ({','.join(column_names)}) values ({values_substitutions})"
+    if upsert:
+        statement += " ON DUPLICATE KEY UPDATE " + ",".join(
+            f"{name}=VALUES({name})"
+            for name in column_names
+            if name != table.get_primary_key()
+        )
+
+    df = df[column_names]
+    cur = connection.cursor()
+    for i in range(0, df.shape[0], chunk_rows):
+        # executemany sends each chunk of an INSERT as one multi-row statement
+        chunk = df.iloc[i : i + chunk_rows].astype(object)
+        rows = chunk.where(chunk.notna(), None).to_numpy().tolist()  # NULL for NA
+        cur.executemany(statement, rows)
+
+
+def load_rows(
+    connection, table: Table, df: DataFrame, date_format: str = "%Y-%m-%d"
+) -> None:
+    """
+    Write rows with LOAD DATA LOCAL INFILE, without commit.  mysql-connector-python reads local infiles
+    by path, so the CSV is written to a temporary file (on tmpfs where available) and removed after the
+    load.  The connection needs allow_local_infile and the server local_infile.
+
+    :param connection: mySQL connection
+    :param table: table metadata
+    :param df: dataframe with the columns of table
+    :param date_format: format of datetime values (DATE columns by default)
+    :return: None
+    """
+
+    column_names = table.get_column_names()
+    csv_frame = df[column_names].copy()
+    for col in table.get_columns():
+        name = col.get_name()
+        if col.get_type() == "BOOLEAN":
+            csv_frame[name] = csv_frame[name].astype("Int64")
+        elif col.get_type() == "VARCHAR":
+            # backslash is the LOAD DATA escape character
+            csv_frame[name] = (
+                csv_frame[name]
+                .str.replace("\\", "\\\\", regex=False)
+                .str.replace("\n", "\\n", regex=False)
+            )
+
+    fd, path = tempfile.mkstemp(
+        suffix=".csv", dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+    )
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            csv_frame.to_csv(
+                f,
+                header=False,
+                index=False,
+                na_rep="\\N",
+                date_format=date_format,
+            )
+        cur = connection.cursor()
+        cur.execute(
+            f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table.get_name()}"
+            " CHARACTER SET utf8 FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"'"
+            f" LINES TERMINATED BY '\\n' ({','.join(column_names)});"
+        )
+    finally:
+        os.remove(path)
@@ -0,0 +1,40 @@
+from .dimension_processor import DimensionProcessor, DimensionSpec
+from model.product import ProductTable
+from model.product_dim import ProductDimTable
+
+# transformation mappings
+product_dim_to_product_mapping = {
+    "product_key": "product_id",
+    "name": "product_name",
+    "description": "product_description",
+    "category": "product_category",
+    "brand": "product_brand",
+    "preferred_supplier_key": "product_preferred_supplier_id",
+    "unit_cost": "product_unit_cost",
+    "length": "product_dimension_length",
+    "width": "product_dimension_width",
+    "height": "product_dimension_height",
+    "introduced_date": "product_introduced_date",
+    "is_discontinued": "product_discontinued",
+    "is_no_longer_offered": "product_no_longer_offered",
+}
+
+PRODUCT_DIMENSION = DimensionSpec(
+    "product_dimension",
+    ProductDimTable(),
+    natural_key="product_key",
+    source=ProductTable(),
+    mapping=product_dim_to_product_mapping,
+    date_keys={"introduced_date_key": "introduced_date"},
+    scd_type=2,
+)
+
+
+class ProductDimensionProcessor(DimensionProcessor):
+    """
+    Transform the product_dim table in the mySQL star schema, as described by PRODUCT_DIMENSION:
+    products keeping type 2 history, e.g. of their category and unit cost.
+    """
+
+    SPEC = PRODUCT_DIMENSION
+    NAME = PRODUCT_DIMENSION.name
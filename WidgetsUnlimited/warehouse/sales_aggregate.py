@@ -0,0 +1,206 @@
+"""
+Aggregate tables of the sales_fact table, maintained incrementally in the transaction appending
+each batch's facts.
+
+The aggregates assume immutable facts: a fact is appended once and never updated or deleted, and a
+fact keeps the dimension row versions of its sale.  Adding the contributions of the new facts of a
+batch (add_fact_delta) therefore keeps the aggregates equal to a full recompute.  Updates of a sale
+after its fact is appended are not applied to the fact nor to the aggregates; SalesFactProcessor
+rejects sources that may update the columns of a fact (see check_immutable_sources).  Any other
+change of the facts requires rebuild_aggregate.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame
+
+from model.metadata import Table
+from model.customer_dim import CustomerDimTable
+from model.sales_aggregate import DailyProductSalesTable, DailyCustomerCohortSalesTable
+from model.sales_fact import SalesFactTable
+
+# additive measures of the aggregates over the sales_fact rows (alias f)
+SALES_MEASURES = {
+    "sales_count": "COUNT(*)",
+    "quantity": "SUM(f.quantity)",
+    "total_price": "SUM(f.total_price)",
+}
+AGGREGATE_CHECK_TOLERANCE = 1e-6  # relative tolerance of measures in check_aggregate
+
+
+class AggregateSpec:
+    """
+    Declaration of an aggregate table of the sales_fact table: the grouping columns and the additive
+    measures (SALES_MEASURES) of its rows.
+
+    Facts are only appended (see SalesFactProcessor), and a fact keeps the dimension row versions of
+    its sale, so an aggregate is maintained by adding the contributions of each batch's new facts.
+    """
+
+    def __init__(
+        self,
+        table: Table,
+        group_by: Dict[str, str],
+        joins: str = "",
+        measures: Dict[str, str] = None,
+    ) -> None:
+        """
+        :param table: aggregate table, keyed by the group_by columns
+        :param group_by: mapping of aggregate columns to SQL expressions over the fact (alias f) and the
+        joined tables
+        :param joins: optional SQL joins of dimension tables to the fact
+        :param measures: mapping of aggregate columns to additive SQL aggregates (default
+        SALES_MEASURES)
+        """
+        self.table = table
+        self.group_by = group_by
+        self.joins = joins
+        self.measures = measures or SALES_MEASURES
+
+        if sorted(self.get_columns()) != sorted(table.get_column_names()):
+            raise Exception(
+                f"Aggregate {table.get_name()} columns do not match its table: {self.get_columns()}"
+            )
+        if sorted(table.get_primary_keys()) != sorted(self.group_by):
+            raise Exception(
+                f"Aggregate {table.get_name()} must be keyed by its group_by columns"
+            )
+
+    def get_name(self) -> str:
+        return self.table.get_name()
+
+    def get_columns(self) -> List[str]:
+        """Return the aggregate columns in the order of get_query"""
+        return list(self.group_by) + list(self.measures)
+
+    def get_query(self, where: str = "") -> str:
+        """
+        Return the SELECT computing the aggregate rows of the facts matching an optional WHERE clause,
+        with the columns of get_columns
+        """
+        group_by = ", ".join(
+            f"{expression} AS {name}" for name, expression in self.group_by.items()
+        )
+        measures = ", ".join(
+            f"{expression} AS {name}" for name, expression in self.measures.items()
+        )
+        return (
+            f"SELECT {group_by}, {measures} FROM {SalesFactTable.NAME} f{self.joins}"
+            f"{' WHERE ' + where if where else ''}"
+            f" GROUP BY {', '.join(self.group_by.values())}"
+        )
+
+
+SALES_AGGREGATES = [
+    AggregateSpec(
+        DailyProductSalesTable(),
+        group_by={"date_key": "f.date_key", "product_dim_key": "f.product_dim_key"},
+    ),
+    AggregateSpec(
+        DailyCustomerCohortSalesTable(),
+        group_by={
+            "date_key": "f.date_key",
+            "age_cohort": "COALESCE(c.age_cohort, 'Unknown')",
+        },
+        joins=f" LEFT JOIN {CustomerDimTable.NAME} c ON c.surrogate_key = f.customer_dim_key",
+    ),
+]
+
+
+def create_aggregates(connection, specs: List[AggregateSpec], recreate=True) -> None:
+    """Create the aggregate tables, replacing any existing ones when recreate"""
+
+    cur = connection.cursor()
+    for spec in specs:
+        if recreate:
+            cur.execute(f"DROP TABLE IF EXISTS {spec.get_name()};")
+        cur.execute(spec.table.get_create_sql_mysql())
+
+
+def add_fact_delta(
+    connection, specs: List[AggregateSpec], first_key: int, last_key: int
+) -> None:
+    """
+    Add the contributions of new facts to the aggregate tables, without commit.  The facts are read
+    back by their range of surrogate keys, inside the transaction appending them, so the aggregates
+    and the facts are committed together.
+
+    :param connection: mySQL connection of the transaction appending the facts
+    :param specs: the aggregates
+    :param first_key: first sales_key of the new facts
+    :param last_key: last sales_key of the new facts
+    :return: None
+    """
+
+    cur = connection.cursor()
+    for spec in specs:
+        cur.execute(
+            f"INSERT INTO {spec.get_name()} ({','.join(spec.get_columns())})"
+            f" {spec.get_query('f.sales_key BETWEEN %s AND %s')}"
+            " ON DUPLICATE KEY UPDATE "
+            + ",".join(f"{name}={name}+VALUES({name})" for name in spec.measures),
+            (first_key, last_key),
+        )
+
+
+def rebuild_aggregate(connection, spec: AggregateSpec) -> None:
+    """Recompute an aggregate table from all the facts, and commit"""
+
+    cur = connection.cursor()
+    cur.execute(f"DELETE FROM {spec.get_name()};")
+    cur.execute(
+        f"INSERT INTO {spec.get_name()} ({','.join(spec.get_columns())})"
+        f" {spec.get_query()}"
+    )
+    connection.commit()
+
+
+def check_aggregate(connection, spec: AggregateSpec) -> DataFrame:
+    """
+    Compare an aggregate table with a full recompute from the facts
+
+    :param connection: mySQL connection
+    :param spec: the aggregate
+    :return: the mismatched rows (see compare_aggregates), empty when consistent
+    """
+
+    columns = spec.get_columns()
+    stored = pd.read_sql_query(
+        f"SELECT {','.join(columns)} FROM {spec.get_name()};", connection
+    )
+    recomputed = pd.read_sql_query(spec.get_query() + ";", connection)
+    recomputed.columns = columns
+    connection.commit()  # end the read
+    return compare_aggregates(
+        stored, recomputed, list(spec.group_by), list(spec.measures)
+    )
+
+
+def compare_aggregates(
+    stored: DataFrame, recomputed: DataFrame, keys: List[str], measures: List[str]
+) -> DataFrame:
+    """
+    Return the aggregate rows whose measures differ between the stored and recomputed aggregates,
+    including rows missing on either side (as zero measures)
+
+    :param stored: aggregate table rows
+    :param recomputed: aggregate rows recomputed from the facts
+    :param keys: key columns of the aggregate (its group_by columns)
+    :param measures: measure columns
+    :return: stored and recomputed measures of the mismatched rows, indexed by the key columns
+    """
+
+    stored = stored.set_index(keys)[measures].astype("float64")
+    recomputed = recomputed.set_index(keys)[measures].astype("float64")
+    index = stored.index.union(recomputed.index)
+    stored = stored.reindex(index, fill_value=0.0)
+    recomputed = recomputed.reindex(index, fill_value=0.0)
+
+    is_equal = np.isclose(
+        stored.to_numpy(), recomputed.to_numpy(), rtol=AGGREGATE_CHECK_TOLERANCE
+    ).all(axis=1)
+    return pd.concat(
+        [stored.add_prefix("stored_"), recomputed.add_prefix("recomputed_")], axis=1
+    )[~is_equal]
@@ -0,0 +1,560 @@
+import itertools
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame, Series
+
+from model.metadata import Table
+from model.order import OrderTable
+from model.order_line_item import OrderLineItemTable
+from model.store_sales import StoreSalesTable
+from model.sales_fact import SalesFactTable
+from model.customer_dim import CustomerDimTable
+from model.product_dim import ProductDimTable
+from model.store_dim import StoreDimTable
+from .batch_checkpoint import BatchCheckpoints, WRITTEN
+from .customer_dimension import CustomerDimensionProcessor
+from .date_dimension import DateDimensionProcessor, get_date_keys
+from .product_dimension import ProductDimensionProcessor
+from .store_dimension import StoreDimensionProcessor
+from .dimension_key_map import DimensionKeyMap, UNKNOWN_KEY
+from .dimension_processor import READ_DIMENSION_IN_LIMIT, READ_DIMENSION_INSERT_CHUNK
+from .mysql_writer import insert_rows, load_rows
+from .sales_aggregate import (
+    SALES_AGGREGATES,
+    add_fact_delta,
+    check_aggregate,
+    create_aggregates,
+    rebuild_aggregate,
+)
+from .star_export import StarExport
+from .surrogate_key import SurrogateKeyAllocator
+from .warehouse_util import read_stage, get_stage_row_counts
+from .write_behind import WriteBehind
+
+ECOMMERCE_CHANNEL = "E-Commerce"
+STORE_CHANNEL = "Store"
+
+# stage columns the facts are built from: facts are immutable (see sales_aggregate), so the sources
+# may only update other columns (see check_immutable_sources)
+FACT_SOURCE_COLUMNS = {
+    OrderTable.NAME: ["order_id", "customer_id", "order_execution_time"],
+    OrderLineItemTable.NAME: [
+        "order_line_item_id",
+        "order_id",
+        "order_line_item_product_id",
+        "order_line_item_quantity",
+        "order_line_item_unit_price",
+        "order_line_item_total_price",
+        "order_line_item_inserted_at",
+    ],
+    StoreSalesTable.NAME: [
+        "store_sales_id",
+        "store_sales_store_id",
+        "store_sales_product_id",
+        "store_sales_quantity",
+        "store_sales_unit_price",
+        "store_sales_total_price",
+        "store_sales_transaction_date",
+        "store_sales_loyalty_number",
+    ],
+}
+
+
+def check_immutable_sources(tables: List[Table]) -> None:
+    """
+    Reject stage tables whose fact columns (FACT_SOURCE_COLUMNS) may be updated: the update of an
+    appended sale is not applied to its fact, nor to the aggregates of the facts
+
+    :param tables: stage tables read by the SalesFactProcessor
+    :return: None
+    """
+    for table in tables:
+        updatable = [
+            col.get_name()
+            for col in table.get_columns()
+            if col.get_name() in FACT_SOURCE_COLUMNS[table.get_name()]
+            and col.can_update()
+        ]
+        if updatable:
+            raise Exception(
+                f"SalesFactProcessor: facts are immutable, but {table.get_name()} may update {updatable}"
+            )
+
+
+class SalesFactProcessor:
+    """
+    Append the sales of a batch to the sales_fact table in the mySQL star schema, combining e-commerce
+    order line items and in-store sales.
+
+    Only sales without a fact are appended: facts are immutable, and the sources may only update columns
+    the facts are not built from (comments, card number), which check_immutable_sources asserts.  A
+    sale staged with its first version is new.  A sale inserted and updated within a batch (or range
+    of batches) is staged as an updated row: updated sales are looked up by source id among the facts
+    queued to the writer and the sales_fact table, so each sale is still appended once.  Dimension
+    keys are resolved through in-memory DimensionKeyMaps, loaded on the first batch and refreshed with
+    the dimension rows written since, after the dimension processors have run (see get_dependencies).
+    The date key is computed from the sale date (see get_date_keys).  E-commerce sales have no store:
+    their store key is UNKNOWN_KEY.
+
+    With write-behind the facts are appended on a background thread while the next batch is
+    transformed.  The channel and source ids of the queued facts are kept until their write ends, so
+    a later batch does not append an updated sale again.
+
+    Appending is not idempotent: with checkpoints, the facts of a batch and its written checkpoint are
+    committed in one transaction, so a restarted warehouse never appends them twice.
+
+    The aggregate tables of SALES_AGGREGATES are maintained in the same transaction, by adding the
+    contributions of the batch's facts (see add_fact_delta).
+
+    With an export, the facts of each batch are published to the parquet copy of the star schema once
+    committed (see StarExport).
+    """
+
+    NAME = "sales_fact"
+
+    def __init__(
+        self,
+        connection=None,
+        write_method="insert",
+        recreate=True,
+        connection_factory: Optional[Callable] = None,
+        write_behind: bool = False,
+        checkpoints: Optional[BatchCheckpoints] = None,
+        export: Optional[StarExport] = None,
+    ):
+        """
+        Initialize SalesFactProcessor
+        :param connection: mySQL connection created by the warehouse.  None is used for test.
+        :param write_method: load (LOAD DATA LOCAL INFILE) or insert (multi-row INSERT)
+        :param recreate: drop and recreate the sales_fact table
+        :param connection_factory: callable returning a new mySQL connection, used by the writer
+        :param write_behind: append each batch on a background thread and its own connection (see
+        WriteBehind).  Needs a connection_factory.
+        :param checkpoints: optional BatchCheckpoints recording the batches written by the processor
+        :param export: optional StarExport publishing the facts of each batch, after their commit
+        """
+        if write_method not in ["load", "insert"]:
+            raise Exception(f"Unknown write method {write_method} for sales facts")
+        if write_behind and connection_factory is None:
+            raise Exception(
+                "A connection_factory is required for a write-behind update"
+            )
+        check_immutable_sources(self.get_stage_tables())
+
+        self._connection = connection
+        self._write_method = write_method
+        self._fact_table = SalesFactTable()
+        self._next_surrogate_key = 1  # used without connection (test) only
+        self._surrogate_keys = None
+        self._customer_keys = None
+        self._loyalty_customer_keys = None
+        self._product_keys = None
+        self._store_keys = None
+        # channel and source id of the facts of the writes not yet committed, by write sequence number
+        self._pending_sales: Dict[int, DataFrame] = {}
+        self._pending_lock = threading.Lock()
+        self._write_sequence = itertools.count()
+        self._checkpoints = checkpoints
+        self._export = export
+        self._writer = None
+        self._write_connection = None
+        if connection:
+            self._surrogate_keys = SurrogateKeyAllocator(
+                connection, self._fact_table.get_name()
+            )
+            self._customer_keys = DimensionKeyMap(
+                connection, CustomerDimTable.NAME, "customer_key"
+            )
+            self._loyalty_customer_keys = DimensionKeyMap(
+                connection, CustomerDimTable.NAME, "loyalty_number"
+            )
+            self._product_keys = DimensionKeyMap(
+                connection, ProductDimTable.NAME, "product_key"
+            )
+            self._store_keys = DimensionKeyMap(
+                connection, StoreDimTable.NAME, "store_key"
+            )
+            self._create_fact(recreate)
+        if write_behind:
+            self._writer = WriteBehind(self.NAME)
+            if connection:
+                self._write_connection = connection_factory()
+
+    @staticmethod
+    def get_stage_tables() -> List[Table]:
+        """Return the stage tables read by process_update"""
+        return [OrderTable(), OrderLineItemTable(), StoreSalesTable()]
+
+    @staticmethod
+    def get_dependencies() -> List[str]:
+        """Return the names of the processors whose tables process_update reads"""
+        return [
+            CustomerDimensionProcessor.NAME,
+            DateDimensionProcessor.NAME,
+            ProductDimensionProcessor.NAME,
+            StoreDimensionProcessor.NAME,
+        ]
+
+    def process_update(self, batch_id: int, last_batch_id: int = None) -> None:
+        """
+        Append the sales inserted in a batch (or inclusive range of batches) to the sales_fact table.
+        Channels whose stage tables have no rows in the batch are skipped.
+
+        :param batch_id: Identifier for ETL process
+        :param last_batch_id: Optional last batch of an inclusive range of batches starting at batch_id
+        :return: None
+        """
+
+        row_counts = get_stage_row_counts(
+            batch_id, self.get_stage_tables(), last_batch_id
+        )
+
+        def is_staged(table: Table) -> bool:
+            return row_counts is None or row_counts[table.get_name()] > 0
+
+        self._refresh_key_maps()
+
+        facts = []
+        if is_staged(OrderLineItemTable()):
+            # orders of the line items are usually staged in the same batch
+            order = None
+            if is_staged(OrderTable()):
+                (order,) = read_stage(
+                    batch_id, [OrderTable()], last_batch_id=last_batch_id
+                )
+            (order_line_item,) = read_stage(
+                batch_id, [OrderLineItemTable()], last_batch_id=last_batch_id
+            )
+            facts.append(self._build_ecommerce_facts(order, order_line_item))
+        if is_staged(StoreSalesTable()):
+            (store_sales,) = read_stage(
+                batch_id, [StoreSalesTable()], last_batch_id=last_batch_id
+            )
+            facts.append(self._build_store_facts(store_sales))
+
+        facts = [f for f in facts if f.shape[0] > 0]
+        if not facts:
+            print("SalesFactProcessor: 0 sales detected")
+            self._submit_write(lambda: self._commit_written(batch_id, last_batch_id))
+            return
+
+        sales_fact = pd.concat(facts, ignore_index=True)
+        first_key = self._allocate_surrogate_keys(sales_fact.shape[0])
+        sales_fact["sales_key"] = np.arange(
+            first_key, first_key + sales_fact.shape[0], dtype="int64"
+        )
+        sales_fact = sales_fact.astype(self._fact_table.get_column_pandas_types())
+        for channel, n_facts in sales_fact["sales_channel"].value_counts().items():
+            print(f"SalesFactProcessor: {n_facts} {channel} sales detected")
+
+        last_key = first_key + sales_fact.shape[0] - 1
+        sequence = next(self._write_sequence)
+        with self._pending_lock:
+            self._pending_sales[sequence] = sales_fact[["sales_channel", "source_id"]]
+
+        def write():
+            try:
+                self._write_facts(sales_fact)
+                self._add_aggregates(first_key, last_key)
+                self._commit_written(batch_id, last_batch_id)
+            except Exception:
+                connection = self._write_connection or self._connection
+                if connection is not None:
+                    connection.rollback()
+                raise
+            finally:
+                # committed facts are read from sales_fact; the sales of a failed write are new again
+                with self._pending_lock:
+                    del self._pending_sales[sequence]
+
+            if self._export is not None:
+                self._export.publish(self._fact_table.get_name(), batch_id, sales_fact)
+
+        self._submit_write(write)
+
+    def _submit_write(self, write: Callable[[], None]) -> None:
+        """Run the writes of a batch, or queue them to the writer with write-behind"""
+        if self._writer is None:
+            write()
+        else:
+            self._writer.submit(write)
+
+    def _add_aggregates(self, first_key: int, last_key: int) -> None:
+        """Add the facts of a range of surrogate keys to the aggregate tables, without commit"""
+        connection = self._write_connection or self._connection
+        if connection is None:
+            return  # test
+        add_fact_delta(connection, SALES_AGGREGATES, first_key, last_key)
+        print(
+            f"SalesFactProcessor: {last_key - first_key + 1} facts added to {len(SALES_AGGREGATES)} aggregates"
+        )
+
+    def check_aggregates(self, rebuild=False) -> Dict[str, int]:
+        """
+        Compare each aggregate table with a full recompute from the facts (after flush, with write-behind)
+
+        :param rebuild: recompute the inconsistent aggregate tables
+        :return: number of mismatched aggregate rows per aggregate table
+        """
+        mismatches = {}
+        for spec in SALES_AGGREGATES:
+            mismatched = check_aggregate(self._connection, spec)
+            mismatches[spec.get_name()] = mismatched.shape[0]
+            print(
+                f"SalesFactProcessor: {mismatched.shape[0]} rows of {spec.get_name()} differ from recompute"
+            )
+            if rebuild and mismatched.shape[0] > 0:
+                rebuild_aggregate(self._connection, spec)
+                print(f"SalesFactProcessor: {spec.get_name()} rebuilt")
+        return mismatches
+
+    def _commit_written(self, batch_id: int, last_batch_id: Optional[int]) -> None:
+        """Record the written checkpoint of a batch in the transaction of its facts, and commit"""
+        connection = self._write_connection or self._connection
+        if connection is None:
+            return  # test
+        if self._checkpoints is not None:
+            self._checkpoints.record(
+                batch_id, WRITTEN, self.NAME, last_batch_id, connection
+            )
+        connection.commit()
+
+    def flush(self) -> None:
+        """Wait until the facts of all batches are committed (write-behind only)"""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def get_writer(self) -> Optional[WriteBehind]:
+        return self._writer
+
+    def _create_fact(self, recreate=True):
+        """
+        Create the sales_fact and aggregate tables on warehouse initialization, replacing any existing
+        ones when recreate
+        """
+
+        cur = self._connection.cursor()
+        if recreate:
+            cur.execute(f"DROP TABLE IF EXISTS {self._fact_table.get_name()};")
+            self._surrogate_keys.reset()
+        cur.execute(self._fact_table.get_create_sql_mysql())
+        create_aggregates(self._connection, SALES_AGGREGATES, recreate)
+
+    def _allocate_surrogate_keys(self, n_keys: int) -> int:
+        """Return the first of n_keys new surrogate keys"""
+
+        if self._surrogate_keys is None:
+            first_key = self._next_surrogate_key
+            self._next_surrogate_key += n_keys
+            return first_key
+        return self._surrogate_keys.allocate(n_keys)
+
+    def _select_new_sales(
+        self, channel: str, table: Table, sales: DataFrame
+    ) -> DataFrame:
+        """
+        Return the staged sales of a channel without a fact.  A sale staged with its first version
+        (inserted_at equal to updated_at) is new; an updated sale is new unless its fact was appended
+        (see _read_appended_sales).
+
+        :param channel: sales channel
+        :param table: source table of the sales, keyed by the source id
+        :param sales: staged sales
+        :return: the new sales
+        """
+
+        source_ids = sales[table.get_primary_key()]
+        is_updated = (
+            sales[table.get_inserted_at()] != sales[table.get_updated_at()]
+        ).to_numpy()
+        if not is_updated.any():
+            return sales
+
+        appended = self._read_appended_sales(channel, source_ids[is_updated])
+        return sales[~(is_updated & source_ids.isin(appended).to_numpy())]
+
+    def _read_appended_sales(self, channel: str, source_ids: Series) -> Set[int]:
+        """
+        Return the source ids of a channel whose facts were appended: queued to the writer or committed
+        to the sales_fact table.  The queued facts are taken before the read, so the facts the writer
+        commits meanwhile are in the snapshot of the read.
+
+        :param channel: sales channel
+        :param source_ids: source ids of updated sales
+        :return: the source ids with a fact
+        """
+
+        with self._pending_lock:
+            pending = list(self._pending_sales.values())
+        appended = set()
+        for sales in pending:
+            appended.update(
+                sales.loc[sales["sales_channel"] == channel, "source_id"].tolist()
+            )
+
+        appended.update(self._read_fact_source_ids(channel, source_ids))
+        return appended
+
+    def _read_fact_source_ids(self, channel: str, source_ids: Series) -> List[int]:
+        """
+        Return the source ids of a channel found in the sales_fact table, through its
+        (sales_channel, source_id) index.  Up to READ_DIMENSION_IN_LIMIT ids are passed as parameters of
+        an IN list; larger sets are bulk loaded into a temporary table joined to the facts.
+        """
+
+        if self._connection is None:
+            return []  # test
+        self._connection.commit()  # end the read transaction: read a new snapshot
+
+        table_name = self._fact_table.get_name()
+        ids = [int(i) for i in source_ids.unique()]
+        cur = self._connection.cursor()
+        if len(ids) <= READ_DIMENSION_IN_LIMIT:
+            cur.execute(
+                f"SELECT source_id FROM {table_name}"
+                f" WHERE sales_channel = %s AND source_id IN ({','.join(['%s'] * len(ids))});",
+                [channel] + ids,
+            )
+            return [source_id for (source_id,) in cur.fetchall()]
+
+        ids_table_name = f"{table_name}_source_id_lookup"
+        cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {ids_table_name};")
+        cur.execute(
+            f"CREATE TEMPORARY TABLE {ids_table_name} (source_id INT PRIMARY KEY);"
+        )
+        try:
+            for i in range(0, len(ids), READ_DIMENSION_INSERT_CHUNK):
+                cur.executemany(
+                    f"INSERT IGNORE INTO {ids_table_name} (source_id) VALUES (%s)",
+                    [(k,) for k in ids[i : i + READ_DIMENSION_INSERT_CHUNK]],
+                )
+            cur.execute(
+                f"SELECT f.source_id FROM {table_name} f"
+                f" JOIN {ids_table_name} k ON f.source_id = k.source_id"
+                f" WHERE f.sales_channel = %s;",
+                (channel,),
+            )
+            return [source_id for (source_id,) in cur.fetchall()]
+        finally:
+            cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {ids_table_name};")
+
+    def _refresh_key_maps(self) -> None:
+        """Add the dimension rows written since the last batch to the key maps"""
+
+        if self._connection is not None:
+            # end the read transaction: the dimension rows are committed by other connections
+            self._connection.commit()
+
+        for key_map in [
+            self._customer_keys,
+            self._loyalty_customer_keys,
+            self._product_keys,
+            self._store_keys,
+        ]:
+            if key_map is not None:
+                key_map.refresh()
+
+    @staticmethod
+    def _lookup(key_map: DimensionKeyMap, natural_keys) -> np.ndarray:
+        if key_map is None:
+            return np.full(len(natural_keys), UNKNOWN_KEY, dtype="int64")
+        return key_map.lookup(natural_keys)
+
+    def _build_ecommerce_facts(
+        self, order: DataFrame, order_line_item: DataFrame
+    ) -> DataFrame:
+        """
+        Build the facts of the new order line items of the batch (see _select_new_sales).  The order
+        date and customer come from the order staged with the line items; line items of orders outside
+        the batch are dated by their insertion and have an unknown customer.
+
+        :param order: staged orders indexed by order_id, or None
+        :param order_line_item: staged order line items indexed by order_id
+        :return: sales_fact dataframe without sales keys
+        """
+
+        line_item = self._select_new_sales(
+            ECOMMERCE_CHANNEL, OrderLineItemTable(), order_line_item
+        )
+        order_ids = line_item["order_id"].to_numpy()
+        if order is None:
+            order = pd.DataFrame(
+                {"customer_id": [], "order_execution_time": pd.to_datetime([])}
+            )
+        # order attributes of each line item, missing for orders outside the batch
+        line_order = order[["customer_id", "order_execution_time"]].reindex(order_ids)
+        customer_ids = line_order["customer_id"].to_numpy()
+        execution_time = line_order["order_execution_time"]
+        sales_dates = execution_time.where(
+            execution_time.notna(),
+            line_item["order_line_item_inserted_at"].to_numpy(),
+        )
+
+        return pd.DataFrame(
+            {
+                "date_key": get_date_keys(sales_dates),
+                "customer_dim_key": self._lookup(self._customer_keys, customer_ids),
+                "product_dim_key": self._lookup(
+                    self._product_keys,
+                    line_item["order_line_item_product_id"].to_numpy(),
+                ),
+                "store_dim_key": UNKNOWN_KEY,
+                "sales_channel": ECOMMERCE_CHANNEL,
+                "source_id": line_item["order_line_item_id"].to_numpy(),
+                "order_id": order_ids,
+                "quantity": line_item["order_line_item_quantity"].to_numpy(),
+                "unit_price": line_item["order_line_item_unit_price"].to_numpy(),
+                "total_price": line_item["order_line_item_total_price"].to_numpy(),
+            }
+        )
+
+    def _build_store_facts(self, store_sales: DataFrame) -> DataFrame:
+        """
+        Build the facts of the new store sales of the batch (see _select_new_sales).  The customer is
+        identified by the loyalty number of the sale.
+
+        :param store_sales: staged store sales
+        :return: sales_fact dataframe without sales keys
+        """
+
+        sales = self._select_new_sales(STORE_CHANNEL, StoreSalesTable(), store_sales)
+
+        return pd.DataFrame(
+            {
+                "date_key": get_date_keys(sales["store_sales_transaction_date"]),
+                "customer_dim_key": self._lookup(
+                    self._loyalty_customer_keys,
+                    sales["store_sales_loyalty_number"].to_numpy(),
+                ),
+                "product_dim_key": self._lookup(
+                    self._product_keys, sales["store_sales_product_id"].to_numpy()
+                ),
+                "store_dim_key": self._lookup(
+                    self._store_keys, sales["store_sales_store_id"].to_numpy()
+                ),
+                "sales_channel": STORE_CHANNEL,
+                "source_id": sales["store_sales_id"].to_numpy(),
+                "order_id": pd.NA,
+                "quantity": sales["store_sales_quantity"].to_numpy(),
+                "unit_price": sales["store_sales_unit_price"].to_numpy(),
+                "total_price": sales["store_sales_total_price"].to_numpy(),
+            }
+        )
+
+    def _write_facts(self, sales_fact: DataFrame) -> None:
+        """
+        Append facts to the mySQL sales_fact table, on the writer's connection with write-behind, without
+        commit (see _commit_written)
+        """
+
+        connection = self._write_connection or self._connection
+        if self._write_method == "load":
+            load_rows(connection, self._fact_table, sales_fact)
+        else:
+            insert_rows(connection, self._fact_table, sales_fact)
+        print(
+            f"SalesFactProcessor: {sales_fact.shape[0]} facts appended to {self._fact_table.get_name()} table"
+        )
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from model.metadata import Table
+
+# leading underscore hides the manifest from dataset readers
+MANIFEST_FILE_NAME = "_manifest.json"
+
+
+def get_index_column(table: Table) -> str:
+    """Return the column indexing (and pruning) stage data: the parent key if present, else primary key"""
+    return table.get_parent_key() if table.has_parent() else table.get_primary_key()
+
+
+def write_stage_manifest(batch_dir: str, batch_id: int, tables: List[Table]) -> Dict:
+    """
+    Describe the stage files of a batch in a manifest written to the batch directory.
+
+    Per table: schema fingerprint, total row count and the list of files.  Per file: relative path,
+    row count, min/max of the primary key, parent key (where present) and updated_at column, byte
+    size and sha256 checksum.  Statistics come from the parquet footers (or from the columns of arrow
+    IPC files).  The manifest is written under a temporary name and renamed, so readers see either no
+    manifest or a complete one.
+
+    :param batch_dir: stage directory of the batch
+    :param batch_id: identifier of incremental batch
+    :param tables: table metadata of the staged tables
+    :return: the manifest
+    """
+    manifest = {"batch_id": batch_id, "tables": {}}
+
+    for table in tables:
+        table_name = table.get_name()
+        stat_columns = {
+            "key": table.get_primary_key(),
+            "updated_at": table.get_updated_at(),
+        }
+        if table.has_parent():
+            stat_columns["parent_key"] = table.get_parent_key()
+
+        files = []
+        for file_name in sorted(os.listdir(os.path.join(batch_dir, table_name))):
+            if file_name.startswith((".", "_")):
+                continue
+            relative_path = os.path.join(table_name, file_name)
+            files.append(
+                _describe_file(os.path.join(batch_dir, relative_path), stat_columns)
+            )
+            files[-1]["path"] = relative_path
+
+        manifest["tables"][table_name] = {
+            "schema_fingerprint": table.get_schema_fingerprint(),
+            "row_count": sum(f["row_count"] for f in files),
+            "files": files,
+        }
+
+    manifest_file = os.path.join(batch_dir, MANIFEST_FILE_NAME)
+    temp_file = os.path.join(batch_dir, "." + MANIFEST_FILE_NAME + ".tmp")
+    with open(temp_file, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_file, manifest_file)
+
+    return manifest
+
+
+def read_stage_manifest(batch_dir: str) -> Optional[Dict]:
+    """Return the manifest of a batch directory, or None when the batch has no manifest"""
+    manifest_file = os.path.join(batch_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def validate_stage_manifest(
+    batch_dir: str, manifest: Dict, tables: List[Table], verify_checksums=False
+) -> None:
+    """
+    Check that the staged files of a batch are complete and match the expected tables, without reading
+    data: every table is present with the expected schema fingerprint and every file exists with
+    the recorded size.  Optionally verify the checksums, which does read the files.
+
+    :raise Exception: on the first inconsistency found
+    """
+    for table in tables:
+        table_name = table.get_name()
+        entry = manifest["tables"].get(table_name)
+        if entry is None:
+            raise Exception(
+                f"Stage batch {manifest['batch_id']} has no {table_name} data"
+            )
+        if entry["schema_fingerprint"] != table.get_schema_fingerprint():
+            raise Exception(
+                f"Stage schema of {table_name} in batch {manifest['batch_id']}"
+                f" does not match table metadata"
+            )
+        for file_entry in entry["files"]:
+            path = os.path.join(batch_dir, file_entry["path"])
+            if not os.path.exists(path):
+                raise Exception(f"Stage file {path} is missing")
+            if os.path.getsize(path) != file_entry["bytes"]:
+                raise Exception(f"Stage file {path} size does not match manifest")
+            if verify_checksums and _checksum(path) != file_entry["checksum"]:
+                raise Exception(f"Stage file {path} checksum does not match manifest")
+
+
+def prune_stage_files(table_entry: Dict, table: Table, key_range=None) -> List[str]:
+    """
+    Return the relative paths of the files of a manifest table entry that may hold rows.  Empty files
+    are skipped and, given an inclusive (low, high) key_range on the index column, so are files whose
+    recorded key range does not overlap it.
+    """
+    stat = "parent_key" if table.has_parent() else "key"
+    paths = []
+    for file_entry in table_entry["files"]:
+        if file_entry["row_count"] == 0:
+            continue
+        if key_range is not None:
+            low, high = key_range
+            if file_entry[f"max_{stat}"] < low or file_entry[f"min_{stat}"] > high:
+                continue
+        paths.append(file_entry["path"])
+    return paths
+
+
+def _describe_file(path: str, stat_columns: Dict[str, str]) -> Dict:
+    """Collect row count, column min/max statistics, size and checksum of one stage file"""
+    if path.endswith(".arrow"):
+        file_entry = _describe_ipc_file(path, stat_columns)
+    else:
+        file_entry = _describe_parquet_file(path, stat_columns)
+
+    file_entry["bytes"] = os.path.getsize(path)
+    file_entry["checksum"] = _checksum(path)
+    return file_entry
+
+
+def _describe_parquet_file(path: str, stat_columns: Dict[str, str]) -> Dict:
+    """Row count and min/max statistics from the row group statistics of a parquet footer"""
+    metadata = pq.read_metadata(path)
+    column_index = {
+        metadata.schema.column(i).name: i for i in range(metadata.num_columns)
+    }
+
+    file_entry = {"row_count": metadata.num_rows}
+    for stat, column_name in stat_columns.items():
+        minimum, maximum = None, None
+        for i in range(metadata.num_row_groups):
+            statistics = (
+                metadata.row_group(i).column(column_index[column_name]).statistics
+            )
+            if statistics is None or not statistics.has_min_max:
+                continue
+            minimum = (
+                statistics.min if minimum is None else min(minimum, statistics.min)
+            )
+            maximum = (
+                statistics.max if maximum is None else max(maximum, statistics.max)
+            )
+        file_entry[f"min_{stat}"] = _json_value(minimum)
+        file_entry[f"max_{stat}"] = _json_value(maximum)
+
+    return file_entry
+
+
+def _describe_ipc_file(path: str, stat_columns: Dict[str, str]) -> Dict:
+    """Row count and min/max statistics computed over the memory mapped columns of an arrow IPC file"""
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        file_entry = {"row_count": table.num_rows}
+        for stat, column_name in stat_columns.items():
+            min_max = pc.min_max(table.column(column_name))
+            file_entry[f"min_{stat}"] = _json_value(min_max["min"].as_py())
+            file_entry[f"max_{stat}"] = _json_value(min_max["max"].as_py())
+    return file_entry
+
+
+def _json_value(value):
+    """Represent statistics values (ints or timestamps) in json"""
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _checksum(path: str) -> str:
+    """Return the sha256 checksum of a file"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return "sha256:" + sha256.hexdigest()
@@ -0,0 +1,308 @@
+import os
+import shutil
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pandas.core.frame import DataFrame
+
+from model.metadata import Table
+from .warehouse_util import get_arrow_schema, stage_writer
+
+# each table is exported to parquet files under EXPORT_ROOT/<table>:
+#   changes/batch_id=<n>/part-<k>.parquet -- rows written by batch n, not yet compacted
+#   snapshot/as_of=<n>/<column>=<v>/part-<i>.parquet -- latest version of every row as of batch n
+EXPORT_ROOT = "/tmp/warehouse/export"
+
+# hive partition column of the snapshot of a table
+EXPORT_PARTITIONS = {"sales_fact": "date_key"}
+EXPORT_COMPACT_BATCHES = 10  # uncompacted batches of a table triggering compaction
+
+
+class StarExport:
+    """
+    Columnar copy of the star schema in parquet files, so analytical scans read column files instead
+    of the mySQL row store.
+
+    The processors publish the rows they write in each batch, after their commit: new dimension rows,
+    the rows updated in place or expired and the appended facts.  The rows of a batch are the changes
+    partition of that batch.  Compaction merges the changes into the snapshot, the latest version of
+    every row by primary key, partitioned by EXPORT_PARTITIONS.  read_current overlays the uncompacted
+    changes on the snapshot: it returns the table as committed in mySQL (every version of a type 2
+    dimension; filter is_current_row for the current ones).
+
+    A snapshot is written in full under a new directory before the compacted changes are removed, so
+    a failed compaction leaves the previous snapshot and the changes in place.  Rows committed in
+    mySQL whose publication failed are restored by reload.
+    """
+
+    def __init__(
+        self,
+        tables: List[Table],
+        root: str = EXPORT_ROOT,
+        recreate=True,
+        partitions: Dict[str, str] = None,
+        compact_batches: int = EXPORT_COMPACT_BATCHES,
+    ) -> None:
+        """
+        :param tables: the exported star schema tables, keyed by their primary key
+        :param root: root directory of the export
+        :param recreate: remove the export of an earlier run
+        :param partitions: snapshot partition column per table name (default EXPORT_PARTITIONS)
+        :param compact_batches: number of uncompacted batches of a table triggering compaction (see
+        compact_due)
+        """
+        self._tables = {table.get_name(): table for table in tables}
+        self._root = root
+        self._partitions = EXPORT_PARTITIONS if partitions is None else partitions
+        self._compact_batches = compact_batches
+
+        if recreate:
+            for name in self._tables:
+                shutil.rmtree(self._get_table_dir(name), ignore_errors=True)
+
+    def publish(self, table_name: str, batch_id: int, rows: DataFrame) -> None:
+        """
+        Export the rows written to a table by a batch, as a new file of the batch's changes partition
+
+        :param table_name: name of the exported table
+        :param batch_id: identifier of the batch (first batch of a range)
+        :param rows: the rows as written to mySQL, with all the table's columns
+        :return: None
+        """
+        if rows.shape[0] == 0:
+            return
+
+        table = self._tables[table_name]
+        arrow_table = _to_arrow(table, rows)
+        batch_dir = os.path.join(
+            self._get_table_dir(table_name), "changes", f"batch_id={batch_id}"
+        )
+        os.makedirs(batch_dir, exist_ok=True)
+        # file names sort in publication order, the order in which later versions replace earlier ones
+        path = os.path.join(
+            batch_dir, f"part-{time.time_ns():020d}-{os.getpid()}.parquet"
+        )
+        with stage_writer(path, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        print(
+            f"StarExport: {rows.shape[0]} rows of batch {batch_id} exported to {table_name}"
+        )
+
+    def get_table_names(self) -> List[str]:
+        return list(self._tables)
+
+    def get_snapshot_batch(self, table_name: str) -> Optional[int]:
+        """Return the last batch compacted into the snapshot of a table, None without snapshot"""
+        as_of = _list_partitions(
+            os.path.join(self._get_table_dir(table_name), "snapshot"), "as_of"
+        )
+        return as_of[-1] if as_of else None
+
+    def get_uncompacted_batches(self, table_name: str) -> List[int]:
+        """Return the batches of the changes not yet compacted into the snapshot of a table, in order"""
+        snapshot_batch = self.get_snapshot_batch(table_name)
+        batches = _list_partitions(
+            os.path.join(self._get_table_dir(table_name), "changes"), "batch_id"
+        )
+        return [b for b in batches if snapshot_batch is None or b > snapshot_batch]
+
+    def read_current(
+        self,
+        table_name: str,
+        columns: Optional[List[str]] = None,
+        filter: Optional[ds.Expression] = None,
+    ) -> pa.Table:
+        """
+        Read the current rows of an exported table: the snapshot, with the rows of the uncompacted
+        changes replacing the snapshot rows of their primary keys
+
+        :param table_name: name of the exported table
+        :param columns: optional columns to read (default all)
+        :param filter: optional filter expression, pushed down to the snapshot files
+        :return: arrow table of the rows
+        """
+        return self._read_current(
+            table_name, self.get_uncompacted_batches(table_name), columns, filter
+        )
+
+    def compact(self, table_name: str, last_batch_id: Optional[int] = None) -> int:
+        """
+        Merge the uncompacted changes of a table (up to a batch) into a new snapshot.  Not to be run
+        while the table's changes are published, except for batches after last_batch_id.
+
+        :param table_name: name of the exported table
+        :param last_batch_id: optional last batch to compact (default all)
+        :return: number of batches compacted
+        """
+        batches = [
+            b
+            for b in self.get_uncompacted_batches(table_name)
+            if last_batch_id is None or b <= last_batch_id
+        ]
+        if not batches:
+            return 0
+
+        current = self._read_current(table_name, batches)
+        self._write_snapshot(table_name, current, batches[-1])
+        print(
+            f"StarExport: {len(batches)} batches compacted into {current.num_rows} rows"
+            f" of {table_name} (as of batch {batches[-1]})"
+        )
+        return len(batches)
+
+    def compact_due(self, last_batch_id: int) -> None:
+        """Compact the tables having compact_batches uncompacted batches up to a batch"""
+        for table_name in self._tables:
+            batches = [
+                b
+                for b in self.get_uncompacted_batches(table_name)
+                if b <= last_batch_id
+            ]
+            if len(batches) >= self._compact_batches:
+                self.compact(table_name, last_batch_id)
+
+    def reload(self, table_name: str, connection, batch_id: int) -> None:
+        """
+        Replace the export of a table with a full read of its mySQL table, once every batch up to
+        batch_id is written, e.g. to recover from a failed publication or to start the export of an
+        existing warehouse
+
+        :param table_name: name of the exported table
+        :param connection: mySQL connection
+        :param batch_id: last batch written to the table
+        :return: None
+        """
+        table = self._tables[table_name]
+        rows = pd.read_sql_query(
+            f"SELECT {','.join(table.get_column_names())} FROM {table_name};",
+            connection,
+        )
+        connection.commit()  # end the read
+        self._write_snapshot(table_name, _to_arrow(table, rows), batch_id)
+        print(f"StarExport: {rows.shape[0]} rows of {table_name} reloaded")
+
+    def _get_table_dir(self, table_name: str) -> str:
+        return os.path.join(self._root, table_name)
+
+    def _get_change_files(self, table_name: str, batches: List[int]) -> List[str]:
+        """Return the files of the changes of batches, in publication order"""
+        changes_dir = os.path.join(self._get_table_dir(table_name), "changes")
+        files = []
+        for batch_id in batches:
+            batch_dir = os.path.join(changes_dir, f"batch_id={batch_id}")
+            files += [
+                os.path.join(batch_dir, file_name)
+                for file_name in sorted(os.listdir(batch_dir))
+                if not file_name.startswith(".")
+            ]
+        return files
+
+    def _get_partitioning(self, table_name: str) -> Optional[ds.Partitioning]:
+        column = self._partitions.get(table_name)
+        if column is None:
+            return None
+        schema = get_arrow_schema(self._tables[table_name])
+        return ds.partitioning(pa.schema([schema.field(column)]), flavor="hive")
+
+    def _read_current(
+        self,
+        table_name: str,
+        batches: List[int],
+        columns: Optional[List[str]] = None,
+        filter: Optional[ds.Expression] = None,
+    ) -> pa.Table:
+        """Read the snapshot of a table with the changes of batches overlaid (see read_current)"""
+
+        table = self._tables[table_name]
+        key = table.get_primary_key()
+        schema = get_arrow_schema(table)
+        columns = columns or schema.names
+
+        # the latest change of each key: the changes are small, and read in full
+        changes = [
+            pq.read_table(path).cast(schema)
+            for path in self._get_change_files(table_name, batches)
+        ]
+        changes = pa.concat_tables(changes) if changes else schema.empty_table()
+        is_latest = ~changes[key].to_pandas().duplicated(keep="last").to_numpy()
+        changes = changes.filter(pa.array(is_latest))
+        replaced = pa.array(changes[key].to_numpy())
+        if filter is not None:
+            changes = ds.InMemoryDataset(changes).to_table(filter=filter)
+
+        parts = [changes.select(columns)]
+        snapshot_batch = self.get_snapshot_batch(table_name)
+        if snapshot_batch is not None:
+            snapshot = ds.dataset(
+                os.path.join(
+                    self._get_table_dir(table_name),
+                    "snapshot",
+                    f"as_of={snapshot_batch}",
+                ),
+                schema=schema,
+                format="parquet",
+                partitioning=self._get_partitioning(table_name),
+            )
+            expression = ~ds.field(key).isin(replaced)
+            if filter is not None:
+                expression = expression & filter
+            parts.insert(0, snapshot.to_table(columns=columns, filter=expression))
+
+        return pa.concat_tables(
+            [part.cast(pa.schema([schema.field(c) for c in columns])) for part in parts]
+        )
+
+    def _write_snapshot(self, table_name: str, current: pa.Table, as_of: int) -> None:
+        """
+        Write the snapshot of a table as of a batch, then remove the earlier snapshots and the changes
+        it includes
+        """
+        table_dir = self._get_table_dir(table_name)
+        snapshot_dir = os.path.join(table_dir, "snapshot")
+        temp_dir = os.path.join(snapshot_dir, f".as_of={as_of}.tmp")
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        ds.write_dataset(
+            current,
+            temp_dir,
+            format="parquet",
+            partitioning=self._get_partitioning(table_name),
+            basename_template="part-{i}.parquet",
+        )
+        os.makedirs(temp_dir, exist_ok=True)  # no file is written for an empty table
+        shutil.rmtree(os.path.join(snapshot_dir, f"as_of={as_of}"), ignore_errors=True)
+        os.rename(temp_dir, os.path.join(snapshot_dir, f"as_of={as_of}"))
+
+        for earlier in _list_partitions(snapshot_dir, "as_of"):
+            if earlier < as_of:
+                shutil.rmtree(os.path.join(snapshot_dir, f"as_of={earlier}"))
+        changes_dir = os.path.join(table_dir, "changes")
+        for batch_id in _list_partitions(changes_dir, "batch_id"):
+            if batch_id <= as_of:
+                shutil.rmtree(os.path.join(changes_dir, f"batch_id={batch_id}"))
+
+
+def _list_partitions(directory: str, name: str) -> List[int]:
+    """Return the sorted integer values of the hive partitions <name>=<value> of a directory"""
+    if not os.path.isdir(directory):
+        return []
+    prefix = f"{name}="
+    return sorted(
+        int(entry[len(prefix) :])
+        for entry in os.listdir(directory)
+        if entry.startswith(prefix)
+    )
+
+
+def _to_arrow(table: Table, rows: DataFrame) -> pa.Table:
+    """Convert dimension or fact rows to an arrow table of the table's export schema"""
+    rows = rows[table.get_column_names()].copy()
+    for col in table.get_columns():
+        if col.get_type() in ["DATE", "TIMESTAMP"]:
+            rows[col.get_name()] = pd.to_datetime(rows[col.get_name()])
+    return pa.Table.from_pandas(
+        rows, schema=get_arrow_schema(table), preserve_index=False
+    )
@@ -0,0 +1,43 @@
+from .dimension_processor import DimensionProcessor, DimensionSpec, ChildSpec
+from model.store import StoreTable
+from model.store_location import StoreLocationTable
+from model.store_dim import StoreDimTable
+
+# transformation mappings
+store_dim_to_store_mapping = {
+    "store_key": "store_id",
+    "name": "store_name",
+    "manager_name": "store_manager_name",
+    "number_of_employees": "store_number_of_employees",
+    "opened_date": "store_opened_date",
+    "closed_date": "store_closed_date",
+}
+
+store_location_to_store_dim_mapping = {
+    "street_address": "store_location_street_address",
+    "city": "store_location_city",
+    "state": "store_location_state",
+    "zip_code": "store_location_zip_code",
+    "sq_footage": "store_location_sq_footage",
+}
+
+STORE_DIMENSION = DimensionSpec(
+    "store_dimension",
+    StoreDimTable(),
+    natural_key="store_key",
+    source=StoreTable(),
+    mapping=store_dim_to_store_mapping,
+    children=[ChildSpec(StoreLocationTable(), store_location_to_store_dim_mapping)],
+    date_keys={"opened_date_key": "opened_date", "closed_date_key": "closed_date"},
+    scd_type=1,
+)
+
+
+class StoreDimensionProcessor(DimensionProcessor):
+    """
+    Transform the store_dim table in the mySQL star schema, as described by STORE_DIMENSION: stores
+    flattened with their location (one per store), updated in place (type 1).
+    """
+
+    SPEC = STORE_DIMENSION
+    NAME = STORE_DIMENSION.name
@@ -0,0 +1,77 @@
+import threading
+
+from model.surrogate_key_allocation import SurrogateKeyAllocationTable
+
+SURROGATE_KEY_BLOCK_SIZE = 10000  # keys reserved per round trip to the warehouse
+
+
+class SurrogateKeyAllocator:
+    """
+    Allocate surrogate keys of a dimension table from blocks reserved in the surrogate_key_allocation
+    table of the warehouse.
+
+    A block is reserved with a single atomic upsert, so processors running in parallel, or restarted,
+    never receive the same keys.  Keys of a block are handed out from memory until it is used up; the
+    unused remainder of a block is lost when the process ends, leaving a gap in the keys.
+    """
+
+    def __init__(
+        self, connection, table_name: str, block_size=SURROGATE_KEY_BLOCK_SIZE
+    ) -> None:
+        """
+        :param connection: mySQL connection used for reservations.  Each reservation is committed.
+        :param table_name: dimension table allocating the keys
+        :param block_size: keys reserved per round trip
+        """
+        self._connection = connection
+        self._table_name = table_name
+        self._block_size = block_size
+        self._next_key = 0  # next key of the cached block
+        self._end_key = 0  # end (exclusive) of the cached block
+        self._lock = threading.Lock()
+        self._allocation_table = SurrogateKeyAllocationTable()
+
+        cur = self._connection.cursor()
+        cur.execute(self._allocation_table.get_create_sql_mysql())
+
+    def allocate(self, n_keys: int) -> int:
+        """
+        Allocate n_keys contiguous surrogate keys.
+
+        :param n_keys: number of keys
+        :return: the first key of the range
+        """
+        with self._lock:
+            if self._end_key - self._next_key < n_keys:
+                self._next_key = self._reserve(max(self._block_size, n_keys))
+                self._end_key = self._next_key + max(self._block_size, n_keys)
+            first_key = self._next_key
+            self._next_key += n_keys
+            return first_key
+
+    def reset(self) -> None:
+        """Restart the keys at 1, when the dimension table is recreated"""
+        with self._lock:
+            cur = self._connection.cursor()
+            cur.execute(
+                f"DELETE FROM {self._allocation_table.get_name()} WHERE table_name = %s;",
+                (self._table_name,),
+            )
+            self._connection.commit()
+            self._next_key = self._end_key = 0
+
+    def _reserve(self, n_keys: int) -> int:
+        """Reserve a block of n_keys keys in the warehouse and return its first key"""
+
+        # LAST_INSERT_ID(expr) returns the new next_key of this upsert to this connection only
+        cur = self._connection.cursor()
+        cur.execute(
+            f"INSERT INTO {self._allocation_table.get_name()} (table_name, next_key)"
+            " VALUES (%s, LAST_INSERT_ID(1 + %s))"
+            " ON DUPLICATE KEY UPDATE next_key = LAST_INSERT_ID(next_key + %s);",
+            (self._table_name, n_keys, n_keys),
+        )
+        cur.execute("SELECT LAST_INSERT_ID();")
+        next_key = cur.fetchone()[0]
+        self._connection.commit()
+        return next_key - n_keys
@@ -0,0 +1,119 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Collection, Dict, List, Optional
+
+TRANSFORM_WORKERS = 4  # processors run concurrently
+
+
+class TransformScheduler:
+    """
+    Run the transformation processors of a batch in dependency order.
+
+    A processor declares its name (NAME), the stage tables it reads (get_stage_tables) and the names of
+    the upstream processors whose tables it looks up (get_dependencies), e.g. a fact processor depends on
+    its dimension processors.  Processors whose dependencies have completed run concurrently in worker
+    threads, so each processor needs its own database connection.  The elapsed time of each processor
+    is reported for every batch.
+
+    A processor writing behind (see WriteBehind) has a flush method.  Its dependents wait for its
+    writes to be committed before they start, as they read its table.
+    """
+
+    def __init__(self, processors: List, workers: int = TRANSFORM_WORKERS) -> None:
+        """
+        :param processors: processors having NAME, get_stage_tables, get_dependencies and process_update
+        :param workers: maximum number of processors running at the same time
+        """
+        self._processors = {processor.NAME: processor for processor in processors}
+        if len(self._processors) != len(processors):
+            raise Exception("TransformScheduler: processor names must be unique")
+        self._workers = workers
+        self._order = self._get_order()
+
+    def _get_order(self) -> List[str]:
+        """Return the processor names in a dependency respecting order; reject unknown names and cycles"""
+
+        for name, processor in self._processors.items():
+            for dependency in processor.get_dependencies():
+                if dependency not in self._processors:
+                    raise Exception(
+                        f"TransformScheduler: {name} depends on unknown processor {dependency}"
+                    )
+
+        order: List[str] = []
+        remaining = dict(self._processors)
+        while remaining:
+            ready = [
+                name
+                for name, processor in remaining.items()
+                if all(d in order for d in processor.get_dependencies())
+            ]
+            if not ready:
+                raise Exception(
+                    f"TransformScheduler: dependency cycle among {sorted(remaining)}"
+                )
+            order.extend(ready)
+            for name in ready:
+                del remaining[name]
+        return order
+
+    def get_order(self) -> List[str]:
+        return self._order
+
+    def run(
+        self,
+        batch_id: int,
+        last_batch_id: Optional[int] = None,
+        skip: Collection[str] = (),
+    ) -> Dict[str, float]:
+        """
+        Run process_update of every processor for a batch, each as soon as all its dependencies have
+        completed.  A failing processor stops the scheduling of further processors; those already
+        running complete before its exception is raised.
+
+        :param batch_id: identifier of incremental batch
+        :param last_batch_id: optional last batch of an inclusive range of batches
+        :param skip: names of the processors that already completed the batch (e.g. on restart)
+        :return: elapsed seconds of each processor run, in order of completion
+        """
+
+        timings: Dict[str, float] = {}
+        completed = set(skip)
+        pending = [name for name in self._order if name not in completed]
+        running = {}
+
+        def timed_update(name):
+            start = time.perf_counter()
+            for dependency in self._processors[name].get_dependencies():
+                flush = getattr(self._processors[dependency], "flush", None)
+                if flush is not None:
+                    flush()
+            self._processors[name].process_update(batch_id, last_batch_id)
+            return time.perf_counter() - start
+
+        batch_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            while pending or running:
+                for name in [n for n in pending if self._is_ready(n, completed)]:
+                    pending.remove(name)
+                    running[executor.submit(timed_update, name)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        wait(running)
+                        raise future.exception()
+                    timings[name] = future.result()
+                    completed.add(name)
+
+        elapsed = time.perf_counter() - batch_start
+        for name in skip:
+            print(f"TransformScheduler: batch {batch_id} {name} skipped")
+        for name, seconds in timings.items():
+            print(f"TransformScheduler: batch {batch_id} {name} {seconds:.3f} s")
+        print(f"TransformScheduler: batch {batch_id} transformed in {elapsed:.3f} s")
+        return timings
+
+    def _is_ready(self, name: str, completed: Collection[str]) -> bool:
+        return all(d in completed for d in self._processors[name].get_dependencies())
@@ -1,43 +1,528 @@
 import os
-from typing import List
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.fs as pa_fs
+import pyarrow.parquet as pq
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from model.metadata import Column, Table
+from .stage_manifest import (
+    get_index_column,
+    prune_stage_files,
+    read_stage_manifest,
+    validate_stage_manifest,
+    write_stage_manifest,
+)
 
-STAGE_DIRECTORY_PREFIX = "/tmp/warehouse/stage/batch"
+# stage files form a hive partitioned dataset: STAGE_ROOT/batch_id=<n>/<table>/part-<k>.<suffix>
+STAGE_ROOT = "/tmp/warehouse/stage"
+
+# arrow types for stage files.  DATE is staged as a timestamp to match the pandas datetime64[ns] type.
+ARROW_TYPES = {
+    "INTEGER": pa.int64(),
+    "BIGINT": pa.int64(),
+    "VARCHAR": pa.string(),
+    "FLOAT": pa.float64(),
+    "DATE": pa.timestamp("ns"),
+    "BOOLEAN": pa.bool_(),
+    "TIMESTAMP": pa.timestamp("ns"),
+}
+
+# arrow schema (and parquet key-value) metadata key of the Table schema fingerprint
+FINGERPRINT_KEY = b"schema_fingerprint"
+
+# pandas types of extracted rows converted through a dataframe (cursor and select methods)
+EXTRACT_PANDAS_TYPES = {
+    "INTEGER": "int64",
+    "BIGINT": "int64",
+    "VARCHAR": "string",
+    "FLOAT": "float64",
+    "DATE": "datetime64[ns]",
+    "BOOLEAN": "bool",
+    "TIMESTAMP": "datetime64[ns]",
+}
+
+COPY_BLOCK_SIZE = 1 << 20  # bytes of CSV text converted to one arrow record batch
+STAGE_CHUNK_SIZE = 50000  # rows fetched per server-side cursor round trip
+EXTRACT_WORKERS = 4  # parallel extraction connections
+EXTRACT_SPLIT_ROWS = 500000  # larger tables in a batch are split into key ranges
+
+
+def get_batch_dir(batch_id) -> str:
+    """Return the stage directory (hive partition) of a batch"""
+    return os.path.join(STAGE_ROOT, f"batch_id={batch_id}")
+
+
+def get_stage_batch_ids(first_batch_id: int, last_batch_id: int) -> List[int]:
+    """Return the ids of the staged batches within an inclusive range, using only the partition names"""
+    if not os.path.exists(STAGE_ROOT):
+        return []
+    batch_ids = [
+        int(name.split("=", 1)[1])
+        for name in os.listdir(STAGE_ROOT)
+        if name.startswith("batch_id=")
+    ]
+    return sorted(b for b in batch_ids if first_batch_id <= b <= last_batch_id)
 
 
 def clean_stage_dir(batch_id):
     """Clean out stage directory for a batch or create if it doesn't"""
-    out_path = STAGE_DIRECTORY_PREFIX + str(batch_id)
+    out_path = get_batch_dir(batch_id)
     if os.path.exists(out_path):
-        for f in os.listdir(out_path):
-            os.remove(os.path.join(out_path, f))
+        shutil.rmtree(out_path)
+    os.makedirs(out_path)
+
+
+def get_stage_dir(batch_id, table_name) -> str:
+    """Return the directory holding the stage files (parts) of a batch and table name"""
+    return os.path.join(get_batch_dir(batch_id), table_name)
+
+
+def get_stage_file(batch_id, table_name, part: int = 0, suffix=".parquet") -> str:
+    """Return the full path name of a stage file for a batch, table name and part number"""
+    return os.path.join(get_stage_dir(batch_id, table_name), f"part-{part:04d}{suffix}")
+
+
+def get_arrow_schema(table: Table) -> pa.Schema:
+    """Return the arrow schema of the stage file for a table, carrying the table's schema fingerprint"""
+    return pa.schema(
+        [(col.get_name(), ARROW_TYPES[col.get_type()]) for col in table.get_columns()],
+        metadata={FINGERPRINT_KEY: table.get_schema_fingerprint().encode()},
+    )
+
+
+def has_stage_fingerprint(dataset: ds.Dataset, table: Table) -> bool:
+    """
+    Return True if every fragment of a stage dataset was written with the table's current schema
+    fingerprint, i.e. its columns already have the stage types of the table.  Only the file footers
+    (or in-memory schemas) are consulted.
+    """
+    fingerprint = table.get_schema_fingerprint().encode()
+    for fragment in dataset.get_fragments():
+        metadata = fragment.physical_schema.metadata or {}
+        if metadata.get(FINGERPRINT_KEY) != fingerprint:
+            return False
+    return True
+
+
+@contextmanager
+def stage_writer(path: str, schema: pa.Schema, file_format: str = "parquet"):
+    """
+    Open an incremental writer for a stage file.  Each write_table call appends a parquet row group
+    (or arrow IPC record batches for file_format "ipc").  The file is written under a temporary name
+    and renamed into place when the block exits without error, so a failed extraction never leaves a
+    partial stage file visible.
+
+    :param path: final path of the stage file
+    :param schema: arrow schema of the stage file
+    :param file_format: parquet (gzip compressed) or ipc (uncompressed arrow IPC file format)
+    """
+    directory, file_name = os.path.split(path)
+    # leading dot hides the temporary file from dataset readers
+    temp_path = os.path.join(directory, "." + file_name + ".tmp")
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(temp_path, schema, compression="gzip")
     else:
-        os.makedirs(out_path)
+        writer = pa.ipc.new_file(temp_path, schema)
+    try:
+        yield writer
+    except BaseException:
+        writer.close()
+        os.remove(temp_path)
+        raise
+    writer.close()
+    os.replace(temp_path, path)
+
+
+class StageBackend:
+    """
+    Storage of the stage area between extraction and transformation.  Extraction writes each StagePart
+    through part_writer and calls finish_batch when a batch is complete; transformations read a table
+    over a range of batches as an arrow dataset.
+    """
+
+    def clean_batch(self, batch_id: int, tables: List[Table]) -> None:
+        """Remove any stage data of a batch and prepare to write the tables"""
+        raise NotImplementedError
+
+    def part_writer(self, part, schema: pa.Schema):
+        """Return a context manager yielding a writer (write_table) for a StagePart"""
+        raise NotImplementedError
+
+    def finish_batch(self, batch_id: int, tables: List[Table]) -> None:
+        """Publish the batch once all parts are written"""
+        raise NotImplementedError
+
+    def get_row_counts(
+        self, batch_id: int, last_batch_id: int, tables: List[Table]
+    ) -> Optional[Dict[str, int]]:
+        """Return staged rows per table name over a range of batches if known without reading data"""
+        raise NotImplementedError
+
+    def has_batch(self, batch_id: int) -> bool:
+        """Return True when a finished batch is available in the stage area"""
+        raise NotImplementedError
+
+    def get_dataset(
+        self,
+        table: Table,
+        first_batch_id: int,
+        last_batch_id: int,
+        key_range=None,
+        verify_checksums=False,
+    ) -> ds.Dataset:
+        """Return the stage data of a table over an inclusive range of batches"""
+        raise NotImplementedError
+
+
+class ParquetStageBackend(StageBackend):
+    """
+    Gzip compressed parquet files on disk under STAGE_ROOT, with a manifest per batch.  Stage data
+    survive the process and can be shared between processes and containers.
+    """
+
+    FILE_FORMAT = "parquet"
+    FILE_SUFFIX = ".parquet"
+
+    def _get_filesystem(self):
+        return None  # default local filesystem
+
+    def clean_batch(self, batch_id: int, tables: List[Table]) -> None:
+        clean_stage_dir(batch_id)
+        for table in tables:
+            os.makedirs(get_stage_dir(batch_id, table.get_name()))
+
+    def part_writer(self, part, schema: pa.Schema):
+        path = get_stage_file(
+            part.batch_id, part.table.get_name(), part.part, self.FILE_SUFFIX
+        )
+        return stage_writer(path, schema, self.FILE_FORMAT)
+
+    def finish_batch(self, batch_id: int, tables: List[Table]) -> None:
+        write_stage_manifest(get_batch_dir(batch_id), batch_id, tables)
+
+    def has_batch(self, batch_id: int) -> bool:
+        return read_stage_manifest(get_batch_dir(batch_id)) is not None
+
+    def get_row_counts(
+        self, batch_id: int, last_batch_id: int, tables: List[Table]
+    ) -> Optional[Dict[str, int]]:
+        row_counts = {table.get_name(): 0 for table in tables}
+        for stage_batch_id in get_stage_batch_ids(batch_id, last_batch_id):
+            manifest = read_stage_manifest(get_batch_dir(stage_batch_id))
+            if manifest is None:
+                return None
+            for table in tables:
+                # tables not extracted in a batch have no rows
+                row_counts[table.get_name()] += (
+                    manifest["tables"].get(table.get_name(), {}).get("row_count", 0)
+                )
+        return row_counts
+
+    def get_dataset(
+        self,
+        table: Table,
+        first_batch_id: int,
+        last_batch_id: int,
+        key_range=None,
+        verify_checksums=False,
+    ) -> ds.Dataset:
+        """
+        Batches outside the range are pruned by partition name.  For batches with a manifest, the
+        manifest is validated and empty files, or files outside key_range, are pruned too.
+        """
+        table_name = table.get_name()
+        paths = []
+        for batch_id in get_stage_batch_ids(first_batch_id, last_batch_id):
+            batch_dir = get_batch_dir(batch_id)
+            manifest = read_stage_manifest(batch_dir)
+            if manifest is not None:
+                validate_stage_manifest(batch_dir, manifest, [table], verify_checksums)
+                relative_paths = prune_stage_files(
+                    manifest["tables"][table_name], table, key_range
+                )
+            else:
+                relative_paths = [
+                    os.path.join(table_name, name)
+                    for name in sorted(os.listdir(os.path.join(batch_dir, table_name)))
+                    if not name.startswith((".", "_"))
+                ]
+            paths.extend(os.path.join(batch_dir, path) for path in relative_paths)
+
+        return ds.dataset(
+            paths,
+            schema=get_arrow_schema(table),
+            format=self.FILE_FORMAT,
+            filesystem=self._get_filesystem(),
+            partitioning=ds.partitioning(
+                pa.schema([("batch_id", pa.int64())]), flavor="hive"
+            ),
+            partition_base_dir=STAGE_ROOT,
+        )
+
+
+class ArrowIpcStageBackend(ParquetStageBackend):
+    """
+    Uncompressed arrow IPC files on disk, laid out and described by manifests like the parquet
+    backend.  Files are opened with memory mapping, so reading stage data into arrow is zero-copy:
+    pages are mapped from the OS page cache rather than decompressed and decoded.
+    """
+
+    FILE_FORMAT = "ipc"
+    FILE_SUFFIX = ".arrow"
+
+    def _get_filesystem(self):
+        return pa_fs.LocalFileSystem(use_mmap=True)
+
+
+class MemoryStageBackend(StageBackend):
+    """
+    An in-process registry of arrow tables, for running extraction and transformation in one process
+    (e.g. demo1.py).  Stage data are handed to the processors without serialization and are lost when
+    the process ends.
+    """
+
+    def __init__(self) -> None:
+        self._batches: Dict[int, Dict[str, List[pa.Table]]] = {}
+        self._finished: Set[int] = set()
+        self._lock = (
+            threading.Lock()
+        )  # parts are registered by parallel extraction workers
+
+    def clean_batch(self, batch_id: int, tables: List[Table]) -> None:
+        with self._lock:
+            self._batches[batch_id] = {table.get_name(): [] for table in tables}
+            self._finished.discard(batch_id)
+
+    @contextmanager
+    def part_writer(self, part, schema: pa.Schema):
+        writer = _MemoryPartWriter()
+        yield writer
+        # registered only when the part completes without error
+        with self._lock:
+            self._batches[part.batch_id][part.table.get_name()].append(
+                pa.Table.from_batches(writer.record_batches, schema)
+            )
+
+    def finish_batch(self, batch_id: int, tables: List[Table]) -> None:
+        with self._lock:
+            self._finished.add(batch_id)
+
+    def has_batch(self, batch_id: int) -> bool:
+        with self._lock:
+            return batch_id in self._finished
+
+    def get_row_counts(
+        self, batch_id: int, last_batch_id: int, tables: List[Table]
+    ) -> Optional[Dict[str, int]]:
+        with self._lock:
+            return {
+                table.get_name(): sum(
+                    t.num_rows
+                    for b, batch in self._batches.items()
+                    if batch_id <= b <= last_batch_id
+                    for t in batch.get(table.get_name(), [])
+                )
+                for table in tables
+            }
+
+    def get_dataset(
+        self,
+        table: Table,
+        first_batch_id: int,
+        last_batch_id: int,
+        key_range=None,
+        verify_checksums=False,
+    ) -> ds.Dataset:
+        with self._lock:
+            parts = [
+                t
+                for b, batch in sorted(self._batches.items())
+                if first_batch_id <= b <= last_batch_id
+                for t in batch.get(table.get_name(), [])
+            ]
+        return ds.InMemoryDataset(parts, schema=get_arrow_schema(table))
+
+
+class _MemoryPartWriter:
+    """Collects the record batches of a part for the MemoryStageBackend"""
+
+    def __init__(self) -> None:
+        self.record_batches = []
+
+    def write_table(self, table: pa.Table) -> None:
+        self.record_batches.extend(table.to_batches())
+
+
+STAGE_BACKENDS = {
+    "parquet": ParquetStageBackend,
+    "ipc": ArrowIpcStageBackend,
+    "memory": MemoryStageBackend,
+}
+
+_stage_backend: StageBackend = ParquetStageBackend()
+
+
+def set_stage_backend(backend) -> StageBackend:
+    """
+    Select the stage backend used by extract_write_stage and read_stage.
+
+    :param backend: a StageBackend, or the name of one in STAGE_BACKENDS (parquet, ipc, memory)
+    :return: the backend now in use
+    """
+    global _stage_backend
+    if isinstance(backend, str):
+        if backend not in STAGE_BACKENDS:
+            raise Exception(f"Unknown stage backend {backend}")
+        backend = STAGE_BACKENDS[backend]()
+    _stage_backend = backend
+    return backend
+
+
+def get_stage_backend() -> StageBackend:
+    """Return the stage backend in use"""
+    return _stage_backend
+
+
+def get_stage_row_counts(
+    batch_id: int, tables, last_batch_id: Optional[int] = None
+) -> Optional[Dict[str, int]]:
+    """
+    Return the number of staged rows per table name in a batch (or inclusive range of batches) without
+    reading the stage data (from the manifests for file backends).  Return None if unknown.
+    """
+    return _stage_backend.get_row_counts(batch_id, last_batch_id or batch_id, tables)
 
 
-def get_stage_file(batch_id, table_name) -> str:
-    """Return the full path name of stage file for a batch and table name"""
-    return os.path.join(STAGE_DIRECTORY_PREFIX + str(batch_id), f"{table_name}.parquet")
+def has_stage_batch(batch_id: int) -> bool:
+    """Return True when the stage area holds the finished batch (e.g. to skip its extraction on restart)"""
+    return _stage_backend.has_batch(batch_id)
 
 
-def read_stage(batch_id: int, tables) -> List[pd.DataFrame]:
+def get_stage_dataset(
+    table: Table,
+    first_batch_id: int,
+    last_batch_id: int,
+    key_range=None,
+    verify_checksums=False,
+) -> ds.Dataset:
+    """
+    Return the stage data of a table over an inclusive range of batches as one arrow dataset.  For
+    file backends batch_id is the hive partition key.
+
+    :param table: table metadata
+    :param first_batch_id: first batch of the range
+    :param last_batch_id: last batch of the range
+    :param key_range: optional inclusive (low, high) range of the index column
+    :param verify_checksums: verify file checksums recorded in the manifests
+    :return: a pyarrow dataset
+    """
+    return _stage_backend.get_dataset(
+        table, first_batch_id, last_batch_id, key_range, verify_checksums
+    )
+
+
+def read_stage_arrow(
+    batch_id: int,
+    tables,
+    key_range=None,
+    verify_checksums=False,
+    last_batch_id: Optional[int] = None,
+) -> List[pa.Table]:
+    """
+    Read stage data as arrow tables, in order of tables argument.  See read_stage for the arguments.
+    Nothing is copied or converted for the memory backend, or for the ipc backend without key_range.
+    """
+    return [
+        _scan_stage(table, batch_id, key_range, verify_checksums, last_batch_id)[0]
+        for table in tables
+    ]
+
+
+def _scan_stage(
+    table: Table, batch_id, key_range, verify_checksums, last_batch_id
+) -> Tuple[pa.Table, bool]:
+    """Scan the stage data of one table; also return whether the data carry the table's fingerprint"""
+    last_batch_id = last_batch_id or batch_id
+    index_column = get_index_column(table)
+    dataset = get_stage_dataset(
+        table, batch_id, last_batch_id, key_range, verify_checksums
+    )
+
+    scan_filter = (ds.field("batch_id") >= batch_id) & (
+        ds.field("batch_id") <= last_batch_id
+    )
+    if key_range is not None:
+        scan_filter = (
+            scan_filter
+            & (ds.field(index_column) >= key_range[0])
+            & (ds.field(index_column) <= key_range[1])
+        )
+    return dataset.to_table(filter=scan_filter), has_stage_fingerprint(dataset, table)
+
+
+def read_stage(
+    batch_id: int,
+    tables,
+    key_range=None,
+    verify_checksums=False,
+    last_batch_id: Optional[int] = None,
+) -> List[pd.DataFrame]:
     """
     Read stage files and instantiate dataframes with the primary key as index
-    :param batch_id: identifier of incremental batch
+
+    Given last_batch_id, all batches from batch_id to last_batch_id are scanned in one pass, for
+    backfills and reprocessing.  When a row was staged in several batches of the range, only the
+    version from the latest batch is kept.
+
+    Batches with a manifest are validated first; tables without rows are returned empty without
+    opening their files and files outside key_range are skipped.
+
+    Stage data whose embedded schema fingerprint matches the table are trusted to have the stage
+    types and only columns converting to a different pandas type are cast; other data are cast in full.
+    Columns with a storage hint are converted in arrow: category columns are dictionary encoded and
+    string[pyarrow] columns keep their arrow buffers.
+
+    :param batch_id: identifier of incremental batch (first batch of the range)
     :param tables: table metadata for files
+    :param key_range: optional inclusive (low, high) range of the index column to read
+    :param verify_checksums: verify file checksums recorded in the manifest
+    :param last_batch_id: optional last batch of an inclusive range of batches
     :return: list of indexed dataframes, in order of tables argument
     """
     stages = []
     for table in tables:
         table_name = table.get_name()
-        index_column = (
-            table.get_parent_key() if table.has_parent() else table.get_primary_key()
+        arrow_table, fingerprint_matches = _scan_stage(
+            table, batch_id, key_range, verify_checksums, last_batch_id
         )
-        df = pd.read_parquet(get_stage_file(batch_id, table_name))
-        df = df.astype(table.get_column_pandas_types())
-        df = df.set_index(index_column, drop=False)
+        df = _stage_to_pandas(arrow_table, table)
+        pd_types = table.get_column_pandas_types()
+        if fingerprint_matches:
+            # written with the current stage types: only columns whose conversion from arrow
+            # differs (e.g. booleans with nulls) need casting
+            pd_types = {
+                name: pd_type
+                for name, pd_type in pd_types.items()
+                if df[name].dtype != pd_type
+            }
+        if pd_types:
+            df = df.astype(pd_types)
+
+        if last_batch_id and last_batch_id != batch_id:
+            df = df.sort_values("batch_id", kind="stable").drop_duplicates(
+                table.get_primary_key(), keep="last"
+            )
+
+        df = df.set_index(get_index_column(table), drop=False)
         print(
             f"CustomerDimensionProcessor: {df.shape[0]} {table_name} records read from stage"
         )
@@ -46,39 +531,322 @@ def read_stage(batch_id: int, tables) -> List[pd.DataFrame]:
     return stages
 
 
-def extract_write_stage(connection, batch_id: int, tables: List[Table]) -> None:
+def _stage_to_pandas(arrow_table: pa.Table, table: Table) -> pd.DataFrame:
+    """Convert stage data to pandas, applying the category and string[pyarrow] storage hints in arrow"""
+
+    storage = {
+        col.get_name(): col.get_storage()
+        for col in table.get_columns()
+        if col.get_name() in arrow_table.column_names
+    }
+    arrow_strings = [
+        name for name, hint in storage.items() if hint == "string[pyarrow]"
+    ]
+    for name, hint in storage.items():
+        if hint == "category":
+            arrow_table = arrow_table.set_column(
+                arrow_table.schema.get_field_index(name),
+                name,
+                pc.dictionary_encode(arrow_table[name]),
+            )
+
+    df = arrow_table.drop(arrow_strings).to_pandas(types_mapper=_stage_types_mapper)
+    for name in arrow_strings:
+        df[name] = pd.arrays.ArrowStringArray(arrow_table[name])
+
+    return df[arrow_table.column_names]
+
+
+def _stage_types_mapper(arrow_type: pa.DataType):
+    """Convert arrow strings straight to the pandas string dtype instead of object then string"""
+    return pd.StringDtype() if arrow_type == pa.string() else None
+
+
+class StagePart:
+    """A unit of extraction work: the rows of one table in a batch, optionally within a key range"""
+
+    def __init__(
+        self,
+        table: Table,
+        batch_id: int,
+        part: int = 0,
+        key_range: Optional[tuple] = None,  # inclusive (low, high) primary key range
+    ) -> None:
+        self.table = table
+        self.batch_id = batch_id
+        self.part = part
+        self.key_range = key_range
+
+    def get_where_clause(self) -> str:
+        where = f"batch_id = {self.batch_id}"
+        if self.key_range:
+            low, high = self.key_range
+            where += f" AND {self.table.get_primary_key()} BETWEEN {low} AND {high}"
+        return where
+
+
+def extract_write_stage(
+    connection,
+    batch_id: int,
+    tables: List[Table],
+    method: str = "copy",
+    chunk_size: int = STAGE_CHUNK_SIZE,
+    connection_factory: Optional[Callable] = None,
+    workers: int = EXTRACT_WORKERS,
+    split_rows: int = EXTRACT_SPLIT_ROWS,
+) -> None:
     """
-    Read from data generator and write to stage parquet file for each table in batch
-    :param connection: Connection to data generator
+    Read from data generator and write to stage parquet files for each table in batch.
+
+    All tables are read from one database snapshot.  When every file is written, a manifest describing
+    them is added to the batch directory.  The connection opens a REPEATABLE READ
+    transaction and exports its snapshot; when a connection_factory is given, tables (and key ranges
+    of tables larger than split_rows) are extracted in parallel by workers, each on its own connection
+    importing that snapshot.  Otherwise the parts are extracted one after another on the connection.
+
+    :param connection: Connection to data generator.  Must not be in autocommit mode or inside a
+                       transaction.
     :param batch_id: identifier of incremental batch
     :param tables: table metadata for files
+    :param method: copy - stream COPY TO STDOUT output into arrow record batches (default)
+                   cursor - fetch rows from a server-side cursor in chunks of chunk_size
+                   select - fetch all rows with SELECT and convert through a pandas dataframe
+                   (the original extraction, baseline of benchmarks/extract_benchmark.py)
+    :param chunk_size: rows per fetch (and parquet row group) for the cursor method
+    :param connection_factory: callable returning a new connection to the data generator database
+    :param workers: number of parallel extraction connections
+    :param split_rows: row count above which a table is split into primary key ranges
     :return: None
     """
 
-    pd_types = {
-        "INTEGER": "int64",
-        "VARCHAR": "string",
-        "FLOAT": "float64",
-        "DATE": "datetime64[ns]",
-        "BOOLEAN": "bool",
-        "TIMESTAMP": "datetime64[ns]",
+    if method not in ["copy", "cursor", "select"]:
+        raise Exception(f"Unknown extract method {method}")
+    if (
+        connection.autocommit
+        or connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+    ):
+        raise Exception(
+            "Extraction requires a non-autocommit connection outside of a transaction"
+        )
+
+    backend = get_stage_backend()
+    backend.clean_batch(batch_id, tables)
+
+    cur = connection.cursor()
+    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+    cur.execute("SELECT pg_export_snapshot();")
+    snapshot_id = cur.fetchone()[0]
+
+    try:
+        parts = []
+        for table in tables:
+            parts.extend(_plan_stage_parts(connection, batch_id, table, split_rows))
+
+        if connection_factory and workers > 1:
+
+            def extract_part(part):
+                worker_connection = connection_factory()
+                try:
+                    worker_cur = worker_connection.cursor()
+                    worker_cur.execute(
+                        "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;"
+                    )
+                    worker_cur.execute(f"SET TRANSACTION SNAPSHOT '{snapshot_id}';")
+                    return _extract_part(worker_connection, part, method, chunk_size)
+                finally:
+                    worker_connection.close()
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                part_rows = list(executor.map(extract_part, parts))
+        else:
+            part_rows = [
+                _extract_part(connection, part, method, chunk_size) for part in parts
+            ]
+    finally:
+        connection.commit()  # end the snapshot transaction
+
+    table_rows: Dict[str, int] = {table.get_name(): 0 for table in tables}
+    for part, n_rows in zip(parts, part_rows):
+        table_rows[part.table.get_name()] += n_rows
+
+    for table_name, n_rows in table_rows.items():
+        print(f"direct-extract: {n_rows} {table_name} records extracted to stage")
+
+    backend.finish_batch(batch_id, tables)
+
+
+def _plan_stage_parts(
+    connection, batch_id: int, table: Table, split_rows: int
+) -> List[StagePart]:
+    """
+    Divide the batch rows of a table into StageParts of contiguous primary key ranges, each expected
+    to hold about split_rows rows.  Small tables are a single part.
+    """
+    primary_key = table.get_primary_key()
+    cur = connection.cursor()
+    cur.execute(
+        f"SELECT COUNT(*), MIN({primary_key}), MAX({primary_key})"
+        f" FROM {table.get_name()} WHERE batch_id = {batch_id};"
+    )
+    n_rows, min_key, max_key = cur.fetchone()
+
+    n_parts = -(-n_rows // split_rows) if split_rows else 1
+    if n_parts <= 1:
+        return [StagePart(table, batch_id)]
+
+    step = -(-(max_key - min_key + 1) // n_parts)
+    return [
+        StagePart(table, batch_id, part, (low, min(low + step - 1, max_key)))
+        for part, low in enumerate(range(min_key, max_key + 1, step))
+    ]
+
+
+def _extract_part(connection, part: StagePart, method: str, chunk_size: int) -> int:
+    """Extract one StagePart with the chosen method and return the number of rows written"""
+    if method == "copy":
+        return _copy_extract_part(connection, part)
+    if method == "select":
+        return _select_extract_part(connection, part)
+    return _cursor_extract_part(connection, part, chunk_size)
+
+
+def _select_extract_part(connection, part: StagePart) -> int:
+    """
+    Extract a stage part with a SELECT, materializing the result set as python tuples and a dataframe
+    before writing the stage file.
+
+    :return: number of rows extracted
+    """
+
+    table = part.table
+    table_name = table.get_name()
+    column_names = ",".join(table.get_column_names())
+    df_type = {
+        col.get_name(): EXTRACT_PANDAS_TYPES[col.get_type()]
+        for col in table.get_columns()
     }
+    schema = get_arrow_schema(table)
 
-    clean_stage_dir(batch_id)
+    sql = f"SELECT {column_names} from {table_name} WHERE {part.get_where_clause()};"
+    cur = connection.cursor()
+    cur.execute(sql)
+    result = cur.fetchall()
 
-    for table in tables:
-        table_name = table.get_name()
-        column_names = ",".join(table.get_column_names())
-
-        sql = f"SELECT {column_names} from {table_name} WHERE batch_id = {batch_id};"
-        cur = connection.cursor()
-        cur.execute(sql)
-        result = cur.fetchall()
-
-        df = pd.DataFrame(result, columns=table.get_column_names())
-        df_type = {
-            col.get_name(): pd_types[col.get_type()] for col in table.get_columns()
-        }
-        df = df.astype(df_type)
-        df.to_parquet(get_stage_file(batch_id, table_name), compression="gzip")
-        print(f"direct-extract: {df.shape[0]} {table_name} records extracted to stage")
+    df = pd.DataFrame(result, columns=table.get_column_names())
+    df = df.astype(df_type)
+    with get_stage_backend().part_writer(part, schema) as writer:
+        writer.write_table(
+            pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+        )
+
+    return df.shape[0]
+
+
+def _cursor_extract_part(connection, part: StagePart, chunk_size: int) -> int:
+    """
+    Extract a stage part through a named (server-side) cursor.  Rows are fetched chunk_size at a time and
+    each chunk is converted and appended to the stage file as one row group, so client memory is
+    bounded by the chunk size rather than the batch size.
+
+    :return: number of rows extracted
+    """
+
+    table = part.table
+    table_name = table.get_name()
+    column_names = ",".join(table.get_column_names())
+    df_type = {
+        col.get_name(): EXTRACT_PANDAS_TYPES[col.get_type()]
+        for col in table.get_columns()
+    }
+    schema = get_arrow_schema(table)
+
+    sql = f"SELECT {column_names} from {table_name} WHERE {part.get_where_clause()};"
+    cur = connection.cursor(name=f"stage_{table_name}_{part.part}")
+    cur.itersize = chunk_size
+    cur.execute(sql)
+
+    n_rows = 0
+    try:
+        with get_stage_backend().part_writer(part, schema) as writer:
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                df = pd.DataFrame(rows, columns=table.get_column_names())
+                df = df.astype(df_type)
+                writer.write_table(
+                    pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                )
+                n_rows += df.shape[0]
+    finally:
+        cur.close()
+
+    return n_rows
+
+
+def _copy_extract_part(connection, part: StagePart) -> int:
+    """
+    Extract a stage part with COPY (SELECT ...) TO STDOUT.  The CSV text is written by a helper thread
+    into a pipe, parsed by arrow into typed record batches of about COPY_BLOCK_SIZE bytes of text and
+    appended to the stage file as row groups as they arrive, so no python objects are created per
+    value and client memory is bounded by the block size.
+
+    :return: number of rows extracted
+    """
+    table = part.table
+    table_name = table.get_name()
+    column_names = ",".join(table.get_column_names())
+    schema = get_arrow_schema(table)
+
+    sql = (
+        f"COPY (SELECT {column_names} from {table_name} WHERE {part.get_where_clause()})"
+        f" TO STDOUT WITH (FORMAT csv, HEADER true)"
+    )
+
+    read_fd, write_fd = os.pipe()
+    pipe_reader = os.fdopen(read_fd, "rb")
+    pipe_writer = os.fdopen(write_fd, "wb")
+    copy_errors = []
+
+    def copy_to_pipe():
+        try:
+            cur = connection.cursor()
+            cur.copy_expert(sql, pipe_writer)
+        except Exception as e:
+            copy_errors.append(e)
+        finally:
+            pipe_writer.close()
+
+    copy_thread = threading.Thread(target=copy_to_pipe)
+    copy_thread.start()
+
+    n_rows = 0
+    try:
+        reader = pa_csv.open_csv(
+            pipe_reader,
+            read_options=pa_csv.ReadOptions(block_size=COPY_BLOCK_SIZE),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=schema,
+                true_values=["t"],
+                false_values=["f"],
+                strings_can_be_null=True,  # postgres writes NULL as an unquoted empty field
+                quoted_strings_can_be_null=False,
+            ),
+        )
+        with get_stage_backend().part_writer(part, schema) as writer:
+            for record_batch in reader:
+                writer.write_table(pa.Table.from_batches([record_batch], schema))
+                n_rows += record_batch.num_rows
+            copy_thread.join()
+            if copy_errors:
+                raise copy_errors[0]  # output may be truncated, discard the stage file
+    except Exception:
+        # a copy failure that ended the CSV stream is the root cause of any parse error
+        if copy_errors and not copy_thread.is_alive():
+            raise copy_errors[0]
+        raise
+    finally:
+        pipe_reader.close()  # unblocks the copy thread if parsing stopped early
+        copy_thread.join()
+
+    return n_rows
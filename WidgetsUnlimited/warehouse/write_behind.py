@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+WRITE_BEHIND_QUEUE_SIZE = 2  # writes waiting per processor before submit blocks
+
+
+class WriteBehind:
+    """
+    Run the mySQL writes of a processor on a background thread, so that the transformation of the
+    next batch overlaps the writes of the previous one.
+
+    Writes run one at a time in the order they were submitted: the writes of every key are applied in
+    batch order.  At most queue_size writes wait to run; submit blocks beyond, holding back the
+    transformation until the writer catches up.  A failed write is raised by the next submit or flush,
+    and no later write runs.  The writes need their own connection, as the transformation thread keeps
+    using the processor's connection.
+    """
+
+    def __init__(self, name: str, queue_size: int = WRITE_BEHIND_QUEUE_SIZE) -> None:
+        """
+        :param name: name of the processor, used for the thread name and messages
+        :param queue_size: maximum number of writes waiting to run
+        """
+        self._name = name
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error: Optional[Exception] = None
+        self._intervals: List[Tuple[float, float]] = []
+        self._thread = threading.Thread(
+            target=self._run, name=f"{name}_write_behind", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self, write: Callable[[], None], on_done: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        Queue a write, blocking while queue_size writes are waiting
+
+        :param write: callable performing and committing the writes of a batch
+        :param on_done: optional callable run on the writer thread once write has succeeded
+        :return: None
+        """
+        self._raise_error()
+        self._queue.put((write, on_done))
+
+    def flush(self) -> None:
+        """Wait until every submitted write has run, raising the exception of a failed write"""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        """Flush and stop the writer thread"""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def get_intervals(self) -> List[Tuple[float, float]]:
+        """Return the (start, end) perf_counter times of the writes run so far"""
+        return list(self._intervals)
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                write, on_done = job
+                if self._error is not None:
+                    continue  # later writes could depend on the failed one
+                start = time.perf_counter()
+                try:
+                    write()
+                    if on_done:
+                        on_done()
+                except Exception as e:
+                    self._error = e
+                finally:
+                    self._intervals.append((start, time.perf_counter()))
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise Exception(
+                f"WriteBehind: write of {self._name} failed: {self._error}"
+            ) from self._error
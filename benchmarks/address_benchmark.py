@@ -0,0 +1,50 @@
+"""
+address_benchmark.py - Compare row-by-row and vectorized parsing of the customer_address column.
+
+Builds n synthetic addresses in memory (no database needed), with one in a thousand malformed, and
+parses them with Series.apply(parse_address) and with parse_addresses, reporting rows/sec and
+peak memory.  The row-by-row baseline is limited to the first APPLY_ROWS well formed addresses,
+which already take minutes.
+
+usage: python benchmarks/address_benchmark.py [n_addresses]
+"""
+
+import sys
+
+import pandas as pd
+
+import context  # noqa: F401
+
+from warehouse.customer_dimension import CustomerDimensionProcessor
+from measure import measure
+
+APPLY_ROWS = 100000
+
+n_addresses = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+addresses = pd.Series(
+    [
+        (
+            f"Name {i}\n{i} Snickersnack Lane\nBrooklyn, NY {i % 100000:05d}"
+            if i % 1000
+            else f"Name {i} Brooklyn NY"
+        )
+        for i in range(n_addresses)
+    ],
+    dtype="string",
+)
+well_formed = addresses[addresses.str.count("\n") == 2][:APPLY_ROWS]
+
+measure(
+    "apply(parse_address)",
+    well_formed.size,
+    well_formed.apply,
+    CustomerDimensionProcessor.parse_address,
+)
+parsed, malformed = measure(
+    "parse_addresses",
+    addresses.size,
+    CustomerDimensionProcessor.parse_addresses,
+    addresses,
+)
+print(f"{parsed.shape[0]} parsed, {malformed.size} quarantined")
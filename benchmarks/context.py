@@ -0,0 +1,7 @@
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "../WidgetsUnlimited")),
+)
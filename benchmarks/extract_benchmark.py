@@ -0,0 +1,46 @@
+"""
+extract_benchmark.py - Compare stage extraction methods of extract_write_stage.
+
+Generates customers and addresses in the data generator database (DATA_GENERATOR_* environment
+variables, see config.sh) and extracts the batch to stage with each method, reporting rows/sec and
+peak memory.  The select method, fetching all rows through a dataframe, is the original extraction
+and the baseline of the comparison.
+
+usage: python benchmarks/extract_benchmark.py [n_customers]
+"""
+
+import sys
+
+import context  # noqa: F401
+
+from model.customer import CustomerTable
+from model.customer_address import CustomerAddressTable
+from operations.generator import DataGenerator, GeneratorRequest
+from warehouse.warehouse_util import extract_write_stage
+from measure import measure
+
+n_customers = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+CUSTOMER = CustomerTable()
+CUSTOMER_ADDRESS = CustomerAddressTable()
+
+data_generator = DataGenerator()
+data_generator.add_tables([CUSTOMER, CUSTOMER_ADDRESS])
+data_generator.generate(GeneratorRequest(CUSTOMER, n_inserts=n_customers), batch_id=1)
+data_generator.generate(
+    GeneratorRequest(CUSTOMER_ADDRESS, n_inserts=2, link_parent=True), batch_id=1
+)
+
+connection = data_generator.get_connection()
+n_rows = n_customers * 3
+
+for method in ["select", "cursor", "copy"]:
+    measure(
+        f"extract_write_stage({method})",
+        n_rows,
+        extract_write_stage,
+        connection,
+        1,
+        [CUSTOMER, CUSTOMER_ADDRESS],
+        method=method,
+    )
@@ -0,0 +1,35 @@
+import time
+import tracemalloc
+
+import pyarrow as pa
+
+
+def measure(label: str, n_rows: int, fn, *args, **kwargs):
+    """
+    Call fn and print elapsed time, rows per second and peak memory.
+
+    Python peak is the tracemalloc high-water mark during the call.  Arrow peak is the arrow
+    memory pool high-water mark above its level at the start of the call; the pool keeps one
+    high-water mark per process, so it is exact only for the first measured call.
+
+    :return: result of fn
+    """
+    pool = pa.default_memory_pool()
+    arrow_base = pool.bytes_allocated()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    result = fn(*args, **kwargs)
+
+    elapsed = time.perf_counter() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    arrow_peak = pool.max_memory() - arrow_base
+
+    print(
+        f"{label:<30} {n_rows:>10} rows {elapsed:>8.3f} s"
+        f" {n_rows / elapsed if elapsed else 0:>12,.0f} rows/s"
+        f" peak python {python_peak / 2 ** 20:>8.1f} MB"
+        f" peak arrow {max(arrow_peak, 0) / 2 ** 20:>8.1f} MB"
+    )
+    return result
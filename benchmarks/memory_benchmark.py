@@ -0,0 +1,111 @@
+"""
+memory_benchmark.py - Compare the memory held by stage and customer_dim dataframes with the default
+column types and with the column storage hints (category, string[pyarrow], nullable boolean).
+
+Builds a stage batch of n synthetic customers with one billing and one shipping address each as
+arrow tables (no database needed), converts it to dataframes both ways and runs the new customer
+transformation, reporting the deep memory usage of each dataframe.
+
+usage: python benchmarks/memory_benchmark.py [n_customers]
+"""
+
+import sys
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+
+import context  # noqa: F401
+
+from model.customer import CustomerTable
+from model.customer_address import CustomerAddressTable
+from warehouse.customer_dimension import CustomerDimensionProcessor
+from warehouse.warehouse_util import get_arrow_schema, _stage_to_pandas
+from measure import measure
+
+n_customers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+CUSTOMER = CustomerTable()
+CUSTOMER_ADDRESS = CustomerAddressTable()
+updated_at = datetime(2021, 9, 1, 12, 0)
+ids = list(range(1, n_customers + 1))
+
+customer_stage = pa.Table.from_pydict(
+    {
+        "customer_id": ids,
+        "customer_name": [f"Name {i}" for i in ids],
+        "customer_user_id": [f"user{i}" for i in ids],
+        "customer_password": [f"pw{i:08d}" for i in ids],
+        "customer_email": [f"user{i}@mail.com" for i in ids],
+        "customer_referral_type": [["OA", "AM", ""][i % 3] for i in ids],
+        "customer_sex": [["F", "M"][i % 2] for i in ids],
+        "customer_date_of_birth": [datetime(1990, 1, 2)] * n_customers,
+        "customer_loyalty_number": ids,
+        "customer_credit_card_number": [f"{i:016d}" for i in ids],
+        "customer_is_preferred": [i % 2 == 0 for i in ids],
+        "customer_is_active": [True] * n_customers,
+        "customer_inserted_at": [updated_at] * n_customers,
+        "customer_updated_at": [updated_at] * n_customers,
+        "batch_id": [1] * n_customers,
+    },
+    schema=get_arrow_schema(CUSTOMER),
+)
+customer_address_stage = pa.Table.from_pydict(
+    {
+        "customer_id": ids + ids,
+        "customer_address_id": list(range(1, 2 * n_customers + 1)),
+        "customer_address": [
+            f"Name {i}\n{i} Snickersnack Lane\nBrooklyn, NY {i % 100000:05d}"
+            for i in ids + ids
+        ],
+        "customer_address_type": ["B"] * n_customers + ["S"] * n_customers,
+        "customer_address_inserted_at": [updated_at] * (2 * n_customers),
+        "customer_address_updated_at": [updated_at] * (2 * n_customers),
+        "batch_id": [1] * (2 * n_customers),
+    },
+    schema=get_arrow_schema(CUSTOMER_ADDRESS),
+)
+
+
+def to_pandas(arrow_table, table, storage):
+    if storage:
+        df = _stage_to_pandas(arrow_table, table)
+    else:
+        df = arrow_table.to_pandas()
+    df = df.astype(table.get_column_pandas_types(storage=storage))
+    return df.set_index(df.columns[0], drop=False)
+
+
+def megabytes(df: pd.DataFrame) -> str:
+    return f"{df.memory_usage(deep=True).sum() / 2 ** 20:,.1f} MB"
+
+
+processor = CustomerDimensionProcessor(None)
+pd_types = processor._dimension_table.get_column_pandas_types(storage=False)
+for storage in [False, True]:
+    label = "storage hints" if storage else "default types"
+    customer = measure(
+        f"customer ({label})", n_customers, to_pandas, customer_stage, CUSTOMER, storage
+    )
+    customer_address = measure(
+        f"customer_address ({label})",
+        2 * n_customers,
+        to_pandas,
+        customer_address_stage,
+        CUSTOMER_ADDRESS,
+        storage,
+    )
+    customer_dim = measure(
+        f"build_new_dimension ({label} stage)",
+        n_customers,
+        processor._build_new_dimension,
+        customer.index,
+        customer,
+        customer_address,
+    )
+    if not storage:
+        customer_dim = customer_dim.astype(pd_types)
+    print(
+        f"{label}: customer {megabytes(customer)}, customer_address {megabytes(customer_address)},"
+        f" customer_dim {megabytes(customer_dim)}"
+    )
@@ -0,0 +1,75 @@
+"""
+update_dimension_benchmark.py - Compare the column loop and the aligned merge used to overlay incremental
+changes on prior customer_dim records, and the transposed and row-wise max of update dates.
+
+Builds n prior customer_dim records and changes to a subset of their columns in memory (no database
+needed), reporting rows/sec and peak memory.
+
+usage: python benchmarks/update_dimension_benchmark.py [n_customers]
+"""
+
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import context  # noqa: F401
+
+from model.customer_dim import CustomerDimTable
+from warehouse.customer_dimension import CustomerDimensionProcessor
+from measure import measure
+
+n_customers = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+CUSTOMER_DIM = CustomerDimTable()
+column_names = CUSTOMER_DIM.get_column_names()
+keys = pd.Index(range(1, n_customers + 1))
+
+prior_customer_dim = pd.DataFrame(
+    {
+        name: (keys if pd_type == "int64" else pd.Series(["prior"] * n_customers))
+        for name, pd_type in CUSTOMER_DIM.get_column_pandas_types().items()
+    }
+)
+prior_customer_dim.index = keys
+
+# changes: name for every customer, billing address for every other one
+customer_dim = pd.DataFrame([], columns=column_names, index=keys)
+customer_dim["name"] = "changed"
+customer_dim.loc[keys[::2], "billing_city"] = "changed"
+
+start = datetime(2021, 9, 1)
+update_dates = pd.DataFrame(
+    {
+        "billing": start + pd.to_timedelta(np.arange(n_customers) % 7, unit="D"),
+        "shipping": pd.NaT,
+        "customer": start + timedelta(days=3),
+    },
+    index=keys,
+)
+
+
+def column_loop(prior_customer_dim, customer_dim):
+    prior_customer_dim = prior_customer_dim.copy()
+    mask = customer_dim.notnull()
+    for col in customer_dim.columns:
+        prior_customer_dim.loc[mask[col], col] = customer_dim[col]
+    return pd.DataFrame(prior_customer_dim, columns=column_names)
+
+
+measure(
+    "overlay column loop", n_customers, column_loop, prior_customer_dim, customer_dim
+)
+measure(
+    "overlay_changes",
+    n_customers,
+    CustomerDimensionProcessor.overlay_changes,
+    prior_customer_dim,
+    customer_dim,
+    column_names,
+)
+measure(
+    "max of transpose", n_customers, lambda d: d.astype(object).T.max(), update_dates
+)
+measure("max(axis=1)", n_customers, update_dates.max, axis=1)
@@ -0,0 +1,80 @@
+"""
+write_dimension_benchmark.py - Compare the write methods of CustomerDimensionProcessor._write_dimension.
+
+Writes n new customer_dim records to the warehouse (WAREHOUSE_* environment variables, see config.sh) with
+each INSERT method, then rewrites them with the REPLACE upsert and with the former executemany REPLACE,
+reporting rows/sec and peak memory.  The load method needs local_infile enabled on the server
+(see docker-compose-db.yaml).
+
+usage: python benchmarks/write_dimension_benchmark.py [n_customers]
+"""
+
+import os
+import sys
+from datetime import date
+
+import pandas as pd
+from mysql.connector import connect
+
+import context  # noqa: F401
+
+from warehouse.customer_dimension import CustomerDimensionProcessor
+from measure import measure
+
+n_customers = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+connection = connect(
+    host=os.getenv("WAREHOUSE_HOST"),
+    port=os.getenv("WAREHOUSE_PORT"),
+    user=os.getenv("WAREHOUSE_USER"),
+    password=os.getenv("WAREHOUSE_PASSWORD"),
+    database=os.getenv("WAREHOUSE_DB"),
+    charset="utf8",
+    allow_local_infile=True,
+)
+
+processor = CustomerDimensionProcessor(None)
+table = processor._dimension_table
+pd_types = table.get_column_pandas_types()
+keys = range(1, n_customers + 1)
+values = {
+    "int64": list(keys),
+    "string": [f"value {k}" for k in keys],
+    "datetime64[ns]": [date(2020, 10, 10)] * n_customers,
+    "bool": [True] * n_customers,
+}
+customer_dim = pd.DataFrame(
+    {name: values[pd_type] for name, pd_type in pd_types.items()}
+).astype(pd_types)
+
+
+def replace_executemany(customer_dim):
+    """The former REPLACE write: one delete plus insert per row"""
+    column_names = table.get_column_names()
+    values_substitutions = ",".join(["%s"] * len(column_names))
+    cur = connection.cursor()
+    cur.executemany(
+        f"REPLACE INTO {table.get_name()} ({','.join(column_names)}) values ({values_substitutions})",
+        customer_dim.to_numpy().tolist(),
+    )
+    connection.commit()
+
+
+for method in ["insert", "load"]:
+    processor = CustomerDimensionProcessor(connection, write_methods={"INSERT": method})
+    measure(
+        f"INSERT ({method})",
+        n_customers,
+        processor._write_dimension,
+        customer_dim,
+        "INSERT",
+    )
+
+measure(
+    "REPLACE (upsert)",
+    n_customers,
+    processor._write_dimension,
+    customer_dim,
+    "REPLACE",
+)
+measure("REPLACE (executemany)", n_customers, replace_executemany, customer_dim)
@@ -18,3 +18,6 @@ export WAREHOUSE_PORT=3306
 export WAREHOUSE_USER=user1
 export WAREHOUSE_PASSWORD=user1
 
+export WAREHOUSE_STAGE_BACKEND=parquet
+export WAREHOUSE_INSERT_METHOD=load
+export WAREHOUSE_PARTITIONS=1
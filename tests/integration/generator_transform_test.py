@@ -62,7 +62,11 @@ def test_generator_and_transform():
     )
     customer_dimension.process_update(2)
 
+    # type 2 history: two expired rows and two new current rows
     cur.execute("SELECT COUNT(*) from customer_dim;")
+    assert cur.fetchone()[0] == 22
+
+    cur.execute("SELECT COUNT(*) from customer_dim where is_current_row = 1;")
     assert cur.fetchone()[0] == 20
 
     cur.execute("SELECT COUNT(email) from customer_dim where email like '%_UPD';")
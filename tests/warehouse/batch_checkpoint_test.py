@@ -0,0 +1,106 @@
+import pytest
+
+from .context import batch_checkpoint, BatchCheckpoints
+
+
+class FakeCheckpointCursor:
+    def __init__(self, connection):
+        self._connection = connection
+        self._result = []
+
+    def execute(self, sql, params=()):
+        self._connection.statements.append(sql)
+        rows = self._connection.rows.values()
+        if sql.startswith("SELECT COUNT(*)"):
+            self._result = [(sum(1 for r in rows if r[0] == params[0]),)]
+        elif sql.startswith("SELECT processor"):
+            self._result = [
+                (r[3],)
+                for r in rows
+                if r[1] == params[0] and r[2] == params[1] and r[3]
+            ]
+
+    def executemany(self, sql, rows):
+        assert sql.startswith("INSERT IGNORE")
+        self._connection.pending.extend(rows)
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+
+class FakeCheckpointConnection:
+    """Keeps the checkpoint rows by key; inserts are applied on commit"""
+
+    def __init__(self):
+        self.rows = {}
+        self.pending = []
+        self.statements = []
+
+    def cursor(self):
+        return FakeCheckpointCursor(self)
+
+    def commit(self):
+        for row in self.pending:
+            self.rows.setdefault(row[0], row)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+
+@pytest.fixture
+def checkpoints():
+    yield BatchCheckpoints(FakeCheckpointConnection())
+
+
+def test_record_steps(checkpoints):
+
+    assert checkpoints.get_first_incomplete_step(1) == batch_checkpoint.EXTRACTED
+    checkpoints.record(1, batch_checkpoint.EXTRACTED)
+    checkpoints.record(1, batch_checkpoint.STAGED)
+    checkpoints.record(1, batch_checkpoint.STAGED)  # retried step
+
+    assert checkpoints.is_complete(1, batch_checkpoint.STAGED)
+    assert not checkpoints.is_complete(2, batch_checkpoint.STAGED)
+    assert checkpoints.get_first_incomplete_step(1) == batch_checkpoint.TRANSFORMED
+
+    with pytest.raises(Exception, match="Unknown checkpoint step"):
+        checkpoints.record(1, "loaded")
+
+
+def test_processor_written(checkpoints):
+
+    checkpoints.record(2, batch_checkpoint.WRITTEN, "customer_dimension", 4)
+    checkpoints.record(3, batch_checkpoint.WRITTEN, "sales_fact")
+
+    assert checkpoints.get_written_processors(3) == {"customer_dimension", "sales_fact"}
+    assert checkpoints.get_written_processors(5) == set()
+    # a processor checkpoint does not complete the batch
+    assert not checkpoints.is_complete(3, batch_checkpoint.WRITTEN)
+    assert checkpoints.is_complete(3, batch_checkpoint.WRITTEN, "sales_fact")
+
+
+def test_record_in_caller_transaction(checkpoints):
+
+    writer_connection = FakeCheckpointConnection()
+    checkpoints.record(
+        1, batch_checkpoint.WRITTEN, "sales_fact", connection=writer_connection
+    )
+
+    # not committed by record
+    assert writer_connection.rows == {}
+    writer_connection.rollback()
+    writer_connection.commit()
+    assert writer_connection.rows == {}
+
+
+def test_recreate():
+
+    connection = FakeCheckpointConnection()
+    BatchCheckpoints(connection, recreate=False)
+    assert not any(s.startswith("DROP") for s in connection.statements)
+    BatchCheckpoints(connection)
+    assert connection.statements[-2].startswith("DROP TABLE IF EXISTS batch_checkpoint")
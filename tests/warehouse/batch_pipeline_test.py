@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from .context import BatchPipeline, WriteBehind
+from .context import get_busy_seconds, get_overlap_seconds
+
+
+def test_busy_and_overlap_seconds():
+
+    assert get_busy_seconds([(0, 2), (1, 3), (5, 6)]) == 4
+    assert get_busy_seconds([]) == 0
+    # extract 0-2, transform 1-4, write 3-5 and 3.5-4
+    stages = [[(0, 2)], [(1, 4)], [(3, 5), (3.5, 4)]]
+    assert get_overlap_seconds(stages) == 2
+    assert get_overlap_seconds([[(0, 1)], [(1, 2)]]) == 0
+
+
+def test_write_behind_order():
+
+    written = []
+    writer = WriteBehind("test", queue_size=1)
+    for batch_id in range(1, 5):
+        writer.submit(
+            lambda batch_id=batch_id: (time.sleep(0.01), written.append(batch_id))
+        )
+    writer.flush()
+
+    assert written == [1, 2, 3, 4]
+    assert len(writer.get_intervals()) == 4
+    writer.close()
+
+
+def test_write_behind_error():
+
+    written = []
+
+    def fail():
+        raise Exception("deadlock")
+
+    writer = WriteBehind("test")
+    writer.submit(fail)
+    with pytest.raises(Exception, match="write of test failed: deadlock"):
+        writer.flush()
+    # later writes do not run
+    with pytest.raises(Exception, match="deadlock"):
+        writer.submit(lambda: written.append(1))
+    assert written == []
+
+
+def test_pipeline_overlap():
+
+    log = []
+    writer = WriteBehind("fake_dim")
+
+    def extract(batch_id):
+        time.sleep(0.1)
+        log.append(("extract", batch_id))
+        return 10
+
+    def transform(batch_id):
+        time.sleep(0.1)
+        log.append(("transform", batch_id))
+        writer.submit(lambda: (time.sleep(0.1), log.append(("write", batch_id))))
+
+    start = time.perf_counter()
+    report = BatchPipeline(extract, transform, [writer]).run(range(1, 5))
+    elapsed = time.perf_counter() - start
+
+    # each stage handles the batches in order, a batch passes the stages in order
+    for stage in ["extract", "transform", "write"]:
+        assert [b for s, b in log if s == stage] == [1, 2, 3, 4]
+    for batch_id in range(1, 5):
+        positions = [
+            log.index((s, batch_id)) for s in ["extract", "transform", "write"]
+        ]
+        assert positions == sorted(positions)
+
+    # 12 stage runs of 0.1 s in about 6 steps
+    assert elapsed < 0.9
+    assert report["batches"] == 4
+    assert report["rows"] == 40
+    assert report["write"] >= 0.4
+    assert report["overlap"] > 0.3
+    assert report["rows_per_second"] == pytest.approx(40 / report["elapsed"])
+
+
+def test_pipeline_bounded_extraction():
+
+    extracted = []
+    transformed = threading.Event()
+
+    def extract(batch_id):
+        extracted.append(batch_id)
+
+    def transform(batch_id):
+        if batch_id == 1:
+            time.sleep(0.2)
+            # batch 2 waits in the queue, batch 3 waits to be queued
+            assert extracted == [1, 2, 3]
+            transformed.set()
+
+    BatchPipeline(extract, transform, queue_size=1).run(range(1, 6))
+    assert transformed.is_set()
+
+
+def test_pipeline_extract_error():
+
+    transformed = []
+
+    def extract(batch_id):
+        if batch_id == 3:
+            raise Exception("source unavailable")
+
+    with pytest.raises(Exception, match="source unavailable"):
+        BatchPipeline(extract, transformed.append).run(range(1, 6))
+    assert transformed == [1, 2]
+
+
+def test_pipeline_transform_error():
+
+    extracted = []
+
+    def transform(batch_id):
+        raise Exception("bad batch")
+
+    with pytest.raises(Exception, match="bad batch"):
+        BatchPipeline(extracted.append, transform).run(range(1, 100))
+    assert len(extracted) < 99
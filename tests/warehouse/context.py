@@ -6,7 +6,42 @@ sys.path.insert(
     os.path.abspath(os.path.join(os.path.dirname(__file__), "../../WidgetsUnlimited")),
 )
 
+from warehouse import customer_dimension, dimension_processor
 from warehouse.customer_dimension import CustomerDimensionProcessor
 
 from model.customer import CustomerTable
 from model.customer_address import CustomerAddressTable
+
+from warehouse import warehouse_util
+from warehouse.warehouse_util import extract_write_stage, read_stage
+from warehouse.surrogate_key import SurrogateKeyAllocator
+from warehouse.transform_scheduler import TransformScheduler
+from warehouse.dimension_key_map import DimensionKeyMap, UNKNOWN_KEY
+from warehouse import sales_fact
+from warehouse.sales_fact import SalesFactProcessor
+from model.order import OrderTable
+from model.order_line_item import OrderLineItemTable
+from model.store_sales import StoreSalesTable
+from warehouse.dimension_processor import DimensionSpec, ChildSpec
+from warehouse.product_dimension import ProductDimensionProcessor
+from warehouse.store_dimension import StoreDimensionProcessor
+from model.product import ProductTable
+from model.store import StoreTable
+from model.store_location import StoreLocationTable
+from model.customer_dim import CustomerDimTable
+from warehouse import date_dimension
+from warehouse.date_dimension import DateDimensionProcessor, get_date_keys
+from warehouse.write_behind import WriteBehind
+from warehouse.batch_pipeline import (
+    BatchPipeline,
+    get_busy_seconds,
+    get_overlap_seconds,
+)
+from warehouse import batch_checkpoint
+from warehouse.batch_checkpoint import BatchCheckpoints
+from warehouse import sales_aggregate
+from model.sales_aggregate import DailyProductSalesTable
+from warehouse.sales_aggregate import AggregateSpec, SALES_AGGREGATES
+from warehouse.star_export import StarExport
+from model.sales_fact import SalesFactTable
+from model.store_dim import StoreDimTable
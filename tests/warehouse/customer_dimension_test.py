@@ -4,9 +4,12 @@ import pandas as pd
 import pytest
 from mysql.connector import connect
 
-
 # from WidgetsUnlimited.warehouse.warehouse_util import get_new_keys
-from .context import CustomerDimensionProcessor, CustomerTable
+from .context import CustomerDimensionProcessor, CustomerTable, customer_dimension
+from .context import dimension_processor
+from .context import CustomerAddressTable, extract_write_stage
+from .context import StarExport, CustomerDimTable
+from .warehouse_util_test import FakeConnection, stage_dir  # noqa: F401
 
 # subset of customer_dim columns for testing
 customer_dim_cols = [
@@ -68,6 +71,9 @@ def base_dimension_records_all():
 
     customer_dim = pd.DataFrame(dim_records)
     customer_dim = customer_dim.set_index("customer_key", drop=False)
+    customer_dim["attribute_hash"] = CustomerDimensionProcessor(None)._hash_attributes(
+        customer_dim
+    )
     yield customer_dim
 
 
@@ -94,6 +100,53 @@ def test_parse_address():
     assert address["zip"] == "11229"
 
 
+def test_parse_addresses():
+
+    addresses = pd.Series(
+        [
+            TEST_BILLING_ADDRESS,
+            "no newlines",
+            TEST_SHIPPING_ADDRESS,
+            "a\nb\nNo Comma NY 1",
+        ],
+        index=[3, 4, 5, 6],
+    )
+    parsed, malformed = CustomerDimensionProcessor.parse_addresses(addresses)
+
+    assert parsed.index.tolist() == [3, 5]
+    for key in parsed.index:
+        expected = CustomerDimensionProcessor.parse_address(addresses[key])
+        assert parsed.loc[key].to_dict() == expected.to_dict()
+    assert malformed.index.tolist() == [4, 6]
+
+
+def test_quarantine_malformed_address():
+
+    c = CustomerDimensionProcessor(None)
+    _date = datetime.now()
+
+    customer = pd.DataFrame(
+        {"customer_id": [3, 4], "customer_updated_at": [_date] * 2}
+    ).set_index("customer_id", drop=False)
+    customer_address = pd.DataFrame(
+        {
+            "customer_id": [3, 4],
+            "customer_address_id": [1, 2],
+            "customer_address": [TEST_BILLING_ADDRESS, "Brooklyn NY"],
+            "customer_address_type": ["B", "B"],
+            "customer_address_updated_at": [_date] * 2,
+        }
+    ).set_index("customer_id", drop=False)
+
+    quarantine = []
+    customer_dim = c.customer_transform(customer, customer_address, quarantine)
+
+    assert customer_dim.at[3, "billing_city"] == "Brooklyn"
+    assert pd.isna(customer_dim.at[4, "billing_city"])
+    assert len(quarantine) == 1
+    assert quarantine[0]["customer_address_id"].tolist() == [2]
+
+
 # Build new customer_dim from customers and addresses.
 # Customers 3 & 5 have billing and shipping; customer 4, billing only,
 def test_build_new_dimension():
@@ -153,6 +206,7 @@ def test_build_new_dimension():
     assert inserts.at[3, "shipping_state"] == "NJ"
     assert inserts.at[4, "billing_city"] == "Brooklyn"
     assert inserts.at[4, "shipping_city"] == "N/A"
+    assert inserts.at[3, "age_cohort"] == "2020s"  # decade of the date of birth
 
 
 def test_transform_referral_type():
@@ -200,6 +254,7 @@ def test_transform_referral_type():
     assert customer_dim.at[2, "referral_type"] == "None"
     assert customer_dim.at[3, "referral_type"] == "Online Advertising"
     assert customer_dim.at[4, "referral_type"] == "Affiliate Marketing"
+    assert (customer_dim["age_cohort"] == "Unknown").all()  # no date of birth
 
 
 def test_update_customer_only(base_dimension_record_45):
@@ -524,3 +579,377 @@ def test_update_all_2(base_dimension_records_all):
     assert customer_dim.loc[46, "billing_street_number"] == "44 Pine Street"
     assert customer_dim.loc[46, "email"] == "henry@hotmail.com"
     assert customer_dim.loc[46, "credit_card_number"] == "88888888"
+
+
+def test_build_versions(base_dimension_records_all):
+
+    c = CustomerDimensionProcessor(None)
+    c._next_surrogate_key = 10
+    pd_types = c._dimension_table.get_column_pandas_types()
+    update_dim = base_dimension_records_all.astype(pd_types)
+    update_dim.loc[45, "email"] = "ellen@newmail.com"
+    update_dim.loc[45, "last_update_date"] = datetime(2021, 9, 1, 12, 30)
+    update_dim.loc[46, "last_update_date"] = datetime(2021, 9, 1, 12, 30)
+    update_dim["attribute_hash"] = c._hash_attributes(update_dim)
+
+    expirations, versions = c._build_versions(base_dimension_records_all, update_dim)
+
+    # customer 46 has no attribute change
+    assert expirations.to_dict() == {1: pd.Timestamp(2021, 9, 1)}
+    assert versions.index.tolist() == [45]
+    assert versions.loc[45, "surrogate_key"] == 10
+    assert versions.loc[45, "email"] == "ellen@newmail.com"
+    assert versions.loc[45, "effective_date"] == pd.Timestamp(2021, 9, 1)
+    assert versions.loc[45, "expiration_date"] == pd.Timestamp(2099, 12, 31)
+    assert versions.loc[45, "is_current_row"] == True
+
+    c._connection = FakeMySQLConnection([])
+    c._expire_dimension(expirations)
+    assert c._connection.statements == [
+        "UPDATE customer_dim SET expiration_date = %s, is_current_row = 0"
+        " WHERE surrogate_key IN (%s);"
+    ]
+
+
+def test_export_expired_versions(base_dimension_records_all, tmp_path):
+
+    c = CustomerDimensionProcessor(None)
+    c._next_surrogate_key = 10
+    update_dim = base_dimension_records_all.astype(
+        c._dimension_table.get_column_pandas_types()
+    )
+    update_dim.loc[45, "email"] = "ellen@newmail.com"
+    update_dim.loc[45, "last_update_date"] = datetime(2021, 9, 1, 12, 30)
+    update_dim["attribute_hash"] = c._hash_attributes(update_dim)
+    expirations, versions = c._build_versions(base_dimension_records_all, update_dim)
+
+    expired = c._build_expired(base_dimension_records_all, expirations)
+    assert expired.index.tolist() == [1]
+    assert expired.loc[1, "email"] == "ellen@supermail.com"
+    assert expired.loc[1, "expiration_date"] == pd.Timestamp(2021, 9, 1)
+    assert expired.loc[1, "is_current_row"] == False
+
+    # both versions of customer 45 are exported, the new one current
+    c._export = StarExport([CustomerDimTable()], root=str(tmp_path))
+    c._publish(2, [pd.DataFrame([]), expired, versions])
+    current = c._export.read_current(CustomerDimTable.NAME).to_pandas()
+    assert current.set_index("surrogate_key")["is_current_row"].to_dict() == {
+        1: False,
+        10: True,
+    }
+    assert current.set_index("surrogate_key").loc[1, "expiration_date"] == (
+        pd.Timestamp(2021, 9, 1)
+    )
+
+
+def test_attribute_hash(base_dimension_records_all):
+
+    c = CustomerDimensionProcessor(None)
+    customer_dim = base_dimension_records_all.astype(
+        c._dimension_table.get_column_pandas_types()
+    )
+    hashes = c._hash_attributes(customer_dim)
+
+    # stored as read back from mySQL: dates at day precision, object columns
+    assert hashes.equals(base_dimension_records_all["attribute_hash"])
+    customer_dim["activation_date"] = pd.Timestamp(2020, 10, 10, 9, 15)
+    assert c._hash_attributes(customer_dim).equals(hashes)
+
+    # control columns are not hashed
+    customer_dim["last_update_date"] = pd.Timestamp(2021, 9, 1)
+    customer_dim["surrogate_key"] = [7, 8]
+    assert c._hash_attributes(customer_dim).equals(hashes)
+
+    customer_dim.loc[46, "shipping_zip"] = "54321"
+    changed = c._hash_attributes(customer_dim)
+    assert changed[45] == hashes[45] and changed[46] != hashes[46]
+
+
+def test_build_versions_without_prior_hash(base_dimension_records_all):
+
+    c = CustomerDimensionProcessor(None)
+    update_dim = base_dimension_records_all.astype(
+        c._dimension_table.get_column_pandas_types()
+    )
+    update_dim.loc[46, "sex"] = "F"
+    update_dim["attribute_hash"] = c._hash_attributes(update_dim)
+    prior_customer_dim = base_dimension_records_all.drop(columns="attribute_hash")
+
+    expirations, versions = c._build_versions(prior_customer_dim, update_dim)
+
+    assert expirations.index.tolist() == [2]
+    assert versions.index.tolist() == [46]
+    assert versions.loc[46, "attribute_hash"] == update_dim.loc[46, "attribute_hash"]
+
+
+class FakeMySQLCursor:
+    """Answers the dimension lookups of _read_dimension from a list of customer keys"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.description = None
+        self._rows = []
+
+    def execute(self, statement, params=None):
+        self._connection.statements.append(statement)
+        if statement.startswith("SELECT"):
+            keys = params if "IN (" in statement else self._connection.lookup_keys
+            self.description = [("surrogate_key",), ("customer_key",)]
+            self._rows = [
+                (100 + k, k) for k in self._connection.customer_keys if k in keys
+            ]
+        elif statement.startswith("DROP"):
+            self._connection.lookup_keys = set()
+        elif statement.startswith("LOAD DATA"):
+            with open(statement.split("'")[1]) as f:
+                self._connection.loaded = f.read()
+
+    def executemany(self, statement, rows):
+        self._connection.statements.append(statement)
+        if "_lookup" in statement:
+            self._connection.lookup_keys.update(row[0] for row in rows)
+        else:
+            self._connection.written_rows.extend(rows)
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeMySQLConnection:
+    def __init__(self, customer_keys):
+        self.customer_keys = customer_keys
+        self.lookup_keys = set()
+        self.statements = []
+        self.written_rows = []
+        self.loaded = None
+
+    def cursor(self):
+        return FakeMySQLCursor(self)
+
+    def commit(self):
+        pass
+
+
+@pytest.mark.parametrize("in_limit", [1000, 2])
+def test_read_dimension_lookup(monkeypatch, in_limit):
+
+    monkeypatch.setattr(dimension_processor, "READ_DIMENSION_IN_LIMIT", in_limit)
+    monkeypatch.setattr(dimension_processor, "READ_DIMENSION_INSERT_CHUNK", 2)
+    c = CustomerDimensionProcessor(None)
+    c._connection = FakeMySQLConnection([1, 3, 5, 7])
+
+    dimension = c._read_dimension("customer_key", pd.Index([3, 4, 5]))
+
+    assert sorted(dimension.index.tolist()) == [3, 5]
+    assert dimension.loc[3, "surrogate_key"] == 103
+    if in_limit == 2:
+        assert any("JOIN" in statement for statement in c._connection.statements)
+        assert c._connection.statements[-1].startswith("DROP TEMPORARY TABLE")
+    else:
+        assert "is_current_row = 1" in c._connection.statements[0]
+        assert len(c._connection.statements) == 1
+
+
+def test_write_dimension_upsert_chunks(monkeypatch, base_dimension_records_all):
+
+    monkeypatch.setattr(dimension_processor, "WRITE_CHUNK_ROWS", 1)
+    c = CustomerDimensionProcessor(None)
+    c._connection = FakeMySQLConnection([])
+
+    c._write_dimension(base_dimension_records_all, "REPLACE")
+
+    assert len(c._connection.statements) == 2
+    assert c._connection.statements[0].startswith("INSERT INTO customer_dim")
+    assert "ON DUPLICATE KEY UPDATE" in c._connection.statements[0]
+    assert "name=VALUES(name)" in c._connection.statements[0]
+    assert "surrogate_key=VALUES" not in c._connection.statements[0]
+    assert len(c._connection.written_rows) == 2
+
+
+def test_write_dimension_load(base_dimension_records_all):
+
+    c = CustomerDimensionProcessor(None, write_methods={"INSERT": "load"})
+    c._connection = FakeMySQLConnection([])
+    customer_dim = base_dimension_records_all.astype(
+        c._dimension_table.get_column_pandas_types()
+    )
+    customer_dim.iloc[0, customer_dim.columns.get_loc("name")] = 'Fred "F\\J", Jr'
+
+    c._write_dimension(customer_dim, "INSERT")
+
+    assert c._connection.statements[0].startswith("LOAD DATA LOCAL INFILE")
+    lines = c._connection.loaded.splitlines()
+    assert len(lines) == 2
+    assert '"Fred ""F\\\\J"", Jr"' in lines[0]
+    assert ",2020-10-10," in lines[0]
+    assert ",1," in lines[0] or ",0," in lines[0]
+
+
+def test_hash_partitions():
+
+    keys = pd.Index(range(1, 1001))
+    partitions = customer_dimension.get_hash_partitions(keys, 4)
+
+    assert set(partitions) == {0, 1, 2, 3}
+    assert min(pd.Series(partitions).value_counts()) > 200
+    assert (
+        customer_dimension.get_hash_partitions(keys[::-1], 4) == partitions[::-1]
+    ).all()
+
+
+def stage_partitioned_batch():
+    """Stage batch 1 of 20 customers, one in 4 with a malformed billing address"""
+
+    updated_at = datetime(2021, 9, 1, 12, 0)
+    customers = [
+        (k, f"c{k}", f"u{k}", "pw", f"c{k}@b.com", ["OA", "AM", ""][k % 3], "F")
+        + (datetime(1990, 1, 2), 1000 + k, "123", True, k % 2 == 0)
+        + (updated_at, updated_at, 1)
+        for k in range(1, 21)
+    ]
+    addresses = [
+        (k, k, TEST_BILLING_ADDRESS if k % 4 else "malformed", "B")
+        + (updated_at, updated_at, 1)
+        for k in range(1, 21)
+    ]
+    extract_write_stage(
+        FakeConnection(
+            {CustomerTable.NAME: customers, CustomerAddressTable.NAME: addresses}
+        ),
+        1,
+        [CustomerTable(), CustomerAddressTable()],
+    )
+
+
+def test_partitioned_update(stage_dir, monkeypatch):  # noqa: F811
+
+    stage_partitioned_batch()
+    written = []
+    c = CustomerDimensionProcessor(None)
+    empty_dimension = pd.DataFrame(columns=c._dimension_table.get_column_names())
+    monkeypatch.setattr(
+        CustomerDimensionProcessor,
+        "_read_dimension",
+        lambda self, key_name, key_values: empty_dimension.set_index(key_name),
+    )
+    monkeypatch.setattr(
+        CustomerDimensionProcessor,
+        "_write_dimension",
+        lambda self, customer_dim, operation: written.append(customer_dim),
+    )
+    monkeypatch.setattr(CustomerDimensionProcessor, "_count_dimension", lambda self: 0)
+
+    counts = c.process_update(1)
+    single = pd.concat(written).drop(columns="surrogate_key").sort_index()
+    written.clear()
+    partition_counts = [c.process_update(1, partition=(p, 3)) for p in range(3)]
+    partitioned = pd.concat(written).drop(columns="surrogate_key").sort_index()
+
+    # categories differ between partitions
+    pd_types = c._dimension_table.get_column_pandas_types(storage=False)
+    del pd_types["surrogate_key"]
+    pd.testing.assert_frame_equal(partitioned.astype(pd_types), single.astype(pd_types))
+    for name in customer_dimension.UPDATE_COUNTS:
+        assert sum(pc[name] for pc in partition_counts) == counts[name]
+    assert counts["new"] == single.shape[0] == 20
+    assert counts["quarantined"] == 5
+
+
+class FakeWorkerConnection:
+    """Picklable stand-in of the mySQL connection of a partition worker: reserves surrogate keys"""
+
+    def __init__(self):
+        self._last_insert_id = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        if query.startswith("INSERT INTO surrogate_key_allocation"):
+            self._last_insert_id = 1 + params[1]
+
+    def fetchone(self):
+        return (self._last_insert_id,)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class WorkerCustomerProcessor(CustomerDimensionProcessor):
+    """
+    Customer processor of the partition workers (pickled by reference), reading an empty dimension
+    and writing its rows to pickle files of output_dir
+    """
+
+    def __init__(self, *args, output_dir=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._output_dir = output_dir
+
+    def _get_worker_options(self):
+        return {**super()._get_worker_options(), "output_dir": self._output_dir}
+
+    def _read_dimension(self, key_name, key_values):
+        columns = self._dimension_table.get_column_names()
+        return pd.DataFrame(columns=columns).set_index(key_name, drop=False)
+
+    def _write_dimension(self, dimension, operation):
+        if dimension.shape[0] > 0:
+            dimension.to_pickle(
+                os.path.join(self._output_dir, f"{operation}-{os.getpid()}.pkl")
+            )
+
+    def _count_dimension(self):
+        return 0
+
+
+def test_process_partitions(stage_dir, tmp_path):  # noqa: F811
+
+    stage_partitioned_batch()
+    output_dir = tmp_path / "written"
+    output_dir.mkdir()
+    c = WorkerCustomerProcessor(
+        None,
+        connection_factory=FakeWorkerConnection,
+        partitions=2,
+        output_dir=str(output_dir),
+    )
+
+    counts = c.process_update(1)
+
+    # one file of inserts per worker process, each holding the customers of its hash partition
+    names = sorted(os.listdir(output_dir))
+    assert [name.split("-")[0] for name in names] == ["INSERT", "INSERT"]
+    written = [pd.read_pickle(output_dir / name) for name in names]
+    partitions = [
+        tuple(
+            set(
+                dimension_processor.get_hash_partitions(
+                    pd.Index(w["customer_key"].astype("int64")), 2
+                )
+            )
+        )
+        for w in written
+    ]
+    assert sorted(partitions) == [(0,), (1,)]
+    written = pd.concat(written)
+    assert sorted(written["customer_key"]) == list(range(1, 21))
+    assert counts == {
+        "keys": 20,
+        "new": 20,
+        "updated": 0,
+        "skipped": 0,
+        "quarantined": 5,
+    }
+    assert c.get_quarantined_addresses().shape[0] == 5
+
+
+def test_partitions_need_connection_factory():
+
+    with pytest.raises(Exception, match="connection_factory"):
+        CustomerDimensionProcessor(None, partitions=4)
@@ -0,0 +1,124 @@
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .context import date_dimension, DateDimensionProcessor, get_date_keys
+from .context import UNKNOWN_KEY
+
+
+def test_date_keys():
+
+    dates = pd.Series(
+        [datetime(2021, 1, 2, 23, 0), pd.NaT, datetime(1999, 12, 31)]
+        + [datetime(2024, 2, 29), datetime(2030, 12, 31, 23, 59)]
+    )
+    assert get_date_keys(dates).tolist() == [
+        20210102,
+        UNKNOWN_KEY,
+        UNKNOWN_KEY,  # before the date dimension
+        20240229,
+        20301231,
+    ]
+    # date objects, e.g. DATE columns read from mySQL
+    assert get_date_keys(np.array([date(2021, 9, 1), None], dtype=object)).tolist() == [
+        20210901,
+        UNKNOWN_KEY,
+    ]
+
+
+def test_date_keys_match_formatted_dates():
+
+    dates = pd.date_range("2000-01-01", "2030-12-31", freq="D")
+    assert (
+        get_date_keys(dates) == dates.strftime("%Y%m%d").astype("int64").to_numpy()
+    ).all()
+
+
+def test_build_date_dimension():
+
+    date_dim = date_dimension.build_date_dimension(
+        date(2021, 1, 1), date(2021, 12, 31), fiscal_year_start_month=2
+    )
+
+    assert date_dim.shape[0] == 365 + 1
+    assert date_dim.loc[UNKNOWN_KEY, "day_name"] == "Unknown"
+    assert pd.isna(date_dim.loc[UNKNOWN_KEY, "full_date"])
+
+    july_4 = date_dim.loc[20210704]
+    assert july_4["day_name"] == "Sunday"
+    assert july_4["day_of_week"] == 7
+    assert july_4["is_weekend"]
+    assert july_4["quarter"] == 3
+    assert july_4["fiscal_month"] == 6
+    assert july_4["fiscal_quarter"] == 2
+    assert july_4["fiscal_year"] == 2022
+
+    # US federal holidays, on their observed dates
+    assert date_dim.loc[20210705, "is_holiday"]
+    assert date_dim.loc[20210705, "holiday_name"] == "Independence Day"
+    assert not date_dim.loc[20210706, "is_holiday"]
+    assert date_dim.loc[20210115, "fiscal_year"] == 2021
+    assert date_dim.loc[20210115, "fiscal_month"] == 12
+
+
+def test_calendar_fiscal_year():
+
+    date_dim = date_dimension.build_date_dimension(
+        date(2021, 12, 31), date(2022, 1, 1), fiscal_year_start_month=1
+    )
+    assert date_dim.loc[20211231, "fiscal_year"] == 2021
+    assert date_dim.loc[20220101, "fiscal_year"] == 2022
+    assert date_dim.loc[20220101, "fiscal_month"] == 1
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def execute(self, sql, params=None):
+        self._connection.statements.append(sql)
+
+    def executemany(self, sql, rows):
+        self._connection.rows += len(rows)
+
+    def fetchone(self):
+        return (self._connection.rows,)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.rows = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+
+def test_load_once():
+
+    connection = FakeConnection()
+    p = DateDimensionProcessor(
+        connection, first_date=date(2021, 1, 1), last_date=date(2021, 1, 31)
+    )
+
+    p.process_update(1)
+    assert connection.rows == 31 + 1
+    p.process_update(2)
+    # restarted warehouse with the existing table
+    DateDimensionProcessor(
+        connection, first_date=date(2021, 1, 1), recreate=False
+    ).process_update(3)
+
+    assert connection.rows == 31 + 1
+    assert not any(s.startswith("DROP") for s in connection.statements[2:])
+
+
+def test_invalid_fiscal_year_start():
+
+    with pytest.raises(Exception, match="fiscal year start"):
+        DateDimensionProcessor(None, fiscal_year_start_month=13)
@@ -0,0 +1,103 @@
+import numpy as np
+
+from .context import DimensionKeyMap, UNKNOWN_KEY
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self._connection = connection
+        self._result = []
+
+    def execute(self, sql, params):
+        self._connection.statements.append((sql, params))
+        (watermark,) = params
+        self._result = [
+            (natural_key, surrogate_key)
+            for natural_key, surrogate_key, is_current in self._connection.rows
+            if surrogate_key > watermark and is_current
+        ]
+
+    def fetchall(self):
+        return self._result
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows  # (natural_key, surrogate_key, is_current_row)
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class SnapshotConnection(FakeConnection):
+    """
+    Reads a snapshot of the committed rows taken by the first read of a transaction, until commit
+    (InnoDB REPEATABLE READ).  Rows committed by other connections are appended to committed_rows.
+    """
+
+    def __init__(self, rows):
+        self._snapshot = None
+        super().__init__(rows)
+
+    @property
+    def rows(self):
+        if self._snapshot is None:
+            self._snapshot = list(self.committed_rows)
+        return self._snapshot
+
+    @rows.setter
+    def rows(self, rows):
+        self.committed_rows = rows
+
+    def commit(self):
+        self._snapshot = None
+
+
+def test_refresh_reads_new_rows_only():
+
+    connection = FakeConnection([(101, 1, 1), (102, 2, 1)])
+    key_map = DimensionKeyMap(connection, "customer_dim", "customer_key")
+
+    assert key_map.refresh() == 2
+    assert len(key_map) == 2
+    assert key_map.refresh() == 0
+
+    sql, params = connection.statements[-1]
+    assert sql == (
+        "SELECT customer_key, surrogate_key FROM customer_dim"
+        " WHERE surrogate_key > %s AND is_current_row = 1;"
+    )
+    assert params == (2,)
+
+
+def test_new_version_replaces_key():
+
+    connection = FakeConnection([(101, 1, 1), (102, 2, 1)])
+    key_map = DimensionKeyMap(connection, "customer_dim", "customer_key")
+    key_map.refresh()
+
+    # type 2 change of 101 and a new customer 103
+    connection.rows[0] = (101, 1, 0)
+    connection.rows.extend([(101, 3, 1), (103, 4, 1)])
+    assert key_map.refresh() == 2
+
+    assert len(key_map) == 3
+    assert key_map.lookup([101, 102, 103]).tolist() == [3, 2, 4]
+
+
+def test_lookup_unknown_keys():
+
+    connection = FakeConnection([(101, 1, 1)])
+    key_map = DimensionKeyMap(connection, "customer_dim", "customer_key")
+
+    keys = key_map.lookup(np.array([101, 999]))
+    assert keys.tolist() == [UNKNOWN_KEY, UNKNOWN_KEY]
+    assert keys.dtype == np.int64
+
+    key_map.refresh()
+    assert key_map.lookup(np.array([101, 999, np.nan])).tolist() == [
+        1,
+        UNKNOWN_KEY,
+        UNKNOWN_KEY,
+    ]
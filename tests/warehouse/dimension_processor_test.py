@@ -0,0 +1,388 @@
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from .context import dimension_processor, DimensionSpec, ChildSpec
+from .context import ProductDimensionProcessor, StoreDimensionProcessor
+from .context import ProductTable, StoreTable, StoreLocationTable
+from .context import CustomerTable, CustomerDimTable
+from .context import CustomerDimensionProcessor, DateDimensionProcessor, UNKNOWN_KEY
+from .context import BatchCheckpoints, StarExport, StoreDimTable
+from .batch_checkpoint_test import FakeCheckpointConnection
+
+INSERTED_AT = datetime(2021, 9, 1, 12, 0)
+UPDATED_AT = datetime(2021, 9, 3, 9, 30)
+
+
+def stage_frame(table, rows):
+    """Build a dataframe the way read_stage returns it"""
+    df = pd.DataFrame(rows, columns=table.get_column_names())
+    df = df.astype(table.get_column_pandas_types(storage=False))
+    index_column = (
+        table.get_parent_key() if table.has_parent() else table.get_primary_key()
+    )
+    return df.set_index(index_column, drop=False)
+
+
+def store_rows(manager_name, updated_at):
+    return [
+        (1, "Main St", manager_name, 12, datetime(2010, 5, 1), None)
+        + (INSERTED_AT, updated_at, 1),
+        (2, "Mall", "Bo", 30, datetime(2015, 6, 1), None)
+        + (INSERTED_AT, INSERTED_AT, 1),
+    ]
+
+
+store_location = stage_frame(
+    StoreLocationTable(),
+    [
+        (11, 1, "1 Main St", "Brooklyn", "NY", "11229", 1200.0)
+        + (INSERTED_AT, INSERTED_AT, 1),
+        (12, 2, "2 Mall Rd", "Paramus", "NJ", "07652", 5400.0)
+        + (INSERTED_AT, INSERTED_AT, 1),
+    ],
+)
+
+product = stage_frame(
+    ProductTable(),
+    [
+        (7, "Widget", "A widget", "Tools", "Acme", 3, 1.5, 1.0, 2.0, 3.0)
+        + (datetime(2020, 1, 1), False, False, INSERTED_AT, INSERTED_AT, 1),
+    ],
+)
+
+
+def test_spec_unknown_columns():
+
+    with pytest.raises(Exception, match="unknown dimension columns"):
+        DimensionSpec(
+            "customer_dimension",
+            CustomerDimTable(),
+            natural_key="customer_key",
+            source=CustomerTable(),
+            mapping={"customer_key": "customer_id", "nickname": "customer_name"},
+        )
+    with pytest.raises(Exception, match="unknown stage columns"):
+        DimensionSpec(
+            "customer_dimension",
+            CustomerDimTable(),
+            natural_key="customer_key",
+            source=CustomerTable(),
+            mapping={"customer_key": "customer_id", "name": "customer_nickname"},
+        )
+
+
+def test_spec_natural_key():
+
+    with pytest.raises(Exception, match="natural key"):
+        DimensionSpec(
+            "customer_dimension",
+            CustomerDimTable(),
+            natural_key="customer_key",
+            source=CustomerTable(),
+            mapping={"name": "customer_name"},
+        )
+
+
+def test_spec_child_table():
+
+    with pytest.raises(Exception, match="not a child"):
+        DimensionSpec(
+            "customer_dimension",
+            CustomerDimTable(),
+            natural_key="customer_key",
+            source=CustomerTable(),
+            mapping={"customer_key": "customer_id"},
+            children=[ChildSpec(StoreLocationTable(), {"name": "store_location_city"})],
+        )
+
+
+def test_stage_tables():
+
+    assert [t.get_name() for t in StoreDimensionProcessor.get_stage_tables()] == [
+        StoreTable.NAME,
+        StoreLocationTable.NAME,
+    ]
+    assert [t.get_name() for t in ProductDimensionProcessor.get_stage_tables()] == [
+        ProductTable.NAME
+    ]
+
+
+def test_date_key_dependencies():
+
+    assert ProductDimensionProcessor.get_dependencies() == [DateDimensionProcessor.NAME]
+    assert CustomerDimensionProcessor.get_dependencies() == []
+
+
+def test_build_new_product_dimension():
+
+    p = ProductDimensionProcessor(None)
+    product_dim = p._build_new_dimension(pd.Index([7]), product)
+
+    assert product_dim.loc[7, "surrogate_key"] == 1
+    assert product_dim.loc[7, "name"] == "Widget"
+    assert product_dim.loc[7, "preferred_supplier_key"] == 3
+    assert product_dim.loc[7, "effective_date"] == pd.Timestamp(2021, 9, 1)
+    assert product_dim.loc[7, "introduced_date_key"] == 20200101
+    assert product_dim.loc[7, "last_update_date"] == INSERTED_AT
+    assert bool(product_dim.loc[7, "is_current_row"])
+    assert product_dim.dtypes.to_dict() == p._dimension_table.get_column_pandas_types()
+
+
+def test_store_type_1_update(monkeypatch):
+
+    written = []
+    stages = [stage_frame(StoreTable(), store_rows("Al", INSERTED_AT)), store_location]
+    monkeypatch.setattr(
+        dimension_processor, "get_stage_row_counts", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(
+        dimension_processor, "read_stage", lambda *args, **kwargs: stages
+    )
+    monkeypatch.setattr(
+        StoreDimensionProcessor,
+        "_read_dimension",
+        lambda self, key_name, key_values: pd.concat(
+            [d for d, _ in written] or [pd.DataFrame(columns=["store_key"])]
+        ).set_index(key_name, drop=False),
+    )
+    monkeypatch.setattr(
+        StoreDimensionProcessor,
+        "_write_dimension",
+        lambda self, dimension, operation: written.append((dimension, operation)),
+    )
+    monkeypatch.setattr(StoreDimensionProcessor, "_count_dimension", lambda self: 0)
+
+    p = StoreDimensionProcessor(None)
+    counts = p.process_update(1)
+
+    assert counts["new"] == 2
+    (inserts, operation), *_ = written
+    assert operation == "INSERT"
+    assert inserts.loc[1, "city"] == "Brooklyn"
+    assert inserts.loc[2, "sq_footage"] == 5400.0
+    assert inserts.loc[1, "opened_date_key"] == 20100501
+    assert inserts.loc[1, "closed_date_key"] == UNKNOWN_KEY
+
+    # the manager of store 1 changes; store 2 is restaged unchanged
+    stages[0] = stage_frame(StoreTable(), store_rows("Cy", UPDATED_AT))
+    counts = p.process_update(2)
+
+    assert counts["updated"] == 2
+    assert counts["skipped"] == 1
+    updates, operation = written[-1]
+    assert operation == "REPLACE"
+    assert updates.index.tolist() == [1]
+    assert updates.loc[1, "manager_name"] == "Cy"
+    # updated in place: same surrogate key and effective date
+    assert updates.loc[1, "surrogate_key"] == inserts.loc[1, "surrogate_key"]
+    assert updates.loc[1, "effective_date"] == inserts.loc[1, "effective_date"]
+    assert updates.loc[1, "last_update_date"] == UPDATED_AT
+
+
+def test_store_export(monkeypatch, tmp_path):
+
+    written = []
+    stages = [stage_frame(StoreTable(), store_rows("Al", INSERTED_AT)), store_location]
+    monkeypatch.setattr(
+        dimension_processor, "get_stage_row_counts", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(
+        dimension_processor, "read_stage", lambda *args, **kwargs: stages
+    )
+    monkeypatch.setattr(
+        StoreDimensionProcessor,
+        "_read_dimension",
+        lambda self, key_name, key_values: pd.concat(
+            [d for d in written] or [pd.DataFrame(columns=["store_key"])]
+        ).set_index(key_name, drop=False),
+    )
+    monkeypatch.setattr(
+        StoreDimensionProcessor,
+        "_write_dimension",
+        lambda self, dimension, operation: written.append(dimension),
+    )
+    monkeypatch.setattr(StoreDimensionProcessor, "_count_dimension", lambda self: 0)
+
+    export = StarExport([StoreDimTable()], root=str(tmp_path))
+    p = StoreDimensionProcessor(None, export=export)
+    p.process_update(1)
+    stages[0] = stage_frame(StoreTable(), store_rows("Cy", UPDATED_AT))
+    p.process_update(2)
+
+    # store 1 updated in place by batch 2
+    assert export.get_uncompacted_batches(StoreDimTable.NAME) == [1, 2]
+    current = export.read_current(StoreDimTable.NAME).to_pandas()
+    assert current.set_index("store_key")["manager_name"].to_dict() == {
+        1: "Cy",
+        2: "Bo",
+    }
+
+
+def test_store_write_behind(monkeypatch):
+
+    written = []
+    release = threading.Event()
+    stages = [stage_frame(StoreTable(), store_rows("Al", INSERTED_AT)), store_location]
+    monkeypatch.setattr(
+        dimension_processor, "get_stage_row_counts", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(
+        dimension_processor, "read_stage", lambda *args, **kwargs: stages
+    )
+    # nothing is committed while the writer is held
+    monkeypatch.setattr(
+        StoreDimensionProcessor,
+        "_read_dimension",
+        lambda self, key_name, key_values: pd.DataFrame(
+            columns=self._dimension_table.get_column_names()
+        ).set_index(key_name, drop=False),
+    )
+
+    def write_dimension(self, dimension, operation):
+        release.wait(5)
+        if dimension.shape[0] > 0:
+            written.append((dimension, operation))
+
+    monkeypatch.setattr(StoreDimensionProcessor, "_write_dimension", write_dimension)
+    monkeypatch.setattr(StoreDimensionProcessor, "_count_dimension", lambda self: 0)
+
+    p = StoreDimensionProcessor(
+        None, connection_factory=lambda: None, write_behind=True
+    )
+    counts = p.process_update(1)
+    assert counts["new"] == 2
+
+    # batch 2 sees the queued inserts of batch 1
+    stages[0] = stage_frame(StoreTable(), store_rows("Cy", UPDATED_AT))
+    counts = p.process_update(2)
+    assert counts["new"] == 0
+    assert counts["updated"] == 2
+    assert counts["skipped"] == 1
+    assert written == []
+
+    release.set()
+    p.flush()
+    assert [operation for _, operation in written] == ["INSERT", "REPLACE"]
+    (inserts, _), (updates, _) = written
+    assert updates.loc[1, "manager_name"] == "Cy"
+    assert updates.loc[1, "surrogate_key"] == inserts.loc[1, "surrogate_key"]
+    assert p._pending_rows == {}
+
+
+class SnapshotCursor:
+    def __init__(self, connection):
+        self._connection = connection
+        self._result = []
+        self.description = None
+
+    def execute(self, sql, params=None):
+        self.description = [(name,) for name in self._connection.columns]
+        self._result = self._connection.get_snapshot()
+
+    def fetchall(self):
+        return self._result
+
+    def close(self):
+        pass
+
+
+class SnapshotConnection:
+    """
+    Dimension table read from a snapshot of the committed rows taken by the first read of a
+    transaction, until commit (InnoDB REPEATABLE READ)
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.committed_rows = []
+        self._snapshot = None
+
+    def cursor(self):
+        return SnapshotCursor(self)
+
+    def get_snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = list(self.committed_rows)
+        return self._snapshot
+
+    def commit(self):
+        self._snapshot = None
+
+    def rollback(self):
+        pass
+
+
+def test_write_behind_reads_committed_rows(monkeypatch):
+
+    stages = [stage_frame(StoreTable(), store_rows("Al", INSERTED_AT)), store_location]
+    monkeypatch.setattr(
+        dimension_processor, "get_stage_row_counts", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(
+        dimension_processor, "read_stage", lambda *args, **kwargs: stages
+    )
+    columns = StoreDimTable().get_column_names()
+    connection = SnapshotConnection(columns)
+    written = []
+
+    def write_dimension(self, dimension, operation):
+        # committed on the writer's own connection
+        if dimension.shape[0] > 0:
+            written.append(operation)
+            connection.committed_rows = [
+                row
+                for row in connection.committed_rows
+                if row[columns.index("store_key")] not in dimension.index
+            ] + list(dimension[columns].itertuples(index=False, name=None))
+
+    monkeypatch.setattr(StoreDimensionProcessor, "_write_dimension", write_dimension)
+    monkeypatch.setattr(StoreDimensionProcessor, "_count_dimension", lambda self: 0)
+
+    p = StoreDimensionProcessor(
+        None, connection_factory=lambda: None, write_behind=True
+    )
+    p._connection = connection
+    assert p.process_update(1)["new"] == 2
+    p.flush()
+    assert p._pending_rows == {}
+
+    # batch 2 reads the rows committed by the writer, no longer queued
+    stages[0] = stage_frame(StoreTable(), store_rows("Cy", UPDATED_AT))
+    counts = p.process_update(2)
+    assert counts["new"] == 0
+    assert counts["updated"] == 2
+    assert counts["skipped"] == 1
+    p.flush()
+    assert written == ["INSERT", "REPLACE"]
+
+
+def test_write_behind_partitions():
+
+    with pytest.raises(Exception, match="connection_factory"):
+        StoreDimensionProcessor(None, write_behind=True)
+    with pytest.raises(Exception, match="cannot write behind"):
+        StoreDimensionProcessor(
+            None, connection_factory=lambda: None, partitions=2, write_behind=True
+        )
+
+
+def test_written_checkpoint_of_empty_batch(monkeypatch):
+
+    connection = FakeCheckpointConnection()
+    monkeypatch.setattr(
+        dimension_processor,
+        "get_stage_row_counts",
+        lambda *args, **kwargs: {StoreTable.NAME: 0, StoreLocationTable.NAME: 0},
+    )
+
+    p = StoreDimensionProcessor(None, checkpoints=BatchCheckpoints(connection))
+    p._connection = connection
+    p.process_update(3, 4)
+
+    assert connection.rows.keys() == {
+        "3/written/store_dimension",
+        "4/written/store_dimension",
+    }
@@ -0,0 +1,128 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from .context import warehouse_util, extract_write_stage, read_stage
+from .context import CustomerDimensionProcessor, CustomerTable, CustomerAddressTable
+from .warehouse_util_test import FakeConnection, stage_dir  # noqa: F401
+
+pytest.importorskip("duckdb")
+from warehouse.duckdb_engine import duckdb_customer_transform  # noqa: E402
+
+T1 = datetime(2021, 9, 1, 12, 0, 0)
+T2 = datetime(2021, 9, 2, 12, 0, 0)
+
+
+def _customer(customer_id, name, referral_type, updated_at, batch_id):
+    return (
+        customer_id,
+        name,
+        f"u{customer_id}",
+        "pw",
+        f"{name}@b.com",
+        referral_type,
+        "F",
+        datetime(1990, 1, 2),
+        1000 + customer_id,
+        "123",
+        True,
+        customer_id % 2 == 0,
+        T1,
+        updated_at,
+        batch_id,
+    )
+
+
+def _address(customer_id, address_id, address, address_type, updated_at, batch_id):
+    return (customer_id, address_id, address, address_type, T1, updated_at, batch_id)
+
+
+BATCHES = {
+    1: {
+        CustomerTable.NAME: [
+            _customer(1, "c1", "OA", T1, 1),
+            _customer(2, "c2", " am", T1, 1),
+            _customer(3, "c3", "", T1, 1),
+        ],
+        CustomerAddressTable.NAME: [
+            _address(1, 1, "A B\n1 Main St\nBrooklyn, NY 11229", "B", T1, 1),
+            _address(1, 2, "A B\n2 Oak St\nFair Lawn,NJ 07410", "S", T1, 1),
+            _address(2, 3, "C D\n3 Elm St\nKenosha, WI 77777", "S", T1, 1),
+        ],
+    },
+    2: {
+        CustomerTable.NAME: [_customer(2, "c2 updated", "XX", T2, 2)],
+        CustomerAddressTable.NAME: [
+            _address(2, 3, "C D\n4 Elm St\nKenosha, WI 77777", "S", T2, 2),
+            _address(3, 4, "malformed address", "B", T2, 2),
+            _address(4, 5, "E F\n5 Pine St\nSt. Joseph, TN 54322", "B", T2, 2),
+        ],
+    },
+}
+
+
+@pytest.fixture(params=["parquet", "ipc", "memory"])
+def staged_batches(stage_dir, monkeypatch, request):  # noqa: F811
+
+    monkeypatch.setattr(warehouse_util, "_stage_backend", None)
+    warehouse_util.set_stage_backend(request.param)
+    tables = [CustomerTable(), CustomerAddressTable()]
+    for batch_id, rows_by_table in BATCHES.items():
+        extract_write_stage(FakeConnection(rows_by_table), batch_id, tables)
+    yield tables
+
+
+def _normalize(customer_dim: pd.DataFrame) -> pd.DataFrame:
+    """Compare values only: object columns with None for missing values"""
+    customer_dim = customer_dim.sort_index().astype(object)
+    return customer_dim.where(customer_dim.notna(), None)
+
+
+@pytest.mark.parametrize("last_batch_id", [1, 2])
+def test_transform_parity(staged_batches, last_batch_id):
+
+    customer, customer_address = read_stage(
+        1, staged_batches, last_batch_id=last_batch_id
+    )
+    pandas_quarantine = []
+    expected = CustomerDimensionProcessor.customer_transform(
+        customer, customer_address, pandas_quarantine
+    )
+
+    duckdb_quarantine = []
+    duckdb_customer, actual = duckdb_customer_transform(
+        1, last_batch_id, duckdb_quarantine
+    )
+
+    pd.testing.assert_frame_equal(
+        _normalize(actual), _normalize(expected), check_names=False
+    )
+    assert sorted(duckdb_customer.index) == sorted(customer.index)
+    assert [q["customer_address_id"].tolist() for q in duckdb_quarantine] == [
+        q["customer_address_id"].tolist() for q in pandas_quarantine
+    ]
+
+
+def test_build_dimension_parity(staged_batches):
+
+    customer, customer_address = read_stage(1, staged_batches, last_batch_id=2)
+    duckdb_customer, customer_changes = duckdb_customer_transform(1, 2)
+    new_keys = pd.Index([1, 2, 3])
+
+    expected = CustomerDimensionProcessor(None)._build_new_dimension(
+        new_keys, customer, customer_address
+    )
+    actual = CustomerDimensionProcessor(None, engine="duckdb")._build_new_dimension(
+        new_keys, duckdb_customer, None, customer_changes
+    )
+
+    pd.testing.assert_frame_equal(
+        _normalize(actual), _normalize(expected), check_names=False
+    )
+
+
+def test_unknown_engine():
+
+    with pytest.raises(Exception, match="Unknown transform engine"):
+        CustomerDimensionProcessor(None, engine="spark")
@@ -0,0 +1,108 @@
+import pandas as pd
+import pytest
+
+from .context import sales_aggregate, AggregateSpec, SALES_AGGREGATES
+from .context import CustomerDimTable, DailyProductSalesTable
+
+duckdb = pytest.importorskip("duckdb")
+
+sales_fact = pd.DataFrame(
+    {
+        "sales_key": [1, 2, 3, 4, 5, 6],
+        "date_key": [20210901, 20210901, 20210901, 20210902, 20210902, 20210902],
+        "customer_dim_key": [10, 11, -1, 10, 12, 11],
+        "product_dim_key": [7, 7, 8, 7, 8, 8],
+        "quantity": [1, 2, 3, 4, 5, 6],
+        "total_price": [1.5, 3.0, 4.5, 6.0, 7.5, 9.0],
+    }
+)
+customer_dim = pd.DataFrame(
+    {"surrogate_key": [10, 11, 12], "age_cohort": ["1990s", "1980s", "1990s"]}
+)
+
+
+def test_spec_columns():
+
+    with pytest.raises(Exception, match="do not match"):
+        AggregateSpec(DailyProductSalesTable(), group_by={"date_key": "f.date_key"})
+
+
+def test_composite_key():
+
+    create_sql = DailyProductSalesTable().get_create_sql_mysql()
+    assert create_sql.endswith("PRIMARY KEY (date_key, product_dim_key));")
+    with pytest.raises(Exception, match="composite primary key"):
+        DailyProductSalesTable().get_primary_key()
+
+
+@pytest.mark.parametrize("spec", SALES_AGGREGATES, ids=lambda s: s.get_name())
+def test_batch_deltas_add_up_to_recompute(spec):
+
+    db = duckdb.connect()
+    db.register("sales_fact", sales_fact)
+    db.register(CustomerDimTable.NAME, customer_dim)
+
+    recomputed = db.execute(spec.get_query()).df()
+    recomputed.columns = spec.get_columns()
+    # batches of facts 1-2, 3-5 and 6, added up like add_fact_delta
+    deltas = [
+        db.execute(
+            spec.get_query("f.sales_key BETWEEN ? AND ?"), [first_key, last_key]
+        ).df()
+        for first_key, last_key in [(1, 2), (3, 5), (6, 6)]
+    ]
+    for delta in deltas:
+        delta.columns = spec.get_columns()
+    stored = pd.concat(deltas).groupby(list(spec.group_by), as_index=False).sum()
+
+    mismatched = sales_aggregate.compare_aggregates(
+        stored, recomputed, list(spec.group_by), list(spec.measures)
+    )
+    assert mismatched.shape[0] == 0
+    assert recomputed["sales_count"].sum() == 6
+
+
+def test_cohort_aggregate():
+
+    (spec,) = [s for s in SALES_AGGREGATES if "age_cohort" in s.group_by]
+    db = duckdb.connect()
+    db.register("sales_fact", sales_fact)
+    db.register(CustomerDimTable.NAME, customer_dim)
+
+    cohorts = db.execute(spec.get_query()).df()
+    cohorts.columns = spec.get_columns()
+    cohorts = cohorts.set_index(["date_key", "age_cohort"])
+
+    assert cohorts.loc[(20210901, "1990s"), "quantity"] == 1
+    assert cohorts.loc[(20210901, "Unknown"), "total_price"] == 4.5
+    assert cohorts.loc[(20210902, "1990s"), "sales_count"] == 2
+
+
+def test_compare_aggregates():
+
+    stored = pd.DataFrame(
+        {
+            "date_key": [1, 1, 2],
+            "product_dim_key": [7, 8, 7],
+            "sales_count": [2, 1, 1],
+            "total_price": [3.0, 1.0, 2.0],
+        }
+    )
+    recomputed = pd.DataFrame(
+        {
+            "date_key": [1, 1, 3],
+            "product_dim_key": [7, 8, 7],
+            "sales_count": [2, 1, 1],
+            "total_price": [3.0 + 1e-9, 1.5, 2.0],
+        }
+    )
+
+    mismatched = sales_aggregate.compare_aggregates(
+        stored,
+        recomputed,
+        ["date_key", "product_dim_key"],
+        ["sales_count", "total_price"],
+    )
+    assert mismatched.index.tolist() == [(1, 8), (2, 7), (3, 7)]
+    assert mismatched.loc[(2, 7), "recomputed_sales_count"] == 0
+    assert mismatched.loc[(1, 8), "stored_total_price"] == 1.0
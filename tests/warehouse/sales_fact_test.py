@@ -0,0 +1,477 @@
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from .context import sales_fact, SalesFactProcessor, DimensionKeyMap, UNKNOWN_KEY
+from .context import OrderTable, OrderLineItemTable, StoreSalesTable
+from .context import BatchCheckpoints
+from .dimension_key_map_test import FakeConnection, SnapshotConnection
+from .batch_checkpoint_test import FakeCheckpointConnection
+
+INSERTED_AT = datetime(2021, 9, 1, 12, 0)
+UPDATED_AT = datetime(2021, 9, 2, 12, 0)
+
+
+def stage_frame(table, rows):
+    """Build a dataframe the way read_stage returns it"""
+    df = pd.DataFrame(rows, columns=table.get_column_names())
+    df = df.astype(table.get_column_pandas_types(storage=False))
+    index_column = (
+        table.get_parent_key() if table.has_parent() else table.get_primary_key()
+    )
+    return df.set_index(index_column, drop=False)
+
+
+order = stage_frame(
+    OrderTable(),
+    [
+        (1, 101, 1, "", 5.0, datetime(2021, 8, 31, 23, 59), False)
+        + (INSERTED_AT, INSERTED_AT, 1),
+        (2, 999, 2, "", 5.0, datetime(2021, 9, 1, 8, 0), False)
+        + (INSERTED_AT, INSERTED_AT, 1),
+    ],
+)
+
+order_line_item = stage_frame(
+    OrderLineItemTable(),
+    [
+        (10, 1, 7, 2, 3.0, 6.0, "", INSERTED_AT, INSERTED_AT, 1),
+        (11, 1, 8, 1, 4.0, 4.0, "", INSERTED_AT, INSERTED_AT, 1),
+        (12, 2, 7, 1, 3.0, 3.0, "", INSERTED_AT, INSERTED_AT, 1),
+        (13, 3, 7, 5, 3.0, 15.0, "", INSERTED_AT, INSERTED_AT, 1),  # order not staged
+        (14, 1, 9, 1, 1.0, 1.0, "updated", INSERTED_AT, UPDATED_AT, 1),
+    ],
+)
+
+store_sales = stage_frame(
+    StoreSalesTable(),
+    [
+        (20, 1, 7, 1, 3.0, 3.0, "S", datetime(2021, 9, 1), "4111", 5001)
+        + (INSERTED_AT, INSERTED_AT, 1),
+        (21, 1, 7, 2, 3.0, 6.0, "S", datetime(2021, 9, 1), "4111", 5999)
+        + (INSERTED_AT, INSERTED_AT, 1),
+        (22, 1, 8, 1, 4.0, 4.0, "S", datetime(2021, 8, 1), "4112", 5001)
+        + (INSERTED_AT, UPDATED_AT, 1),
+    ],
+)
+
+
+@pytest.fixture
+def processor():
+    p = SalesFactProcessor(None)
+    p._customer_keys = DimensionKeyMap(
+        FakeConnection([(101, 1, 0), (101, 5, 1)]), "customer_dim", "customer_key"
+    )
+    p._loyalty_customer_keys = DimensionKeyMap(
+        FakeConnection([(5001, 5, 1)]), "customer_dim", "loyalty_number"
+    )
+    p._product_keys = DimensionKeyMap(
+        FakeConnection([(7, 70, 1), (9, 90, 1)]), "product_dim", "product_key"
+    )
+    p._store_keys = DimensionKeyMap(
+        FakeConnection([(1, 10, 1)]), "store_dim", "store_key"
+    )
+    p.committed = mark_updated_sales_loaded(p)
+    yield p
+
+
+def mark_updated_sales_loaded(p):
+    """
+    The updated line item and store sale had their facts appended by an earlier batch: return the
+    source ids of the sales_fact table by channel
+    """
+    committed = {sales_fact.ECOMMERCE_CHANNEL: {14}, sales_fact.STORE_CHANNEL: {22}}
+    p._read_fact_source_ids = lambda channel, source_ids: [
+        i for i in source_ids if i in committed[channel]
+    ]
+    return committed
+
+
+def test_ecommerce_facts(processor):
+
+    processor._refresh_key_maps()
+    facts = processor._build_ecommerce_facts(order, order_line_item)
+
+    # line items updated after their fact was appended are not facts
+    assert facts["source_id"].tolist() == [10, 11, 12, 13]
+    assert facts["customer_dim_key"].tolist() == [5, 5, UNKNOWN_KEY, UNKNOWN_KEY]
+    # order date, or insertion date without staged order
+    assert facts["date_key"].tolist() == [20210831, 20210831, 20210901, 20210901]
+    assert facts["total_price"].tolist() == [6.0, 4.0, 3.0, 15.0]
+    assert facts["product_dim_key"].tolist() == [70, UNKNOWN_KEY, 70, 70]
+    assert (facts["store_dim_key"] == UNKNOWN_KEY).all()
+    assert (facts["sales_channel"] == sales_fact.ECOMMERCE_CHANNEL).all()
+
+
+def test_store_facts(processor):
+
+    processor._refresh_key_maps()
+    facts = processor._build_store_facts(store_sales)
+
+    assert facts["source_id"].tolist() == [20, 21]
+    assert facts["customer_dim_key"].tolist() == [5, UNKNOWN_KEY]
+    assert facts["date_key"].tolist() == [20210901, 20210901]
+    assert facts["product_dim_key"].tolist() == [70, 70]
+    assert facts["store_dim_key"].tolist() == [10, 10]
+    assert facts["order_id"].isna().all()
+
+
+def test_key_maps_see_committed_rows(processor):
+
+    connection = SnapshotConnection([(7, 70, 1)])
+    processor._connection = connection
+    processor._product_keys = DimensionKeyMap(connection, "product_dim", "product_key")
+    processor._refresh_key_maps()
+
+    # product 9 is committed by the product dimension processor
+    connection.committed_rows.append((9, 90, 1))
+    processor._refresh_key_maps()
+    assert processor._product_keys.lookup([7, 9]).tolist() == [70, 90]
+
+
+def test_sales_updated_in_range(processor):
+
+    processor._refresh_key_maps()
+    # line item 15 was inserted and updated within the batch range: read_stage keeps its update only
+    updated_in_range = stage_frame(
+        OrderLineItemTable(),
+        [
+            (15, 2, 7, 2, 3.0, 6.0, "updated", INSERTED_AT, UPDATED_AT, 2),
+            (14, 1, 9, 1, 1.0, 1.0, "again", INSERTED_AT, UPDATED_AT, 2),
+        ],
+    )
+    facts = processor._build_ecommerce_facts(order, updated_in_range)
+    assert facts["source_id"].tolist() == [15]
+    assert facts["total_price"].tolist() == [6.0]
+
+    # a later update of line item 15 is not a new sale
+    processor.committed[sales_fact.ECOMMERCE_CHANNEL].add(15)
+    facts = processor._build_ecommerce_facts(order, updated_in_range)
+    assert facts.shape[0] == 0
+
+
+def test_failed_write_keeps_sales_new(processor, monkeypatch):
+
+    monkeypatch.setattr(
+        sales_fact, "get_stage_row_counts", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(
+        sales_fact,
+        "read_stage",
+        lambda batch_id, tables, last_batch_id=None: [
+            {
+                OrderTable.NAME: order,
+                OrderLineItemTable.NAME: order_line_item,
+                StoreSalesTable.NAME: store_sales,
+            }[t.get_name()]
+            for t in tables
+        ],
+    )
+
+    written = []
+
+    def write_facts(self, df):
+        if not written:
+            written.append(None)
+            raise Exception("lost connection")
+        written.append(df)
+
+    monkeypatch.setattr(SalesFactProcessor, "_write_facts", write_facts)
+    with pytest.raises(Exception, match="lost connection"):
+        processor.process_update(1)
+    assert processor._pending_sales == {}
+
+    # the retry appends the sales again
+    processor.process_update(1)
+    assert written[-1]["source_id"].tolist() == [10, 11, 12, 13, 20, 21]
+
+
+@pytest.mark.parametrize(
+    "row_counts, sources",
+    [
+        (None, {OrderLineItemTable.NAME: 4, StoreSalesTable.NAME: 2}),
+        (
+            {OrderTable.NAME: 0, OrderLineItemTable.NAME: 5, StoreSalesTable.NAME: 0},
+            {OrderLineItemTable.NAME: 4},
+        ),
+    ],
+)
+def test_process_update(processor, monkeypatch, row_counts, sources):
+
+    stages = {
+        OrderTable.NAME: order,
+        OrderLineItemTable.NAME: order_line_item,
+        StoreSalesTable.NAME: store_sales,
+    }
+    read_tables = []
+
+    def fake_read_stage(batch_id, tables, last_batch_id=None):
+        read_tables.extend(t.get_name() for t in tables)
+        return [stages[t.get_name()] for t in tables]
+
+    monkeypatch.setattr(
+        sales_fact, "get_stage_row_counts", lambda *args, **kwargs: row_counts
+    )
+    monkeypatch.setattr(sales_fact, "read_stage", fake_read_stage)
+    written = []
+    monkeypatch.setattr(
+        SalesFactProcessor, "_write_facts", lambda self, df: written.append(df)
+    )
+
+    processor.process_update(1)
+    processor.process_update(2)
+
+    if row_counts is not None:
+        assert OrderTable.NAME not in read_tables
+        assert StoreSalesTable.NAME not in read_tables
+    for facts in written:
+        assert facts.shape[0] == sum(sources.values())
+        assert facts.dtypes.to_dict() == processor._fact_table.get_column_pandas_types()
+    # surrogate keys continue over batches
+    keys = pd.concat(written)["sales_key"].tolist()
+    assert keys == list(range(1, 2 * sum(sources.values()) + 1))
+
+
+def test_queued_sales_not_appended_again(processor, monkeypatch):
+
+    # line item 15 is inserted by batch 1 and updated by batch 2, while the facts of batch 1 are queued
+    stages = [
+        stage_frame(
+            OrderLineItemTable(),
+            [(15, 2, 7, 2, 3.0, 6.0, "", INSERTED_AT, INSERTED_AT, 1)],
+        ),
+        stage_frame(
+            OrderLineItemTable(),
+            [(15, 2, 7, 2, 3.0, 6.0, "updated", INSERTED_AT, UPDATED_AT, 2)],
+        ),
+    ]
+    monkeypatch.setattr(
+        sales_fact,
+        "get_stage_row_counts",
+        lambda *args, **kwargs: {
+            OrderTable.NAME: 0,
+            OrderLineItemTable.NAME: 1,
+            StoreSalesTable.NAME: 0,
+        },
+    )
+    monkeypatch.setattr(
+        sales_fact,
+        "read_stage",
+        lambda batch_id, tables, last_batch_id=None: [stages[batch_id - 1]],
+    )
+    release = threading.Event()
+    written = []
+
+    def write_facts(self, df):
+        release.wait(5)
+        written.append(df)
+
+    monkeypatch.setattr(SalesFactProcessor, "_write_facts", write_facts)
+
+    p = SalesFactProcessor(None, connection_factory=lambda: None, write_behind=True)
+    mark_updated_sales_loaded(p)
+    p.process_update(1)
+    p.process_update(2)
+    release.set()
+    p.flush()
+
+    assert [df["source_id"].tolist() for df in written] == [[15]]
+    assert p._pending_sales == {}
+
+
+class FakeFactCursor:
+    def __init__(self, connection):
+        self._connection = connection
+        self._result = []
+
+    def execute(self, sql, params=()):
+        self._connection.statements.append(sql)
+        if sql.startswith("SELECT f.source_id"):
+            ids = self._connection.lookup_ids
+        elif sql.startswith("SELECT source_id"):
+            ids = params[1:]
+        else:
+            return
+        self._result = [
+            (source_id,)
+            for channel, source_id in self._connection.rows
+            if channel == params[0] and source_id in ids
+        ]
+
+    def executemany(self, sql, rows):
+        self._connection.lookup_ids.extend(k for (k,) in rows)
+
+    def fetchall(self):
+        return self._result
+
+
+class FakeFactConnection:
+    """The (sales_channel, source_id) rows of the sales_fact table"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.lookup_ids = []
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeFactCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+@pytest.mark.parametrize("in_limit", [1000, 1])
+def test_read_fact_source_ids(monkeypatch, in_limit):
+
+    monkeypatch.setattr(sales_fact, "READ_DIMENSION_IN_LIMIT", in_limit)
+    p = SalesFactProcessor(None)
+    connection = FakeFactConnection(
+        [(sales_fact.ECOMMERCE_CHANNEL, 14), (sales_fact.STORE_CHANNEL, 15)]
+    )
+    p._connection = connection
+
+    source_ids = pd.Series([14, 15, 16, 14])
+    found = p._read_fact_source_ids(sales_fact.ECOMMERCE_CHANNEL, source_ids)
+
+    assert found == [14]
+    assert connection.commits == 1  # the read starts from a new snapshot
+    if in_limit == 1:
+        assert sorted(connection.lookup_ids) == [14, 15, 16]
+        assert connection.statements[-1].startswith("DROP TEMPORARY TABLE")
+    else:
+        assert "IN (%s,%s,%s)" in connection.statements[-1]
+
+
+def test_unknown_write_method():
+
+    with pytest.raises(Exception, match="write method"):
+        SalesFactProcessor(None, write_method="copy")
+
+
+def test_immutable_sources(monkeypatch):
+
+    table = StoreSalesTable()
+    (quantity,) = [
+        col for col in table.get_columns() if col.get_name() == "store_sales_quantity"
+    ]
+    monkeypatch.setattr(quantity, "_update", True)
+    with pytest.raises(Exception, match="facts are immutable"):
+        sales_fact.check_immutable_sources([OrderLineItemTable(), table])
+    sales_fact.check_immutable_sources(SalesFactProcessor.get_stage_tables())
+
+
+def test_write_behind(monkeypatch):
+
+    monkeypatch.setattr(
+        sales_fact, "get_stage_row_counts", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(
+        sales_fact,
+        "read_stage",
+        lambda batch_id, tables, last_batch_id=None: [
+            {
+                OrderTable.NAME: order,
+                OrderLineItemTable.NAME: order_line_item,
+                StoreSalesTable.NAME: store_sales,
+            }[t.get_name()]
+            for t in tables
+        ],
+    )
+    written = []
+    monkeypatch.setattr(
+        SalesFactProcessor,
+        "_write_facts",
+        lambda self, df: (time.sleep(0.1), written.append(df)),
+    )
+
+    p = SalesFactProcessor(None, connection_factory=lambda: None, write_behind=True)
+    mark_updated_sales_loaded(p)
+    p.process_update(1)
+    p.process_update(2)
+    assert len(written) < 2
+    p.flush()
+
+    keys = pd.concat(written)["sales_key"].tolist()
+    assert keys == list(range(1, 13))
+    with pytest.raises(Exception, match="connection_factory"):
+        SalesFactProcessor(None, write_behind=True)
+
+
+def test_facts_and_checkpoint_one_transaction(processor, monkeypatch):
+
+    connection = FakeCheckpointConnection()
+    processor._connection = connection
+    processor._checkpoints = BatchCheckpoints(connection)
+    monkeypatch.setattr(
+        sales_fact, "get_stage_row_counts", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(
+        sales_fact,
+        "read_stage",
+        lambda batch_id, tables, last_batch_id=None: [
+            {
+                OrderTable.NAME: order,
+                OrderLineItemTable.NAME: order_line_item,
+                StoreSalesTable.NAME: store_sales,
+            }[t.get_name()]
+            for t in tables
+        ],
+    )
+
+    def insert_rows(connection, table, df):
+        connection.pending.append((f"facts of batch {batch_id}", df.shape[0]))
+        if fail:
+            raise Exception("lost connection")
+
+    monkeypatch.setattr(sales_fact, "insert_rows", insert_rows)
+
+    batch_id, fail = 1, False
+    processor.process_update(batch_id)
+    assert set(connection.rows) == {"facts of batch 1", "1/written/sales_fact"}
+
+    # neither the facts nor the checkpoint of a failed write are committed
+    batch_id, fail = 2, True
+    with pytest.raises(Exception, match="lost connection"):
+        processor.process_update(batch_id)
+    connection.commit()
+    assert processor._checkpoints.get_written_processors(2) == set()
+    assert "facts of batch 2" not in connection.rows
+
+
+def test_aggregates_in_fact_transaction(processor, monkeypatch):
+
+    connection = FakeCheckpointConnection()
+    processor._connection = connection
+    monkeypatch.setattr(
+        sales_fact, "get_stage_row_counts", lambda *args, **kwargs: None
+    )
+    monkeypatch.setattr(
+        sales_fact,
+        "read_stage",
+        lambda batch_id, tables, last_batch_id=None: [
+            {
+                OrderTable.NAME: order,
+                OrderLineItemTable.NAME: order_line_item,
+                StoreSalesTable.NAME: store_sales,
+            }[t.get_name()]
+            for t in tables
+        ],
+    )
+    monkeypatch.setattr(sales_fact, "insert_rows", lambda connection, table, df: None)
+    added = []
+
+    def add_fact_delta(connection, specs, first_key, last_key):
+        assert connection.pending == []  # not committed before
+        added.append((first_key, last_key))
+
+    monkeypatch.setattr(sales_fact, "add_fact_delta", add_fact_delta)
+
+    processor.process_update(1)
+    processor.process_update(2)
+
+    # 4 e-commerce and 2 store facts per batch
+    assert added == [(1, 6), (7, 12)]
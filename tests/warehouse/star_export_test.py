@@ -0,0 +1,140 @@
+import os
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+from .context import StarExport, SalesFactTable, StoreDimTable
+
+DEFAULTS = {
+    "INTEGER": 0,
+    "BIGINT": 0,
+    "VARCHAR": "",
+    "FLOAT": 0.0,
+    "DATE": pd.Timestamp(2021, 9, 1),
+    "BOOLEAN": True,
+    "TIMESTAMP": pd.Timestamp(2021, 9, 1),
+}
+
+
+def table_rows(table, **values):
+    """Build rows of a table from the given column values, other columns set to a default"""
+    n_rows = len(next(iter(values.values())))
+    return pd.DataFrame(
+        {
+            col.get_name(): values.get(
+                col.get_name(), [DEFAULTS[col.get_type()]] * n_rows
+            )
+            for col in table.get_columns()
+        }
+    )
+
+
+def store_rows(surrogate_keys, cities):
+    return table_rows(StoreDimTable(), surrogate_key=surrogate_keys, city=cities)
+
+
+def fact_rows(sales_keys, date_keys):
+    return table_rows(
+        SalesFactTable(),
+        sales_key=sales_keys,
+        date_key=date_keys,
+        sales_channel=["Store"] * len(sales_keys),
+        order_id=pd.array([None] * len(sales_keys), dtype="Int64"),
+    )
+
+
+@pytest.fixture
+def export(tmp_path):
+    yield StarExport(
+        [StoreDimTable(), SalesFactTable()], root=str(tmp_path), compact_batches=2
+    )
+
+
+def test_read_current_overlays_changes(export):
+
+    export.publish(StoreDimTable.NAME, 1, store_rows([1, 2], ["Brooklyn", "Paramus"]))
+    export.publish(StoreDimTable.NAME, 2, store_rows([1], ["Queens"]))
+    export.publish(StoreDimTable.NAME, 3, store_rows([], []))
+
+    assert export.get_uncompacted_batches(StoreDimTable.NAME) == [1, 2]
+    current = export.read_current(StoreDimTable.NAME).to_pandas()
+    assert current.shape[0] == 2
+    assert current.set_index("surrogate_key")["city"].to_dict() == {
+        1: "Queens",
+        2: "Paramus",
+    }
+    assert list(current.columns) == StoreDimTable().get_column_names()
+
+
+def test_compact(export, tmp_path):
+
+    export.publish(SalesFactTable.NAME, 1, fact_rows([1, 2], [20210901, 20210901]))
+    export.publish(SalesFactTable.NAME, 2, fact_rows([3, 4], [20210901, 20210902]))
+    export.publish(SalesFactTable.NAME, 3, fact_rows([5], [20210902]))
+
+    assert export.compact(SalesFactTable.NAME, last_batch_id=2) == 2
+    assert export.get_snapshot_batch(SalesFactTable.NAME) == 2
+    assert export.get_uncompacted_batches(SalesFactTable.NAME) == [3]
+    snapshot_dir = tmp_path / SalesFactTable.NAME / "snapshot" / "as_of=2"
+    assert sorted(os.listdir(snapshot_dir)) == [
+        "date_key=20210901",
+        "date_key=20210902",
+    ]
+    assert sorted(os.listdir(tmp_path / SalesFactTable.NAME / "changes")) == [
+        "batch_id=3"
+    ]
+
+    current = export.read_current(SalesFactTable.NAME).to_pandas()
+    assert sorted(current["sales_key"]) == [1, 2, 3, 4, 5]
+    assert current["order_id"].isna().all()
+
+    assert export.compact(SalesFactTable.NAME) == 1
+    assert export.compact(SalesFactTable.NAME) == 0
+    assert os.listdir(tmp_path / SalesFactTable.NAME / "snapshot") == ["as_of=3"]
+    assert export.read_current(SalesFactTable.NAME).num_rows == 5
+
+
+def test_filter_skips_replaced_rows(export):
+
+    export.publish(StoreDimTable.NAME, 1, store_rows([1, 2], ["Brooklyn", "Paramus"]))
+    export.compact(StoreDimTable.NAME)
+    export.publish(StoreDimTable.NAME, 2, store_rows([1], ["Queens"]))
+
+    # the snapshot row of store 1 matches, but was replaced by batch 2
+    brooklyn = export.read_current(
+        StoreDimTable.NAME, filter=ds.field("city") == "Brooklyn"
+    )
+    assert brooklyn.num_rows == 0
+
+    queens = export.read_current(
+        StoreDimTable.NAME,
+        columns=["surrogate_key"],
+        filter=ds.field("city") == "Queens",
+    )
+    assert queens.column_names == ["surrogate_key"]
+    assert queens["surrogate_key"].to_pylist() == [1]
+
+
+def test_compact_due(export):
+
+    export.publish(StoreDimTable.NAME, 1, store_rows([1], ["Brooklyn"]))
+    export.compact_due(1)
+    assert export.get_snapshot_batch(StoreDimTable.NAME) is None
+
+    export.publish(StoreDimTable.NAME, 2, store_rows([2], ["Paramus"]))
+    export.publish(StoreDimTable.NAME, 3, store_rows([3], ["Queens"]))
+    export.compact_due(2)  # batch 3 may still be published
+    assert export.get_snapshot_batch(StoreDimTable.NAME) == 2
+    assert export.get_uncompacted_batches(StoreDimTable.NAME) == [3]
+    assert export.read_current(StoreDimTable.NAME).num_rows == 3
+
+
+def test_recreate(export, tmp_path):
+
+    export.publish(StoreDimTable.NAME, 1, store_rows([1], ["Brooklyn"]))
+
+    restarted = StarExport([StoreDimTable()], root=str(tmp_path), recreate=False)
+    assert restarted.read_current(StoreDimTable.NAME).num_rows == 1
+    recreated = StarExport([StoreDimTable()], root=str(tmp_path))
+    assert recreated.read_current(StoreDimTable.NAME).num_rows == 0
@@ -0,0 +1,110 @@
+import threading
+
+from .context import SurrogateKeyAllocator
+
+
+class FakeAllocationCursor:
+    """Applies the block reservation upsert to the next_key values of a FakeAllocationDatabase"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._result = None
+
+    def execute(self, statement, params=None):
+        database = self._connection.database
+        database.statements.append(statement)
+        if statement.startswith("INSERT"):
+            table_name, n_keys, _ = params
+            with database.lock:
+                next_key = database.next_keys.get(table_name, 1) + n_keys
+                database.next_keys[table_name] = next_key
+            self._connection.last_insert_id = next_key
+        elif statement.startswith("SELECT LAST_INSERT_ID"):
+            self._result = (self._connection.last_insert_id,)
+        elif statement.startswith("DELETE"):
+            database.next_keys.pop(params[0], None)
+
+    def fetchone(self):
+        return self._result
+
+
+class FakeAllocationConnection:
+    def __init__(self, database):
+        self.database = database
+        self.last_insert_id = 0
+
+    def cursor(self):
+        return FakeAllocationCursor(self)
+
+    def commit(self):
+        pass
+
+
+class FakeAllocationDatabase:
+    def __init__(self):
+        self.next_keys = {}
+        self.statements = []
+        self.lock = threading.Lock()
+
+    def count_reservations(self):
+        return sum(s.startswith("INSERT") for s in self.statements)
+
+
+def test_allocate_from_cached_block():
+
+    database = FakeAllocationDatabase()
+    allocator = SurrogateKeyAllocator(
+        FakeAllocationConnection(database), "customer_dim", block_size=100
+    )
+
+    assert allocator.allocate(10) == 1
+    assert allocator.allocate(90) == 11
+    assert database.count_reservations() == 1
+
+    # does not fit the cached block: a new contiguous block is reserved
+    assert allocator.allocate(150) == 101
+    assert allocator.allocate(1) == 251
+    assert database.count_reservations() == 3
+
+
+def test_allocators_do_not_collide():
+
+    database = FakeAllocationDatabase()
+    allocators = [
+        SurrogateKeyAllocator(
+            FakeAllocationConnection(database), "customer_dim", block_size=7
+        )
+        for _ in range(4)
+    ]
+    keys = [[] for _ in allocators]
+
+    def allocate(i):
+        for _ in range(50):
+            first_key = allocators[i].allocate(3)
+            keys[i].extend(range(first_key, first_key + 3))
+
+    threads = [threading.Thread(target=allocate, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_keys = [k for worker_keys in keys for k in worker_keys]
+    assert len(all_keys) == len(set(all_keys)) == 600
+
+
+def test_restart_continues_after_reserved_keys():
+
+    database = FakeAllocationDatabase()
+    allocator = SurrogateKeyAllocator(
+        FakeAllocationConnection(database), "customer_dim", block_size=100
+    )
+    assert allocator.allocate(5) == 1
+
+    restarted = SurrogateKeyAllocator(
+        FakeAllocationConnection(database), "customer_dim", block_size=100
+    )
+    assert restarted.allocate(5) == 101
+
+    restarted.reset()
+    assert restarted.allocate(5) == 1
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+from .context import TransformScheduler, CustomerDimensionProcessor, WriteBehind
+
+
+class FakeProcessor:
+    """Records the interval of each process_update call in a shared log"""
+
+    def __init__(self, name, dependencies=(), seconds=0.1, log=None, fail=False):
+        self.NAME = name
+        self._dependencies = list(dependencies)
+        self._seconds = seconds
+        self._log = log if log is not None else {}
+        self._fail = fail
+
+    def get_stage_tables(self):
+        return []
+
+    def get_dependencies(self):
+        return self._dependencies
+
+    def process_update(self, batch_id, last_batch_id=None):
+        start = time.perf_counter()
+        time.sleep(self._seconds)
+        if self._fail:
+            raise Exception(f"{self.NAME} failed")
+        self._log[self.NAME] = (start, time.perf_counter(), threading.get_ident())
+
+
+def test_dimensions_concurrent_facts_after():
+
+    log = {}
+    scheduler = TransformScheduler(
+        [
+            FakeProcessor("sales_fact", ["customer_dim", "product_dim"], log=log),
+            FakeProcessor("customer_dim", log=log),
+            FakeProcessor("product_dim", log=log),
+        ]
+    )
+
+    assert scheduler.get_order() == ["customer_dim", "product_dim", "sales_fact"]
+    start = time.perf_counter()
+    timings = scheduler.run(1)
+    elapsed = time.perf_counter() - start
+
+    assert set(timings) == {"customer_dim", "product_dim", "sales_fact"}
+    assert all(seconds >= 0.1 for seconds in timings.values())
+    # dimensions overlap, the fact starts after both
+    assert log["customer_dim"][0] < log["product_dim"][1]
+    assert log["product_dim"][0] < log["customer_dim"][1]
+    assert log["sales_fact"][0] >= max(log["customer_dim"][1], log["product_dim"][1])
+    assert elapsed < 0.29
+
+
+def test_dependency_errors():
+
+    with pytest.raises(Exception, match="unknown processor"):
+        TransformScheduler([FakeProcessor("sales_fact", ["store_dim"])])
+    with pytest.raises(Exception, match="cycle"):
+        TransformScheduler(
+            [
+                FakeProcessor("a", ["b"]),
+                FakeProcessor("b", ["a"]),
+                FakeProcessor("c"),
+            ]
+        )
+    with pytest.raises(Exception, match="unique"):
+        TransformScheduler([FakeProcessor("a"), FakeProcessor("a")])
+
+
+def test_failure_stops_dependents():
+
+    log = {}
+    scheduler = TransformScheduler(
+        [
+            FakeProcessor("customer_dim", fail=True, log=log),
+            FakeProcessor("product_dim", seconds=0.2, log=log),
+            FakeProcessor("sales_fact", ["customer_dim", "product_dim"], log=log),
+        ]
+    )
+
+    with pytest.raises(Exception, match="customer_dim failed"):
+        scheduler.run(1)
+    assert "product_dim" in log  # running processors complete
+    assert "sales_fact" not in log
+
+
+def test_skip_completed_processors():
+
+    log = {}
+    scheduler = TransformScheduler(
+        [
+            FakeProcessor("customer_dim", log=log),
+            FakeProcessor("product_dim", log=log),
+            FakeProcessor("sales_fact", ["customer_dim", "product_dim"], log=log),
+        ]
+    )
+
+    # restart of a batch which failed in product_dim
+    timings = scheduler.run(1, skip={"customer_dim"})
+    assert set(timings) == {"product_dim", "sales_fact"}
+    assert "customer_dim" not in log
+
+
+class FakeWriteBehindProcessor(FakeProcessor):
+    """Queues a write of 0.2 s on each process_update"""
+
+    def __init__(self, name, log):
+        super().__init__(name, seconds=0, log=log)
+        self._writer = WriteBehind(name)
+
+    def process_update(self, batch_id, last_batch_id=None):
+        super().process_update(batch_id, last_batch_id)
+        self._writer.submit(self._write)
+
+    def _write(self):
+        time.sleep(0.2)
+        self._log[f"{self.NAME}_write"] = time.perf_counter()
+
+    def flush(self):
+        self._writer.flush()
+
+
+def test_dependents_wait_for_writes():
+
+    log = {}
+    scheduler = TransformScheduler(
+        [
+            FakeWriteBehindProcessor("customer_dim", log=log),
+            FakeProcessor("sales_fact", ["customer_dim"], seconds=0, log=log),
+        ]
+    )
+
+    scheduler.run(1)
+    assert log["sales_fact"][0] >= log["customer_dim_write"]
+
+
+def test_customer_dimension_declarations():
+
+    scheduler = TransformScheduler([CustomerDimensionProcessor(None)])
+
+    assert scheduler.get_order() == [CustomerDimensionProcessor.NAME]
+    assert [t.get_name() for t in CustomerDimensionProcessor.get_stage_tables()] == [
+        "customer",
+        "customer_address",
+    ]
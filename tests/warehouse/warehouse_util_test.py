@@ -0,0 +1,498 @@
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from .context import warehouse_util, extract_write_stage, read_stage
+from .context import CustomerTable, CustomerAddressTable
+
+TEST_TIME = datetime(2021, 9, 1, 12, 34, 56, 123456)
+
+customer_rows = [
+    (
+        1,
+        "c1",
+        "u1",
+        "p1",
+        "a@b.com",
+        "OA",
+        "F",
+        datetime(1990, 1, 2),
+        1001,
+        "123",
+        True,
+        False,
+        TEST_TIME,
+        TEST_TIME,
+        1,
+    ),
+    (
+        2,
+        "",
+        None,
+        "p2",
+        "b@b.com",
+        None,
+        "M",
+        datetime(1991, 3, 4),
+        1002,
+        "456",
+        False,
+        True,
+        TEST_TIME,
+        TEST_TIME,
+        1,
+    ),
+]
+
+customer_address_rows = [
+    (
+        1,
+        1,
+        "First Middle Last\n123 Snickersnack Lane\nBrooklyn, NY 11229",
+        "B",
+        TEST_TIME,
+        TEST_TIME,
+        1,
+    ),
+]
+
+
+def _csv_value(value) -> str:
+    """Format a value the way postgres COPY ... (FORMAT csv) does"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+TABLES = {
+    table.get_name(): table for table in [CustomerTable(), CustomerAddressTable()]
+}
+
+
+class FakeCursor:
+    """Cursor serving canned rows for the snapshot, planning, SELECT and COPY TO STDOUT statements"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._result = []
+
+    def _rows(self, sql):
+        table_name = next(
+            name for name in self._connection.rows_by_table if f" {name} " in sql
+        )
+        rows = self._connection.rows_by_table[table_name]
+        if " BETWEEN " in sql:
+            low, high = [
+                int(v)
+                for v in sql.split(" BETWEEN ")[1]
+                .split(")")[0]
+                .rstrip(";")
+                .split(" AND ")
+            ]
+            key_index = (
+                TABLES[table_name]
+                .get_column_names()
+                .index(TABLES[table_name].get_primary_key())
+            )
+            rows = [row for row in rows if low <= row[key_index] <= high]
+        return rows
+
+    def execute(self, sql):
+        self._connection.statements.append(sql)
+        if sql.startswith("SET"):
+            self._result = []
+        elif "pg_export_snapshot" in sql:
+            self._result = [("00000003-0000001B-1",)]
+        elif sql.startswith("SELECT COUNT(*)"):
+            table = next(t for name, t in TABLES.items() if f" {name} " in sql)
+            keys = [
+                row[table.get_column_names().index(table.get_primary_key())]
+                for row in self._rows(sql)
+            ]
+            self._result = [
+                (len(keys), min(keys, default=None), max(keys, default=None))
+            ]
+        else:
+            self._result = self._rows(sql)
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchmany(self, size):
+        rows, self._result = self._result[:size], self._result[size:]
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self._result))
+
+    def close(self):
+        pass
+
+    def copy_expert(self, sql, file):
+        self._connection.statements.append(sql)
+        column_names = sql.split("SELECT ")[1].split(" from")[0]
+        file.write((column_names + "\n").encode())
+        for row in self._rows(sql):
+            file.write((",".join(_csv_value(v) for v in row) + "\n").encode())
+
+
+class FakeConnection:
+    def __init__(self, rows_by_table):
+        self.rows_by_table = rows_by_table
+        self.statements = []
+        self.autocommit = False
+        self.closed = False
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return 0  # TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stage_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(warehouse_util, "STAGE_ROOT", str(tmp_path))
+    yield tmp_path
+
+
+@pytest.fixture
+def connection():
+    yield FakeConnection(
+        {
+            CustomerTable.NAME: customer_rows,
+            CustomerAddressTable.NAME: customer_address_rows,
+        }
+    )
+
+
+@pytest.mark.parametrize("method", ["copy", "cursor", "select"])
+def test_extract_write_stage(stage_dir, connection, method):
+
+    tables = [CustomerTable(), CustomerAddressTable()]
+    extract_write_stage(connection, 1, tables, method=method)
+    customer, customer_address = read_stage(1, tables)
+
+    assert customer.shape[0] == 2
+    assert customer.loc[1, "customer_is_active"] == False
+    assert customer.loc[2, "customer_is_preferred"] == False
+    assert customer.loc[2, "customer_name"] == ""
+    assert pd.isna(customer.loc[2, "customer_user_id"])
+    assert pd.isna(customer.loc[2, "customer_referral_type"])
+    assert customer.loc[1, "customer_updated_at"] == TEST_TIME
+    assert customer.loc[2, "customer_date_of_birth"] == datetime(1991, 3, 4)
+    assert customer_address.shape[0] == 1
+    assert customer_address.loc[1, "customer_address"].endswith("NY 11229")
+
+
+@pytest.mark.parametrize("method", ["cursor", "select"])
+def test_extract_methods_match(stage_dir, connection, method):
+
+    tables = [CustomerTable(), CustomerAddressTable()]
+    extract_write_stage(connection, 1, tables, method=method, chunk_size=1)
+    selected = read_stage(1, tables)
+    extract_write_stage(connection, 1, tables, method="copy")
+    copied = read_stage(1, tables)
+
+    for selected_df, copied_df in zip(selected, copied):
+        pd.testing.assert_frame_equal(selected_df, copied_df)
+
+
+def test_extract_empty_table(stage_dir):
+
+    tables = [CustomerTable()]
+    extract_write_stage(FakeConnection({CustomerTable.NAME: []}), 1, tables)
+    (customer,) = read_stage(1, tables)
+
+    assert customer.shape[0] == 0
+    assert list(customer.columns) == CustomerTable().get_column_names()
+
+
+def test_cursor_extract_chunks(stage_dir, connection):
+
+    extract_write_stage(connection, 1, [CustomerTable()], method="cursor", chunk_size=1)
+    stage_file = warehouse_util.get_stage_file(1, CustomerTable.NAME, 0)
+
+    assert pq.ParquetFile(stage_file).num_row_groups == 2
+
+
+class FailingCursor(FakeCursor):
+    def copy_expert(self, sql, file):
+        file.write(b"customer_id\n")
+        raise Exception("connection lost")
+
+    def fetchmany(self, size):
+        raise Exception("connection lost")
+
+    def fetchall(self):
+        raise Exception("connection lost")
+
+
+class FailingConnection(FakeConnection):
+    def cursor(self, name=None):
+        return FailingCursor(self)
+
+
+@pytest.mark.parametrize("method", ["copy", "cursor", "select"])
+def test_failed_extract_leaves_no_file(stage_dir, connection, method):
+
+    with pytest.raises(Exception, match="connection lost"):
+        extract_write_stage(
+            FailingConnection({CustomerTable.NAME: customer_rows}),
+            1,
+            [CustomerTable()],
+            method=method,
+        )
+
+    assert os.listdir(stage_dir / "batch_id=1" / CustomerTable.NAME) == []
+
+
+@pytest.mark.parametrize("method", ["copy", "cursor"])
+def test_parallel_extract_split_by_key_range(stage_dir, connection, method):
+
+    worker_connections = []
+
+    def connection_factory():
+        worker_connections.append(FakeConnection(connection.rows_by_table))
+        return worker_connections[-1]
+
+    tables = [CustomerTable(), CustomerAddressTable()]
+    extract_write_stage(
+        connection,
+        1,
+        tables,
+        method=method,
+        connection_factory=connection_factory,
+        workers=2,
+        split_rows=1,
+    )
+    customer, customer_address = read_stage(1, tables)
+
+    assert sorted(os.listdir(stage_dir / "batch_id=1" / CustomerTable.NAME)) == [
+        "part-0000.parquet",
+        "part-0001.parquet",
+    ]
+    assert sorted(customer.index.tolist()) == [1, 2]
+    assert customer_address.shape[0] == 1
+
+    # one worker connection per part, each importing the coordinator's snapshot
+    assert len(worker_connections) == 3
+    for worker_connection in worker_connections:
+        assert worker_connection.closed
+        assert worker_connection.statements[:2] == [
+            "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;",
+            "SET TRANSACTION SNAPSHOT '00000003-0000001B-1';",
+        ]
+    assert connection.statements[:2] == [
+        "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;",
+        "SELECT pg_export_snapshot();",
+    ]
+
+
+def test_stage_manifest(stage_dir, connection):
+
+    tables = [CustomerTable(), CustomerAddressTable()]
+    extract_write_stage(connection, 1, tables, split_rows=1)
+
+    with open(stage_dir / "batch_id=1" / "_manifest.json") as f:
+        manifest = json.load(f)
+
+    customer_entry = manifest["tables"][CustomerTable.NAME]
+    assert customer_entry["row_count"] == 2
+    assert (
+        customer_entry["schema_fingerprint"] == CustomerTable().get_schema_fingerprint()
+    )
+    assert [f["path"] for f in customer_entry["files"]] == [
+        os.path.join(CustomerTable.NAME, "part-0000.parquet"),
+        os.path.join(CustomerTable.NAME, "part-0001.parquet"),
+    ]
+    assert [(f["min_key"], f["max_key"]) for f in customer_entry["files"]] == [
+        (1, 1),
+        (2, 2),
+    ]
+    assert customer_entry["files"][0]["max_updated_at"] == TEST_TIME.isoformat()
+
+    address_file = manifest["tables"][CustomerAddressTable.NAME]["files"][0]
+    assert (address_file["min_parent_key"], address_file["max_parent_key"]) == (1, 1)
+
+    assert warehouse_util.get_stage_row_counts(1, tables) == {
+        CustomerTable.NAME: 2,
+        CustomerAddressTable.NAME: 1,
+    }
+
+
+def test_read_stage_key_range(stage_dir, connection):
+
+    tables = [CustomerTable(), CustomerAddressTable()]
+    extract_write_stage(connection, 1, tables, split_rows=1)
+
+    dataset = warehouse_util.get_stage_dataset(CustomerTable(), 1, 1, (2, 5))
+    customer, customer_address = read_stage(1, tables, key_range=(2, 5))
+
+    assert customer.index.tolist() == [2]
+    assert customer_address.shape[0] == 0
+    assert dataset.files == [
+        os.path.join(
+            str(stage_dir / "batch_id=1"), CustomerTable.NAME, "part-0001.parquet"
+        )
+    ]
+
+
+def test_read_stage_empty_table_from_manifest(stage_dir):
+
+    tables = [CustomerTable()]
+    extract_write_stage(FakeConnection({CustomerTable.NAME: []}), 1, tables)
+
+    (customer,) = read_stage(1, tables)
+
+    assert warehouse_util.get_stage_dataset(CustomerTable(), 1, 1).files == []
+    assert customer.shape[0] == 0
+    assert customer.dtypes.to_dict() == CustomerTable().get_column_pandas_types()
+
+
+def test_read_stage_validates_manifest(stage_dir, connection):
+
+    tables = [CustomerTable()]
+    extract_write_stage(connection, 1, tables)
+    stage_file = warehouse_util.get_stage_file(1, CustomerTable.NAME, 0)
+
+    with open(stage_file, "ab") as f:
+        f.write(b"garbage")
+    with pytest.raises(Exception, match="size does not match"):
+        read_stage(1, tables)
+
+    os.remove(stage_file)
+    with pytest.raises(Exception, match="is missing"):
+        read_stage(1, tables)
+
+    with pytest.raises(Exception, match="has no customer_address data"):
+        read_stage(1, [CustomerAddressTable()])
+
+
+def test_read_stage_batch_range(stage_dir):
+
+    tables = [CustomerTable(), CustomerAddressTable()]
+    updated_customer = (2, "c2 updated") + customer_rows[1][2:]
+    batches = {
+        1: {CustomerTable.NAME: customer_rows, CustomerAddressTable.NAME: []},
+        2: {CustomerTable.NAME: [updated_customer], CustomerAddressTable.NAME: []},
+        3: {CustomerTable.NAME: [], CustomerAddressTable.NAME: customer_address_rows},
+    }
+    for batch_id, rows_by_table in batches.items():
+        extract_write_stage(FakeConnection(rows_by_table), batch_id, tables)
+
+    customer, customer_address = read_stage(1, tables, last_batch_id=3)
+
+    assert sorted(customer.index.tolist()) == [1, 2]
+    assert customer.loc[2, "customer_name"] == "c2 updated"
+    assert customer.loc[2, "batch_id"] == 2
+    assert customer_address.shape[0] == 1
+    assert warehouse_util.get_stage_row_counts(1, tables, last_batch_id=3) == {
+        CustomerTable.NAME: 3,
+        CustomerAddressTable.NAME: 1,
+    }
+
+    # batch 1 is pruned by partition
+    (customer,) = read_stage(2, [CustomerTable()], last_batch_id=5)
+    assert customer.index.tolist() == [2]
+    assert warehouse_util.get_stage_batch_ids(2, 5) == [2, 3]
+
+
+@pytest.mark.parametrize("backend", ["parquet", "ipc", "memory"])
+def test_stage_backends(stage_dir, connection, monkeypatch, backend):
+
+    monkeypatch.setattr(warehouse_util, "_stage_backend", None)
+    warehouse_util.set_stage_backend(backend)
+
+    tables = [CustomerTable(), CustomerAddressTable()]
+    assert not warehouse_util.has_stage_batch(1)
+    extract_write_stage(connection, 1, tables, method="cursor")
+    assert warehouse_util.has_stage_batch(1)
+    assert not warehouse_util.has_stage_batch(2)
+    customer, customer_address = read_stage(1, tables)
+
+    assert customer.shape[0] == 2
+    assert customer.loc[1, "customer_updated_at"] == TEST_TIME
+    assert customer_address.loc[1, "customer_address"].endswith("NY 11229")
+    assert warehouse_util.get_stage_row_counts(1, tables) == {
+        CustomerTable.NAME: 2,
+        CustomerAddressTable.NAME: 1,
+    }
+    (customer,) = read_stage(1, [CustomerTable()], key_range=(2, 2))
+    assert customer.index.tolist() == [2]
+
+    # file backends only
+    assert os.path.exists(warehouse_util.get_batch_dir(1)) == (backend != "memory")
+    if backend == "ipc":
+        assert os.path.exists(
+            warehouse_util.get_stage_file(1, CustomerTable.NAME, suffix=".arrow")
+        )
+
+
+def test_unknown_stage_backend():
+
+    with pytest.raises(Exception, match="Unknown stage backend"):
+        warehouse_util.set_stage_backend("csv")
+
+
+def test_read_stage_schema_fingerprint(stage_dir, connection):
+
+    customer_table = CustomerTable()
+    extract_write_stage(connection, 1, [customer_table])
+    stage_file = warehouse_util.get_stage_file(1, CustomerTable.NAME)
+
+    metadata = pq.read_schema(stage_file).metadata
+    assert metadata[b"schema_fingerprint"] == (
+        customer_table.get_schema_fingerprint().encode()
+    )
+    (customer,) = read_stage(1, [customer_table])
+    assert customer.dtypes.to_dict() == customer_table.get_column_pandas_types()
+
+    # a file written without the fingerprint is converted in full
+    data = pq.read_table(stage_file)
+    os.remove(os.path.join(warehouse_util.get_batch_dir(1), "_manifest.json"))
+    pq.write_table(data.replace_schema_metadata(None), stage_file)
+    dataset = warehouse_util.get_stage_dataset(customer_table, 1, 1)
+    assert not warehouse_util.has_stage_fingerprint(dataset, customer_table)
+    (legacy_customer,) = read_stage(1, [customer_table])
+    pd.testing.assert_frame_equal(legacy_customer, customer)
+
+
+def test_read_stage_storage_hints(stage_dir, connection):
+
+    tables = [CustomerTable(), CustomerAddressTable()]
+    extract_write_stage(connection, 1, tables)
+
+    customer, customer_address = read_stage(1, tables)
+
+    assert isinstance(customer["customer_referral_type"].dtype, pd.CategoricalDtype)
+    assert customer["customer_name"].dtype == "string[pyarrow]"
+    assert customer["customer_is_active"].dtype == "boolean"
+    assert customer_address["customer_address_type"].dtype == "category"
+    assert customer_address["customer_address"].dtype == "string[pyarrow]"
+
+    # the same values as the default types
+    for df, table in zip([customer, customer_address], tables):
+        arrow_table = warehouse_util.read_stage_arrow(1, [table])[0]
+        expected = (
+            arrow_table.to_pandas()
+            .astype(table.get_column_pandas_types(storage=False))
+            .set_index(df.index.name, drop=False)
+        )
+        pd.testing.assert_frame_equal(
+            df.astype(object), expected.astype(object), check_dtype=False
+        )